@@ -3,7 +3,9 @@ import pandas
 from datetime import datetime, timedelta
 import asyncio
 import json
+import time
 from strategy_trading.STUtils.retryDeco import retry
+from strategy_trading.STUtils.ohlcvResampler import KlineArrays, resample
 from datetime import time as dt_time
 
 
@@ -18,6 +20,95 @@ freq_seconds_to_freq = {
 }
 
 
+HUOBI_SPOT_REST_URL = 'https://api.huobi.pro'
+HUOBI_FUTURES_REST_URL = 'https://api.hbdm.com'
+# responses are shared by callers asking for the same url within the ttl, e.g. several KlineBuilders of one symbol
+KLINE_CACHE_TTL_SECONDS = 5.
+HTTP_POOL_SIZE = 20
+
+_http_sessions = {}  # event loop -> its pooled session
+_kline_cache = {}  # url -> (expire monotonic time, data)
+_kline_inflight = {}  # url -> future of a request in progress
+
+
+async def get_http_session() -> aiohttp.ClientSession:
+    # one pooled keep-alive session per event loop, a session cannot be used from another loop
+    loop = asyncio.get_running_loop()
+    session = _http_sessions.get(loop)
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=HTTP_POOL_SIZE, keepalive_timeout=60))
+        _http_sessions[loop] = session
+    return session
+
+
+async def close_http_session():
+    # close the session of the running loop and forget those of loops already closed
+    session = _http_sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
+    for loop in [loop for loop in _http_sessions if loop.is_closed()]:
+        del _http_sessions[loop]
+    _kline_cache.clear()
+
+
+async def _request_kline_data(url):
+    session = await get_http_session()
+    async with session.get(url) as response:
+        resp = await response.text()
+    return json.loads(resp)['data']
+
+
+async def fetch_kline_data(url, ttl_seconds = None) -> list:
+    '''
+    Raw kline dicts of a REST kline url. Concurrent requests of one url share one HTTP request and a response is reused
+    for ttl_seconds (KLINE_CACHE_TTL_SECONDS by default, 0 disables). Callers get their own copies of the dicts.
+    '''
+    if ttl_seconds is None:
+        ttl_seconds = KLINE_CACHE_TTL_SECONDS
+    now = time.monotonic()
+    cached = _kline_cache.get(url)
+    if cached is not None and cached[0] > now:
+        data = cached[1]
+    elif url in _kline_inflight:
+        data = await asyncio.shield(_kline_inflight[url])
+    else:
+        future = asyncio.ensure_future(_request_kline_data(url))
+        _kline_inflight[url] = future
+        try:
+            data = await asyncio.shield(future)
+        finally:
+            _kline_inflight.pop(url, None)
+        if ttl_seconds > 0:
+            _kline_cache[url] = (time.monotonic() + ttl_seconds, data)
+            for expired_url in [cached_url for cached_url, (expire, _) in _kline_cache.items() if expire <= now]:
+                del _kline_cache[expired_url]
+    return [dict(kline) for kline in data]
+
+
+def get_native_freq_seconds(freq_seconds):
+    # the largest native period which freq_seconds is a multiple of, None if there is none
+    if freq_seconds in freq_seconds_to_freq:
+        return freq_seconds
+    native = [tmp_seconds for tmp_seconds in freq_seconds_to_freq if freq_seconds % tmp_seconds == 0]
+    return max(native) if native else None
+
+
+def resample_raw_klines(tmp_data: list, freq_seconds: int, limit: int) -> list:
+    '''
+    Resample raw REST klines ('id' in UTC epoch seconds) into freq_seconds bars, epoch aligned. Keeps the latest limit bars,
+    newest first as the exchange returns them.
+    '''
+    tmp_data = sorted(tmp_data, key=lambda data: data['id'])
+    arrays = KlineArrays([data['id'] * 1000000 for data in tmp_data],
+                         *[[data[column] for data in tmp_data] for column in ('open', 'high', 'low', 'close', 'volume', 'amount', 'count')])
+    resampled = resample(arrays, freq_seconds)
+    klines = resampled.to_dicts()
+    for kline, t in zip(klines, resampled.time.tolist()):
+        kline.pop('time')
+        kline['id'] = t // 1000000
+    return klines[::-1][:limit]
+
+
 def get_next_last_friday_of_one_quarter(curr_time: datetime, _time: dt_time):
     # get friday, one week ago, at 16 o'clock
     last_friday = (curr_time.date() - timedelta(days=curr_time.weekday()) + timedelta(days=4, weeks=-1))
@@ -45,26 +136,26 @@ def get_next_friday(curr_time: datetime, _time: dt_time):
 
 @retry
 async def get_klines(exchange_symbol, freq_seconds, limit = 2000, ret_dataframe = True, timezone = 'HKT'):
-    # freq_seconds to freq
-    assert freq_seconds in freq_seconds_to_freq
-    freq = freq_seconds_to_freq[freq_seconds]
+    # freq_seconds to freq. other multiples of a native freq are resampled from it
+    native_freq_seconds = get_native_freq_seconds(freq_seconds)
+    assert native_freq_seconds is not None
+    freq = freq_seconds_to_freq[native_freq_seconds]
     limit = min(limit, 2000)
     assert limit > 0
+    raw_limit = min(limit * (freq_seconds // native_freq_seconds), 2000)
 
     if exchange_symbol[-3:] in ['_CQ', '_CW', '_NW']: # contract
-        url = 'https://api.hbdm.com/market/history/kline?period=%s&size=%s&symbol=%s' % (freq, limit, exchange_symbol) # use huobi pro REST ipo directly
+        url = '%s/market/history/kline?period=%s&size=%s&symbol=%s' % (HUOBI_FUTURES_REST_URL, freq, raw_limit, exchange_symbol) # use huobi pro REST ipo directly
     else: # spot
-        url = 'https://api.huobi.pro/market/history/kline?period=%s&size=%s&symbol=%s' % (freq, limit, exchange_symbol) # use huobi pro REST ipo directly
+        url = '%s/market/history/kline?period=%s&size=%s&symbol=%s' % (HUOBI_SPOT_REST_URL, freq, raw_limit, exchange_symbol) # use huobi pro REST ipo directly
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as response:
-            resp = await response.text()
-
-    tmp_data = json.loads(resp)['data']
+    tmp_data = await fetch_kline_data(url)
 
     for data in tmp_data:
         data['volume'] = data.pop('amount')
         data['amount'] = data.pop('vol')
+    if native_freq_seconds != freq_seconds:
+        tmp_data = resample_raw_klines(tmp_data, freq_seconds, limit)
 
     if ret_dataframe:
         kline_df = pandas.DataFrame.from_dict(tmp_data)
@@ -85,23 +176,23 @@ async def get_klines(exchange_symbol, freq_seconds, limit = 2000, ret_dataframe
 
 @retry
 async def get_swap_klines(exchange_symbol, freq_seconds, limit = 2000, ret_dataframe = True, timezone = 'HKT'):
-    # freq_seconds to freq
-    assert freq_seconds in freq_seconds_to_freq
-    freq = freq_seconds_to_freq[freq_seconds]
+    # freq_seconds to freq. other multiples of a native freq are resampled from it
+    native_freq_seconds = get_native_freq_seconds(freq_seconds)
+    assert native_freq_seconds is not None
+    freq = freq_seconds_to_freq[native_freq_seconds]
     limit = min(limit, 2000)
     assert limit > 0
+    raw_limit = min(limit * (freq_seconds // native_freq_seconds), 2000)
 
-    url = 'https://api.hbdm.com/swap-ex/market/history/kline?contract_code={}&period={}&size={}'.format(exchange_symbol, freq, limit) # use huobi pro REST ipo directly
-
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as response:
-            resp = await response.text()
+    url = '{}/swap-ex/market/history/kline?contract_code={}&period={}&size={}'.format(HUOBI_FUTURES_REST_URL, exchange_symbol, freq, raw_limit) # use huobi pro REST ipo directly
 
-    tmp_data = json.loads(resp)['data']
+    tmp_data = await fetch_kline_data(url)
 
     for data in tmp_data:
         data['volume'] = data.pop('amount')
         data['amount'] = data.pop('vol')
+    if native_freq_seconds != freq_seconds:
+        tmp_data = resample_raw_klines(tmp_data, freq_seconds, limit)
 
     if ret_dataframe:
         kline_df = pandas.DataFrame.from_dict(tmp_data)
@@ -120,6 +211,21 @@ async def get_swap_klines(exchange_symbol, freq_seconds, limit = 2000, ret_dataf
         return tmp_data
 
 
+async def sync_kline_store(kline_store, exchange, exchange_symbol, freq_seconds, max_bars = 2000) -> int:
+    '''
+    Fetch only the bars missing in kline_store (STUtils.klineStore.KlineStore) for HUOBI_SPOT/HUOBI_SWAP symbols,
+    the latest stored one included, and store them. Returns the number of new bars.
+    '''
+    limit = kline_store.get_missing_bars(exchange, exchange_symbol, freq_seconds, max_bars=max_bars)
+    if exchange == 'HUOBI_SWAP':
+        klines = await get_swap_klines(exchange_symbol, freq_seconds, limit=limit, ret_dataframe=False, timezone='UTC')
+    elif exchange == 'HUOBI_SPOT':
+        klines = await get_klines(exchange_symbol, freq_seconds, limit=limit, ret_dataframe=False, timezone='UTC')
+    else:
+        raise ValueError("{} klines cannot be stored".format(exchange))
+    return kline_store.write(exchange, exchange_symbol, freq_seconds, KlineArrays.from_dicts(klines))
+
+
 async def get_accurate_huobi_fut_klines(global_symbol, freq_seconds, limit = 2000, ret_dataframe = True, timezone = 'HKT'):
     assert timezone in ['HKT', 'UTC']
 
@@ -139,10 +245,9 @@ async def get_accurate_huobi_fut_klines(global_symbol, freq_seconds, limit = 200
     ccy = global_symbol.split('-')[1].split('/')[0]
     cleaned_klines = pandas.DataFrame()
 
-    for contract_type in ['CW', 'NW', 'CQ']:
-        contract = "{}_{}".format(ccy, contract_type)
-        klines = await get_klines(contract, freq_seconds, limit = 2000, ret_dataframe = True, timezone = 'UTC')
-
+    contracts = ["{}_{}".format(ccy, contract_type) for contract_type in ['CW', 'NW', 'CQ']]
+    legs = await asyncio.gather(*[get_klines(contract, freq_seconds, limit = 2000, ret_dataframe = True, timezone = 'UTC') for contract in contracts])
+    for contract, klines in zip(contracts, legs):
         if not klines.empty:
             klines['start_datetime'] = klines.index
             update_global_symbol(klines, contract)
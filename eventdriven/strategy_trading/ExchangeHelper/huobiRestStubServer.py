@@ -0,0 +1,104 @@
+'''
+Local stand-in for the Huobi market history REST endpoints, serving synthetic klines, so huobiRestHelper can be
+exercised offline:
+
+    python -m strategy_trading.ExchangeHelper.huobiRestStubServer
+
+starts the stub, points huobiRestHelper at it and checks pooling, caching and the parallel futures legs.
+'''
+from aiohttp import web
+from datetime import datetime
+import asyncio
+import random
+import time
+
+PERIOD_SECONDS = {'1min': 60, '5min': 300, '15min': 900, '30min': 1800, '60min': 3600, '4hour': 3600 * 4, '1day': 3600 * 24}
+
+
+class HuobiRestStubServer():
+    def __init__(self, host = '127.0.0.1', port = 18080, delay_seconds = 0.):
+        self.host = host
+        self.port = port
+        self.delay_seconds = delay_seconds
+        self.requests = []
+        self.peers = set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._runner = None
+
+    @property
+    def url(self):
+        return "http://{}:{}".format(self.host, self.port)
+
+    def make_klines(self, period, size):
+        freq_seconds = PERIOD_SECONDS[period]
+        last_id = int(time.time()) // freq_seconds * freq_seconds
+        price = 10000.
+        data = []
+        for i in range(size):
+            price += random.gauss(0, 5)
+            high = price + random.random() * 5
+            low = price - random.random() * 5
+            amount = random.random() * 10
+            data.append({'id': last_id - i * freq_seconds, 'open': price, 'close': random.uniform(low, high), 'high': high, 'low': low,
+                         'amount': amount, 'vol': amount * price, 'count': random.randint(1, 100)})
+        return data
+
+    async def handle_kline(self, request: web.Request):
+        self.requests.append(request.path_qs)
+        self.peers.add(request.transport.get_extra_info('peername'))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.delay_seconds:
+                await asyncio.sleep(self.delay_seconds)
+        finally:
+            self.in_flight -= 1
+        period = request.query['period']
+        size = int(request.query.get('size', 150))
+        return web.json_response({'status': 'ok', 'ts': int(time.time() * 1000), 'data': self.make_klines(period, size)})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/market/history/kline', self.handle_kline)
+        app.router.add_get('/swap-ex/market/history/kline', self.handle_kline)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+if __name__ == '__main__':
+    from strategy_trading.ExchangeHelper import huobiRestHelper
+
+    async def main():
+        server = HuobiRestStubServer(delay_seconds=0.2)
+        await server.start()
+        huobiRestHelper.HUOBI_SPOT_REST_URL = server.url
+        huobiRestHelper.HUOBI_FUTURES_REST_URL = server.url
+
+        # several builders of one symbol at the same time: one request
+        results = await asyncio.gather(*[huobiRestHelper.get_klines('btcusdt', 60, limit=10, ret_dataframe=False) for _ in range(5)])
+        assert len(server.requests) == 1 and all(len(klines) == 10 for klines in results)
+        # within the ttl: served from the cache
+        await huobiRestHelper.get_klines('btcusdt', 60, limit=10, ret_dataframe=False)
+        assert len(server.requests) == 1
+        # resampled from 5min
+        klines = await huobiRestHelper.get_swap_klines('BTC-USD', 600, limit=20, ret_dataframe=False)
+        assert len(klines) == 20
+
+        server.max_in_flight = 0
+        start = time.perf_counter()
+        await huobiRestHelper.get_accurate_huobi_fut_klines("FUTU-BTC/USD-{}".format(datetime.utcnow().strftime("%Y%m%d")), 60, limit=100)
+        elapsed = time.perf_counter() - start
+        # CW/NW/CQ requested in parallel
+        assert server.max_in_flight == 3, server.max_in_flight
+        print("requests: {}, connections: {}, futures legs: {:.3f}s".format(len(server.requests), len(server.peers), elapsed))
+
+        await huobiRestHelper.close_http_session()
+        await server.stop()
+
+    asyncio.run(main())
@@ -0,0 +1,74 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from strategy_trading.MACD_SAR_HFT.sell_signal import generate_sell_signal
+
+FEE = 0.0000065
+
+
+def position_path(buy, sell):
+    '''
+    Position after each bar as sar_stra_v3 builds it: starts at buy[0]; then a sell with no position does nothing,
+    a buy without sell adds 1, otherwise sell[i] is subtracted.
+    '''
+    buy = np.asarray(buy)
+    sell = np.asarray(sell).astype(np.int64)
+    n = len(buy)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    position0 = int(buy[0])
+    buy = buy.astype(bool)
+
+    if sell.min() >= 0 and sell.max() <= 1:
+        # one unit sold at most: a running sum floored at 0, i.e. the sum minus its running minimum below 0
+        steps = np.where(buy & (sell == 0), 1, -sell)
+        steps[0] = position0
+        total = np.cumsum(steps)
+        return total - np.minimum(np.minimum.accumulate(total), 0)
+
+    # SAR_agent_v2 sell counts can take the position below 0, where the floor no longer applies
+    position = position0
+    path = [position]
+    for b, s in zip(buy[1:].tolist(), sell[1:].tolist()):
+        if not (position == 0 and s):
+            position += 1 if b and not s else -s
+        path.append(position)
+    return np.array(path, dtype=np.int64)
+
+
+def backtest(close, buy, sell, use_fee=True, fee=FEE):
+    '''
+    Returns (position, cash, equity) arrays: cash is the cumulated trade cash flow, fees taken on both sides,
+    equity the cash plus the position marked at close. As in sar_stra_v3 the position held at the first bar
+    costs nothing; equity[-1] is the value sar_stra_v3 returns.
+    '''
+    close = np.asarray(close, dtype=np.float64)
+    position = position_path(buy, sell)
+    flows = np.zeros(len(close))
+    flows[1:] = -np.diff(position) * close[1:]
+    if use_fee:
+        flows = np.where(flows > 0, flows * (1 - fee), np.where(flows < 0, flows * (1 + fee), flows))
+    # bars with a nan close add nothing to the cash, as pandas cumsum skips them
+    cash = np.cumsum(np.where(np.isnan(flows), 0., flows))
+    cash[np.isnan(flows)] = np.nan
+    return position, cash, position * close + cash
+
+
+def sweep_sar_stra_v3(agent, roll_lengths=(5, ), vol_ratios=(1.25, ), sell_starts=(5, ), profit_coefs=(1.005, ), sell_end=-1, use_fee=True):
+    '''
+    Final value of sar_stra_v3 for every parameter combination, reusing the indicators of one agent
+    (e.g. SAR_agent(time_bar)): entries are computed once per (roll_length, vol_ratio), sell signals once per
+    (sell_start, profit_coef) on top.
+    '''
+    close = agent.time_bar.close.values
+    rows = []
+    for roll_length, vol_ratio in itertools.product(roll_lengths, vol_ratios):
+        buy, _ = agent.generate_signal_in_sar_stra(roll_length=roll_length, vol_ratio=vol_ratio)
+        for sell_start, profit_coef in itertools.product(sell_starts, profit_coefs):
+            sell = generate_sell_signal(agent.time_bar, buy, sell_start=sell_start, sell_end=sell_end, profit_coef=profit_coef)
+            _, _, equity = backtest(close, buy.values, sell.values, use_fee)
+            rows.append({'roll_length': roll_length, 'vol_ratio': vol_ratio, 'sell_start': sell_start, 'profit_coef': profit_coef,
+                         'value': equity[-1] if len(equity) else np.nan})
+    return pd.DataFrame(rows)
@@ -0,0 +1,81 @@
+'''
+Check backtest_kernel against the position loop and fee code of sar_stra_v3, then time a sweep over sell_start and
+profit_coef on synthetic entries:
+
+    python -m strategy_trading.MACD_SAR_HFT.backtest_kernel_benchmark -n 10000 -m 43200
+'''
+from strategy_trading.MACD_SAR_HFT.backtest_kernel import backtest
+from strategy_trading.MACD_SAR_HFT.sell_signal import generate_sell_signal, generate_sell_count_signal
+from strategy_trading.MACD_SAR_HFT.sell_signal_regression import random_bars
+from optparse import OptionParser
+import itertools
+import numpy as np
+import pandas as pd
+import time
+
+
+def legacy_backtest(time_bar, buy, sell, use_fee=True):
+    # position
+    pos_rec = pd.Series(buy.astype(int))
+    for i in range(1, len(pos_rec)):
+        if (pos_rec[i - 1] == 0) and sell[i]:
+            pos_rec[i] = pos_rec[i - 1]
+        else:
+            pos_rec[i] = pos_rec[i - 1] + (1 if buy[i] and not sell[i] else -int(sell[i]))
+
+    a = pos_rec
+
+    # from trading
+    if use_fee:
+        fee = 0.0000065
+
+        c = (-(a.diff()) * time_bar.close)
+        c[c > 0] = c[c > 0] * (1 - fee)
+        c[c < 0] = c[c < 0] * (1 + fee)
+        c = c.cumsum()
+    else:
+        c = (-(a.diff()) * time_bar.close).cumsum()
+
+    b = (a) * time_bar.close  # from holding stock
+
+    return a, b + c
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("-n", type="int", dest="n", default=10000, help="bars compared against the legacy loop")
+    parser.add_option("-m", type="int", dest="m", default=30 * 1440, help="bars of the sweep")
+    (options, args) = parser.parse_args()
+
+    for seed in range(3):
+        time_bar, buy = random_bars(options.n, 0.05, seed)
+        # the legacy loop indexes by position
+        time_bar = time_bar.reset_index(drop=True)
+        buy = buy.reset_index(drop=True)
+        buy.iloc[0] = True
+        for generate in (generate_sell_signal, generate_sell_count_signal):
+            sell = generate(time_bar, buy, sell_start=5, sell_end=-1, profit_coef=1.002)
+            for use_fee in (True, False):
+                start = time.perf_counter()
+                legacy_position, legacy_value = legacy_backtest(time_bar, buy, sell, use_fee)
+                t_legacy = time.perf_counter() - start
+                start = time.perf_counter()
+                position, cash, equity = backtest(time_bar.close.values, buy.values, sell.values, use_fee)
+                t_kernel = time.perf_counter() - start
+                assert np.array_equal(position, legacy_position.values), generate.__name__
+                assert np.array_equal(equity[1:], legacy_value.values[1:]), generate.__name__
+        print("seed {}: identical, legacy {:.3f}s, kernel {:.5f}s".format(seed, t_legacy, t_kernel))
+
+    # entries depend on (roll_length, vol_ratio) through pandas rolling sums computed once per pair;
+    # every (sell_start, profit_coef) then costs one sell search and one backtest
+    time_bar, buy = random_bars(options.m, 0.01, 0)
+    close = time_bar.close.values
+    sell_starts = range(1, 31)
+    profit_coefs = np.linspace(1.001, 1.02, 40)
+    start = time.perf_counter()
+    values = []
+    for sell_start, profit_coef in itertools.product(sell_starts, profit_coefs):
+        sell = generate_sell_signal(time_bar, buy, sell_start=sell_start, sell_end=-1, profit_coef=profit_coef)
+        values.append(backtest(close, buy.values, sell.values)[2][-1])
+    elapsed = time.perf_counter() - start
+    print("{} backtests on {} bars: {:.2f}s, {:.0f} per minute".format(len(values), options.m, elapsed, len(values) / elapsed * 60))
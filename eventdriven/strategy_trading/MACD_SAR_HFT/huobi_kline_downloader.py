@@ -0,0 +1,233 @@
+import asyncio
+import gzip
+import json
+import logging
+import time
+from datetime import datetime
+
+import aiohttp
+import numpy as np
+import pandas as pd
+
+PERIOD_SECONDS = {'1min': 60, '5min': 300, '15min': 900, '30min': 1800, '60min': 3600, '4hour': 14400, '1day': 86400}
+PAGE_SIZE = 300
+COLUMNS = ('open', 'high', 'low', 'close', 'vol')
+
+logger = logging.getLogger('HuobiKlineDownloader')
+
+
+def get_ws_address(symbol, is_fr=False):
+    # websocket address and the name used in column names, as Huobi_kline picks them
+    if symbol[-2:] in {'CW', 'CQ', 'NW', 'NQ'}:
+        return 'wss://api.hbdm.vn/ws', ''.join(symbol.split('_'))
+    elif symbol[-3:] == 'USD':
+        return ('wss://api.hbdm.vn/ws_index' if is_fr else 'wss://api.hbdm.vn/swap-ws'), symbol
+    elif symbol[-4:] == 'USDT':
+        return ('wss://api.hbdm.vn/ws_index' if is_fr else 'wss://api.hbdm.vn/linear-swap-ws'), symbol
+    return "wss://api-aws.huobi.pro/ws", symbol
+
+
+def get_time_range(period, start_time=None, end_time=None):
+    time_interval = PERIOD_SECONDS[period]
+    if end_time is None:
+        end_time = int(datetime.timestamp(datetime.now()))
+        end_time -= end_time % time_interval
+    if start_time is None:
+        start_time = end_time - (PAGE_SIZE - 1) * time_interval
+    return start_time, end_time
+
+
+class RateLimiter:
+    # at most rate_per_second acquisitions in any one second window, shared by every connection
+    def __init__(self, rate_per_second):
+        self.interval = 1. / rate_per_second
+        self.next_time = 0.
+
+    async def acquire(self):
+        now = time.monotonic()
+        wait = self.next_time - now
+        self.next_time = max(now, self.next_time) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class HuobiKlineConnection:
+    '''
+    One websocket connection carrying many kline requests at once. Responses are matched to requests by id,
+    pings are answered by the reader task.
+    '''
+    def __init__(self, url, session, rate_limiter, max_in_flight=10, timeout=10.):
+        self.url = url
+        self.session = session
+        self.rate_limiter = rate_limiter
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+        self.timeout = timeout
+        self.ws = None
+        self._pending = {}
+        self._next_id = 0
+        self._reader = None
+
+    async def connect(self):
+        self.ws = await self.session.ws_connect(self.url)
+        self._reader = asyncio.ensure_future(self._read())
+
+    async def _read(self):
+        try:
+            async for msg in self.ws:
+                if msg.type == aiohttp.WSMsgType.BINARY:
+                    result = json.loads(gzip.decompress(msg.data))
+                elif msg.type == aiohttp.WSMsgType.TEXT:
+                    result = json.loads(msg.data)
+                else:
+                    break
+                if 'ping' in result:
+                    await self.ws.send_str(json.dumps({'pong': result['ping']}))
+                    continue
+                future = self._pending.pop(result.get('id'), None)
+                if future is not None and not future.done():
+                    future.set_result(result)
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError('connection to {} closed'.format(self.url)))
+            self._pending.clear()
+
+    async def request(self, topic, from_ts, to_ts, retry=3):
+        for attempt in range(retry):
+            async with self.semaphore:
+                await self.rate_limiter.acquire()
+                self._next_id += 1
+                request_id = str(self._next_id)
+                future = asyncio.get_running_loop().create_future()
+                self._pending[request_id] = future
+                await self.ws.send_str(json.dumps({'req': topic, 'id': request_id, 'from': from_ts, 'to': to_ts}))
+                try:
+                    result = await asyncio.wait_for(future, self.timeout)
+                except asyncio.TimeoutError:
+                    self._pending.pop(request_id, None)
+                    logger.warning('{} {}-{} timeout, retry...'.format(topic, from_ts, to_ts))
+                    continue
+            if result.get('status') != 'ok':
+                raise Exception('Got nothing. There may be some problems in symbol or start/end timestamp. {}'.format(result))
+            return result.get('data') or []
+        raise Exception('{} {}-{} failed after {} tries'.format(topic, from_ts, to_ts, retry))
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+        if self._reader is not None:
+            await self._reader
+
+
+class HuobiKlineDownloader:
+    '''
+    Pipelines the 300-bar page requests of a time range, and of many symbols, within one shared rate limit.
+    Symbols on the same websocket address share one connection. Pages are written straight into preallocated arrays.
+    ws_url overrides every address, e.g. to point at huobi_ws_mock_server.
+    '''
+    def __init__(self, rate_per_second=10, max_in_flight=10, timeout=10., ws_url=None):
+        self.rate_limiter = RateLimiter(rate_per_second)
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.ws_url = ws_url
+        self.session = None
+        self.connections = {}
+        self._connecting = {}
+
+    async def _get_connection(self, url):
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+        if url not in self.connections:
+            if url not in self._connecting:
+                connection = HuobiKlineConnection(url, self.session, self.rate_limiter, self.max_in_flight, self.timeout)
+                self._connecting[url] = asyncio.ensure_future(connection.connect())
+                await self._connecting[url]
+                self.connections[url] = connection
+            else:
+                await self._connecting[url]
+        return self.connections[url]
+
+    async def download(self, symbol, period='1min', start_time=None, end_time=None, is_fr=False):
+        '''
+        Returns {'id': int64 seconds, 'open'/'high'/'low'/'close'/'vol': float64} of the bars in [start_time, end_time].
+        '''
+        time_interval = PERIOD_SECONDS[period]
+        start_time, end_time = get_time_range(period, start_time, end_time)
+        url, _ = get_ws_address(symbol, is_fr)
+        connection = await self._get_connection(self.ws_url or url)
+        topic = "market.{}.{}.{}".format(symbol, 'estimated_rate' if is_fr else 'kline', period)
+
+        size = max(0, (end_time - start_time) // time_interval + 1)
+        arrays = {column: np.full(size, np.nan) for column in COLUMNS}
+        filled = np.zeros(size, dtype=bool)
+
+        async def fetch_page(page_end):
+            page_start = max(start_time, page_end - (PAGE_SIZE - 1) * time_interval)
+            data = await connection.request(topic, page_start, page_end)
+            if not data:
+                return
+            ids = np.fromiter((bar['id'] for bar in data), dtype=np.int64, count=len(data))
+            index = (ids - start_time) // time_interval
+            valid = (index >= 0) & (index < size)
+            index = index[valid]
+            for column in COLUMNS:
+                values = np.fromiter((bar.get(column, np.nan) for bar in data), dtype=np.float64, count=len(data))
+                arrays[column][index] = values[valid]
+            filled[index] = True
+
+        page_ends = range(end_time, start_time - 1, -PAGE_SIZE * time_interval)
+        await asyncio.gather(*[fetch_page(page_end) for page_end in page_ends])
+
+        result = {column: values[filled] for column, values in arrays.items()}
+        result['id'] = (start_time + np.arange(size, dtype=np.int64) * time_interval)[filled]
+        return result
+
+    async def download_many(self, symbols, period='1min', start_time=None, end_time=None, is_fr=False):
+        results = await asyncio.gather(*[self.download(symbol, period, start_time, end_time, is_fr) for symbol in symbols])
+        return dict(zip(symbols, results))
+
+    async def close(self):
+        for connection in self.connections.values():
+            await connection.close()
+        self.connections.clear()
+        self._connecting.clear()
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+def to_dataframe(arrays, symbol, is_fr=False, get_full_market_data=False, adjust_time=True, col_with_asset_name=False):
+    # the DataFrame Huobi_kline returns for the same arguments
+    _, symbol_name = get_ws_address(symbol, is_fr)
+    prefix = ('hbfr' if is_fr else 'hb') + symbol_name + '_'
+    result_data = pd.DataFrame({'datetime': arrays['id']})
+    if get_full_market_data:
+        for column, name in (('open', 'open'), ('high', 'high'), ('low', 'low'), ('close', 'close'), ('vol', 'volume')):
+            result_data[prefix + name] = arrays[column]
+    else:
+        result_data[prefix + 'close'] = arrays['close']
+    if adjust_time:
+        result_data['datetime'] = pd.to_datetime(result_data['datetime'] + 28800, unit='s')
+    if col_with_asset_name:
+        return result_data
+    result_data.rename(columns={column: column.split("_")[-1] for column in result_data.columns}, inplace=True)
+    result_data['adj_close'] = result_data['close']
+    return result_data
+
+
+async def download_klines_async(symbols, period='1min', start_time=None, end_time=None, is_fr=False, get_full_market_data=False,
+                                adjust_time=True, col_with_asset_name=False, rate_per_second=10, ws_url=None):
+    downloader = HuobiKlineDownloader(rate_per_second=rate_per_second, ws_url=ws_url)
+    try:
+        results = await downloader.download_many(symbols, period, start_time, end_time, is_fr)
+    finally:
+        await downloader.close()
+    return {symbol: to_dataframe(arrays, symbol, is_fr, get_full_market_data, adjust_time, col_with_asset_name) for symbol, arrays in results.items()}
+
+
+def download_klines(symbols, period='1min', start_time=None, end_time=None, **kwargs):
+    '''
+    Blocking entry for research scripts: {symbol: DataFrame as Huobi_kline returns it}, all symbols fetched concurrently.
+    e.g. download_klines(['BTC_CW', 'BTC_NW', 'BTC_CQ', 'BTC_NQ'], '1min', start_time=..., get_full_market_data=True)
+    '''
+    return asyncio.run(download_klines_async(symbols, period, start_time, end_time, **kwargs))
@@ -0,0 +1,129 @@
+'''
+Local stand-in for the Huobi market websocket: answers kline "req" messages with gzipped synthetic bars and pings
+its clients, so huobi_kline_downloader can be exercised offline:
+
+    python -m strategy_trading.MACD_SAR_HFT.huobi_ws_mock_server
+
+starts the mock, downloads several contracts through one connection and checks pipelining and the returned bars.
+'''
+from aiohttp import web
+import asyncio
+import gzip
+import json
+import time
+
+PERIOD_SECONDS = {'1min': 60, '5min': 300, '15min': 900, '30min': 1800, '60min': 3600, '4hour': 14400, '1day': 86400}
+
+
+def synthetic_bar(symbol, bar_id):
+    # deterministic in (symbol, id), so the client side can check what it got
+    base = 1000. + sum(map(ord, symbol)) + (bar_id // 60) % 1000
+    return {'id': bar_id, 'open': base, 'high': base + 2., 'low': base - 2., 'close': base + 1., 'amount': 1., 'vol': base, 'count': 1}
+
+
+class HuobiWsMockServer():
+    def __init__(self, host = '127.0.0.1', port = 18081, delay_seconds = 0., ping_interval = 1.):
+        self.host = host
+        self.port = port
+        self.delay_seconds = delay_seconds
+        self.ping_interval = ping_interval
+        self.requests = []
+        self.connections = 0
+        self.pongs = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._runner = None
+
+    @property
+    def url(self):
+        return "ws://{}:{}/ws".format(self.host, self.port)
+
+    async def _send(self, ws, message):
+        await ws.send_bytes(gzip.compress(json.dumps(message).encode('utf-8')))
+
+    async def _reply(self, ws, request):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.delay_seconds:
+                await asyncio.sleep(self.delay_seconds)
+        finally:
+            self.in_flight -= 1
+        _, symbol, _, period = request['req'].split('.')
+        freq_seconds = PERIOD_SECONDS[period]
+        first_id = -(-request['from'] // freq_seconds) * freq_seconds
+        data = [synthetic_bar(symbol, bar_id) for bar_id in range(first_id, request['to'] + 1, freq_seconds)]
+        await self._send(ws, {'rep': request['req'], 'status': 'ok', 'id': request['id'], 'tick': None, 'data': data})
+
+    async def _ping(self, ws):
+        while not ws.closed:
+            await self._send(ws, {'ping': int(time.time() * 1000)})
+            await asyncio.sleep(self.ping_interval)
+
+    async def handle_ws(self, request: web.Request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.connections += 1
+        pinger = asyncio.ensure_future(self._ping(ws))
+        replies = set()
+        try:
+            async for msg in ws:
+                if msg.type != web.WSMsgType.TEXT:
+                    continue
+                message = json.loads(msg.data)
+                if 'pong' in message:
+                    self.pongs += 1
+                elif 'req' in message:
+                    self.requests.append(message)
+                    reply = asyncio.ensure_future(self._reply(ws, message))
+                    replies.add(reply)
+                    reply.add_done_callback(replies.discard)
+        finally:
+            pinger.cancel()
+            for reply in list(replies):
+                reply.cancel()
+        return ws
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/ws', self.handle_ws)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+if __name__ == '__main__':
+    from strategy_trading.MACD_SAR_HFT.huobi_kline_downloader import download_klines_async, PAGE_SIZE
+
+    async def main():
+        server = HuobiWsMockServer(delay_seconds=0.2, ping_interval=0.1)
+        await server.start()
+
+        symbols = ['BTC_CW', 'BTC_NW', 'BTC_CQ', 'BTC_NQ']
+        end_time = 1600000000 // 60 * 60
+        start_time = end_time - 60 * (PAGE_SIZE * 5 - 1)
+        start = time.perf_counter()
+        results = await download_klines_async(symbols, '1min', start_time, end_time, get_full_market_data=True, adjust_time=False,
+                                              rate_per_second=100, ws_url=server.url)
+        elapsed = time.perf_counter() - start
+
+        # 4 symbols x 5 pages over one connection, pipelined rather than one page per round trip
+        assert len(server.requests) == 20 and server.connections == 1
+        assert server.max_in_flight > 1, server.max_in_flight
+        assert server.pongs > 0
+        for symbol, df in results.items():
+            assert list(df.columns) == ['datetime', 'open', 'high', 'low', 'close', 'volume', 'adj_close']
+            assert len(df) == PAGE_SIZE * 5 and df['datetime'].is_monotonic_increasing
+            assert df['datetime'].iloc[0] == start_time and df['datetime'].iloc[-1] == end_time
+            expected = [synthetic_bar(symbol, bar_id)['close'] for bar_id in df['datetime']]
+            assert df['close'].tolist() == expected, symbol
+        print("requests: {}, connections: {}, max in flight: {}, pongs: {}, {:.3f}s".format(
+            len(server.requests), server.connections, server.max_in_flight, server.pongs, elapsed))
+
+        await server.stop()
+
+    asyncio.run(main())
@@ -16,6 +16,8 @@ from strategy_trading.easy_strategy.strategy_base import StrategyImplBase
 from strategy_trading.easy_strategy.datafeed import FullLevelOrderBook, FixedLevelOrderBook, Trade, Kline, Ticker, IndexTicker
 from strategy_trading.easy_strategy.order import Order
 from strategy_trading.easy_strategy.data_type import Side, OrderType, PositionEffect
+from strategy_trading.MACD_SAR_HFT.sell_signal import generate_sell_signal
+from strategy_trading.MACD_SAR_HFT.backtest_kernel import backtest
 
 class SAR_agent:
     def __init__(self, time_bar,
@@ -61,68 +63,15 @@ def sar_stra_v3(time_bar, agent=SAR_agent, print_fig=False, use_fee=True):
 
     buy, sell = agent.generate_signal_in_sar_stra(vol_ratio=1.25)
 
-    def generate_sell_signal(df_input, buy_signal, sell_start=10, sell_end=60, profit_coef=1.005):
-        df = df_input.copy()
-        df['buy'] = buy_signal
-        # init a sell-price vector
-        df = df.apply(func=lambda x: x['close'] * profit_coef if x['buy'] else np.nan, axis=1)
-
-        # generate a sell-price table with a drift
-        df = pd.DataFrame(np.diag(df), columns=df.index)
-        df = df.drop(df.index[df.sum() == 0], axis=0).replace(0, np.nan)
-
-        if sell_end == -1:
-            df = df.apply(func=lambda x: x.ffill(axis=0, inplace=False), axis=1)
-        else:
-            df = df.apply(func=lambda x: x.ffill(axis=0, inplace=False, limit=(sell_end - sell_start)), axis=1)
-        df = df.shift(periods=sell_start, axis=1).fillna(0)
-
-        def transform(row):
-            p = ((row > 0) & (row <= df_input.close)).astype(int)
-            if sum(p) > 0:
-                return row[p == 1].index[0]
-            elif sum(row != 0) > 0:
-                return row[row != 0].index[-1]
-            else:
-                return row.index[-1]
-
-        sell_loc = df.apply(func=transform, axis=1).values
-        sell = pd.Series(data=0, index=df_input.index)
-        sell.loc[sell_loc] = 1
-
-        return sell
-
     sell = generate_sell_signal(time_bar, buy, sell_start=5, sell_end=-1, profit_coef=1.005)
 
-    # position
-    pos_rec = pd.Series(buy.astype(int))
-    for i in range(1, len(pos_rec)):
-        if (pos_rec[i - 1] == 0) and sell[i]:
-            pos_rec[i] = pos_rec[i - 1]
-        else:
-            pos_rec[i] = pos_rec[i - 1] + (1 if buy[i] and not sell[i] else -int(sell[i]))
-
-    a = pos_rec
+    position, cash, equity = backtest(time_bar.close.values, buy.values, sell.values, use_fee)
+    a = pd.Series(position, index=time_bar.index)
 
     real_buy = a.diff() > 0
     real_sell = a.diff() < 0
 
-    # from trading
-    if use_fee:
-        fee = 0.0000065
-
-        c = (-(a.diff()) * time_bar.close)
-        c[c > 0] = c[c > 0] * (1 - fee)
-        c[c < 0] = c[c < 0] * (1 + fee)
-        # print(c[c > 0])
-        # print(c[c < 0])
-        c = c.cumsum()
-    else:
-        c = (-(a.diff()) * time_bar.close).cumsum()
-
-    b = (a) * time_bar.close  # from holding stock
-
-    value = (b + c)
+    value = pd.Series(equity, index=time_bar.index)
 
     #     if print_fig:
     #         fig = agent.print_stat(real_buy, real_sell)
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+
+def get_sell_locations(close, buy, sell_start=10, sell_end=60, profit_coef=1.005):
+    '''
+    Bar position each buy sells at: the first bar in [i + sell_start, i + sell_end] (to the last bar if sell_end is -1)
+    whose close reaches close[i] * profit_coef, else the end of that window, clipped to the last bar.
+    Buys at a nan or zero close are skipped, as the np.diag table dropped them.
+
+    The first hit of every buy is searched at once by binary lifting over a table of range maxima,
+    O(n log n) time and memory instead of an n x n table.
+    '''
+    close = np.asarray(close, dtype=np.float64)
+    n = len(close)
+    buy_index = np.flatnonzero(np.asarray(buy, dtype=bool))
+    targets = close[buy_index] * profit_coef
+    valid = ~np.isnan(targets) & (targets != 0)
+    buy_index = buy_index[valid]
+    targets = targets[valid]
+    if len(buy_index) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    lo = buy_index + sell_start
+    if sell_end == -1:
+        hi = np.full(len(lo), n - 1)
+    else:
+        if sell_end <= sell_start:
+            raise ValueError('sell_end must be greater than sell_start')
+        hi = np.minimum(lo + (sell_end - sell_start), n - 1)
+
+    # levels[k][p] = max(close[p: p + 2 ** k]), nan never reaches a target
+    levels = [np.where(np.isnan(close), -np.inf, close)]
+    while 2 ** len(levels) <= n:
+        step = 2 ** (len(levels) - 1)
+        levels.append(np.maximum(levels[-1][:-step], levels[-1][step:]))
+
+    # skip the longest run of bars from lo that all stay below the target
+    pos = lo.copy()
+    for k in range(len(levels) - 1, -1, -1):
+        size = 2 ** k
+        fits = pos + size <= n
+        block_max = levels[k][np.where(fits, pos, 0)]
+        pos += (fits & (block_max < targets)) * size
+
+    hit = (pos <= hi) & (targets > 0)
+    return np.where(hit, pos, hi)
+
+
+def generate_sell_signal(df_input, buy_signal, sell_start=10, sell_end=60, profit_coef=1.005):
+    # as in sar_stra_v3: 1 at every bar some buy sells at
+    buy = buy_signal.reindex(df_input.index) if isinstance(buy_signal, pd.Series) else buy_signal
+    sell = np.zeros(len(df_input), dtype=np.int64)
+    sell[get_sell_locations(df_input.close.values, buy, sell_start, sell_end, profit_coef)] = 1
+    return pd.Series(sell, index=df_input.index)
+
+
+def generate_sell_count_signal(df_input, buy_signal, sell_start=10, sell_end=60, profit_coef=1.005):
+    # as in SAR_agent_v2: number of buys selling at each bar, nothing at the last bar
+    buy = buy_signal.reindex(df_input.index) if isinstance(buy_signal, pd.Series) else buy_signal
+    sell = np.bincount(get_sell_locations(df_input.close.values, buy, sell_start, sell_end, profit_coef), minlength=len(df_input))
+    if len(sell):
+        sell[-1] = 0
+    return pd.Series(sell.astype(np.int64), index=df_input.index)
@@ -0,0 +1,103 @@
+'''
+Check sell_signal against the np.diag implementations it replaced in sar_stra_v3 and SAR_agent_v2, on random walks:
+
+    python -m strategy_trading.MACD_SAR_HFT.sell_signal_regression -n 2000
+
+then time the new search alone on months of 1min bars.
+'''
+from strategy_trading.MACD_SAR_HFT.sell_signal import generate_sell_signal, generate_sell_count_signal
+from optparse import OptionParser
+import numpy as np
+import pandas as pd
+import time
+
+
+def _legacy_sell_loc(df_input, buy_signal, sell_start, sell_end, profit_coef):
+    df = df_input.copy()
+    df['buy'] = buy_signal
+    # init a sell-price vector
+    df = df.apply(func=lambda x: x['close'] * profit_coef if x['buy'] else np.nan, axis=1)
+
+    # generate a sell-price table with a drift
+    df = pd.DataFrame(np.diag(df), columns=df.index)
+    df = df.drop(df.index[df.sum() == 0], axis=0).replace(0, np.nan)
+
+    if sell_end == -1:
+        df = df.apply(func=lambda x: x.ffill(axis=0, inplace=False), axis=1)
+    else:
+        df = df.apply(func=lambda x: x.ffill(axis=0, inplace=False, limit=(sell_end - sell_start)), axis=1)
+    df = df.shift(periods=sell_start, axis=1).fillna(0)
+
+    def transform(row):
+        p = ((row > 0) & (row <= df_input.close)).astype(int)
+        if sum(p) > 0:
+            return row[p == 1].index[0]
+        elif sum(row != 0) > 0:
+            return row[row != 0].index[-1]
+        else:
+            return row.index[-1]
+
+    return df.apply(func=transform, axis=1).values
+
+
+def legacy_sell_signal(df_input, buy_signal, sell_start=10, sell_end=60, profit_coef=1.005):
+    # sar_stra_v3.generate_sell_signal
+    sell_loc = _legacy_sell_loc(df_input, buy_signal, sell_start, sell_end, profit_coef)
+    sell = pd.Series(data=0, index=df_input.index)
+    sell.loc[sell_loc] = 1
+    return sell
+
+
+def legacy_sell_count_signal(df_input, buy_signal, sell_start=10, sell_end=60, profit_coef=1.005):
+    # SAR_agent_v2.generate_sell_signal
+    sell_loc = _legacy_sell_loc(df_input, buy_signal, sell_start, sell_end, profit_coef)
+    sell_loc = sell_loc[sell_loc != df_input.index[-1]]
+    if sell_loc.size > 0:
+        sell = pd.Series(data=1, index=sell_loc).groupby(level=0).sum()
+        sell = sell.reindex(df_input.index, fill_value=0)
+    else:
+        sell = pd.Series(data=0, index=df_input.index)
+    return sell
+
+
+def random_bars(n, buy_ratio, seed):
+    rng = np.random.default_rng(seed)
+    close = 3000. * np.exp(np.cumsum(rng.normal(0, 0.002, n)))
+    index = pd.date_range('2021-01-01', periods=n, freq='min')
+    time_bar = pd.DataFrame({'datetime': index, 'close': close, 'volume': rng.random(n)}, index=index)
+    buy = pd.Series(rng.random(n) < buy_ratio, index=index)
+    return time_bar, buy
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("-n", type="int", dest="n", default=2000, help="bars compared against the legacy implementation")
+    parser.add_option("-m", type="int", dest="m", default=3 * 30 * 1440, help="bars timed for the new implementation alone")
+    (options, args) = parser.parse_args()
+
+    cases = 0
+    for seed in range(3):
+        for buy_ratio in (0.02, 0.2):
+            time_bar, buy = random_bars(options.n, buy_ratio, seed)
+            # a buy at the first and the last bar hits both window edges
+            buy.iloc[0] = buy.iloc[-1] = True
+            for sell_start, sell_end, profit_coef in [(5, -1, 1.005), (10, 60, 1.005), (5, -1, 1.001), (0, 30, 1.002), (3, 4, 1.0)]:
+                args = (time_bar, buy, sell_start, sell_end, profit_coef)
+                pd.testing.assert_series_equal(generate_sell_signal(*args), legacy_sell_signal(*args), check_names=False)
+                pd.testing.assert_series_equal(generate_sell_count_signal(*args), legacy_sell_count_signal(*args), check_names=False)
+                cases += 1
+    print("{} cases identical on {} bars".format(cases, options.n))
+
+    time_bar, buy = random_bars(options.n, 0.05, 0)
+    start = time.perf_counter()
+    legacy_sell_signal(time_bar, buy, 5, -1, 1.005)
+    t_legacy = time.perf_counter() - start
+    start = time.perf_counter()
+    generate_sell_signal(time_bar, buy, 5, -1, 1.005)
+    t_new = time.perf_counter() - start
+    print("{} bars: np.diag {:.3f}s, sell_signal {:.4f}s".format(options.n, t_legacy, t_new))
+
+    time_bar, buy = random_bars(options.m, 0.05, 0)
+    start = time.perf_counter()
+    generate_sell_signal(time_bar, buy, 5, -1, 1.005)
+    print("{} bars: sell_signal {:.4f}s".format(options.m, time.perf_counter() - start))
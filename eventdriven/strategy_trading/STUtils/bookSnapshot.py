@@ -0,0 +1,106 @@
+from itertools import islice
+import numpy as np
+
+
+class _SideLevels():
+    def __init__(self, levels: int):
+        self.prices = np.full(levels, np.nan)
+        self.sizes = np.zeros(levels)
+        self.cum_sizes = np.zeros(levels)
+        self.cum_notional = np.zeros(levels)
+        self.depth = 0
+        self._cached = []  # (price, size) as seen in the book at the last refresh
+
+    def refresh(self, book_levels, levels: int):
+        cached = self._cached
+        old_depth = self.depth
+        first_changed = None
+        new_levels = []
+        depth = 0
+        for level in islice(book_levels, levels):
+            price, size = level[0], level[1]
+            if first_changed is None and (depth >= old_depth or cached[depth][0] != price or cached[depth][1] != size):
+                first_changed = depth
+            if first_changed is not None:
+                new_levels.append((price, size))
+            depth += 1
+        if first_changed is None:
+            if depth == old_depth:
+                return
+            # the book got shallower, the remaining levels are unchanged
+            first_changed = depth
+
+        # only rewrite the levels from the first changed one. cumulative columns are rebuilt from there
+        del cached[first_changed:]
+        cached.extend(new_levels)
+        end = first_changed + len(new_levels)
+        if new_levels:
+            self.prices[first_changed:end] = [float(level[0]) for level in new_levels]
+            self.sizes[first_changed:end] = [float(level[1]) for level in new_levels]
+            np.cumsum(self.sizes[first_changed:end], out=self.cum_sizes[first_changed:end])
+            np.cumsum(self.prices[first_changed:end] * self.sizes[first_changed:end], out=self.cum_notional[first_changed:end])
+            if first_changed > 0:
+                self.cum_sizes[first_changed:end] += self.cum_sizes[first_changed - 1]
+                self.cum_notional[first_changed:end] += self.cum_notional[first_changed - 1]
+        self.prices[end:old_depth] = np.nan
+        self.sizes[end:old_depth] = 0
+        self.cum_sizes[end:old_depth] = 0
+        self.cum_notional[end:old_depth] = 0
+        self.depth = depth
+
+
+class TopLevelSnapshot():
+    '''
+    float64 columns (prices, sizes, cum_sizes, cum_notional) of the top N levels per side.
+    The arrays are allocated once and updated in place by refresh(), which only rewrites the levels from
+    the first one that differs from the previous refresh. Levels beyond the book depth are nan/0.
+    Finding that level still compares the top N levels with the previous refresh, O(N) per call.
+    '''
+    def __init__(self, levels: int):
+        assert isinstance(levels, int) and levels > 0
+        self.levels = levels
+        self.bid = _SideLevels(levels)
+        self.ask = _SideLevels(levels)
+
+    def refresh(self, bids, asks):
+        self.bid.refresh(bids, self.levels)
+        self.ask.refresh(asks, self.levels)
+        return self
+
+    def imbalance(self, levels: int = None):
+        levels = self.levels if levels is None else levels
+        bid_size = self.bid.cum_sizes[min(levels, self.bid.depth) - 1] if self.bid.depth else 0.
+        ask_size = self.ask.cum_sizes[min(levels, self.ask.depth) - 1] if self.ask.depth else 0.
+        if bid_size + ask_size == 0:
+            return 0.
+        return (bid_size - ask_size) / (bid_size + ask_size)
+
+    def weighted_sizes(self, weights):
+        # weights beyond the snapshot levels are ignored
+        weights = np.asarray(weights, dtype=float)[:self.levels]
+        n = len(weights)
+        return float(np.dot(weights, self.bid.sizes[:n])), float(np.dot(weights, self.ask.sizes[:n]))
+
+    def vwap_to_size(self, is_bid: bool, size: float):
+        # average price of taking `size` from the given side. None if the snapshot is not deep enough or size < 0,
+        # the touch price for size 0
+        side = self.bid if is_bid else self.ask
+        depth = side.depth
+        if size <= 0:
+            return float(side.prices[0]) if size == 0 and depth else None
+        i = int(np.searchsorted(side.cum_sizes[:depth], size))
+        if i >= depth:
+            return None
+        prev_size = side.cum_sizes[i - 1] if i > 0 else 0.
+        prev_notional = side.cum_notional[i - 1] if i > 0 else 0.
+        return (prev_notional + (size - prev_size) * side.prices[i]) / size
+
+
+if __name__ == '__main__':
+    snapshot = TopLevelSnapshot(3).refresh([[100, 1], [99, 2], [98, 3], [97, 4]], [[101, 1], [102, 2]])
+    assert snapshot.weighted_sizes([1., .5]) == (2., 2.)
+    # more weights than levels, and more levels than the book has on the ask side
+    assert snapshot.weighted_sizes([1., .5, .25, .125, .0625]) == (2.75, 2.)
+    assert snapshot.vwap_to_size(True, 3) == (100 + 99 * 2) / 3 and snapshot.vwap_to_size(False, 4) is None
+    assert snapshot.vwap_to_size(False, 0) == 101 and snapshot.vwap_to_size(True, -1) is None
+    print("weighted sizes and vwap ok")
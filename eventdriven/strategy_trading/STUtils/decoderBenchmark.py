@@ -0,0 +1,60 @@
+'''
+Compare frame decoders of BaseWebsocketClient on recorded gateway frames (one json frame per line).
+
+    python -m strategy_trading.STUtils.decoderBenchmark -f md_frames.jsonl
+
+Without -f, a synthetic 150-level DEPTH frame is used.
+'''
+from strategy_trading.STUtils.wssClient import get_json_decoder, orjson
+from optparse import OptionParser
+import json
+import time
+
+
+def synthetic_frames(n = 2000, book_level = 150):
+    frames = []
+    for seq in range(n):
+        frames.append(json.dumps({
+            'symbol': 'btcusdt', 'dataType': 'DEPTH', 'seq': seq, 'exchTimestamp': 1600000000000 + seq,
+            'correlationID': "{}|{}".format(1600000000000000 + seq, seq),
+            'bids': [[10000 - i * 0.01, 0.1234 + i] for i in range(book_level)],
+            'asks': [[10000.01 + i * 0.01, 0.4321 + i] for i in range(book_level)]
+        }).encode('utf-8'))
+    return frames
+
+
+def legacy_decoder(data: bytes):
+    # what BaseWebsocketClient did before: decode to str, then stdlib json
+    return json.loads(data.decode('utf-8'))
+
+
+def run(decoder, frames, rounds = 5):
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for frame in frames:
+            decoder(frame)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("-f", type="string", dest="file", default=None, help="recorded frames (json lines)")
+    (options, args) = parser.parse_args()
+
+    if options.file:
+        with open(options.file, 'rb') as f:
+            frames = [line.strip() for line in f if line.strip()]
+    else:
+        frames = synthetic_frames()
+
+    decoders = [('json(str)', legacy_decoder),
+                ('json(bytes)', json.loads),
+                ('json(Decimal)', get_json_decoder(use_decimal=True))]
+    if orjson is not None:
+        decoders.append(('orjson', orjson.loads))
+    for name, decoder in decoders:
+        elapsed = run(decoder, frames)
+        print("{:<14} {:>8.2f}us/frame".format(name, elapsed / len(frames) * 1e6))
@@ -0,0 +1,102 @@
+import logging
+import json
+import time
+from enum import Enum
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(obj):
+    # Decimal, datetime, CorrelationID, ClientOrder ...
+    if isinstance(obj, Enum):
+        return obj.name
+    return str(obj)
+
+
+def dumps_event(fields: dict) -> str:
+    if orjson is not None:
+        return orjson.dumps(fields, default=_default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    return json.dumps(fields, default=_default, separators=(',', ':'))
+
+
+class _Event():
+    '''
+    Log record msg rendered only when a handler formats it, i.e. after level filtering, and possibly in the
+    handler thread. Fields must therefore not be mutated after the event is logged.
+    '''
+    __slots__ = ('category', 'fields')
+
+    def __init__(self, category, fields):
+        self.category = category
+        self.fields = fields
+
+    def __str__(self):
+        return "{} {}".format(self.category, dumps_event(self.fields))
+
+
+class EventLogger():
+    '''
+    Structured order lifecycle log on top of a stdlib logger: event(category, **fields) logs one compact json line.
+    Each category can be sampled (keep one of every n) and/or rate limited (at most n per second). Events rejected by
+    the level, sampling or rate limit cost one dict lookup and are counted in suppressed.
+    When building the fields is itself costly, guard it with sample(category) and log with log(category, **fields).
+    '''
+    def __init__(self, name: str, level = logging.INFO):
+        self.logger = logging.getLogger(name)
+        self.level = level
+        self._limits = {}  # category -> [sample_every, max_per_second, counter, window start, count in window]
+        self.suppressed = {}
+
+    def set_sampling(self, category: str, sample_every: int = 1, max_per_second: int = None):
+        assert sample_every >= 1
+        assert max_per_second is None or max_per_second > 0
+        if sample_every == 1 and max_per_second is None:
+            self._limits.pop(category, None)
+        else:
+            self._limits[category] = [sample_every, max_per_second, 0, 0., 0]
+
+    def sample(self, category: str) -> bool:
+        if not self.logger.isEnabledFor(self.level):
+            return False
+        limit = self._limits.get(category)
+        if limit is None:
+            return True
+        limit[2] += 1
+        if limit[2] < limit[0]:
+            self.suppressed[category] = self.suppressed.get(category, 0) + 1
+            return False
+        limit[2] = 0
+        if limit[1] is not None:
+            now = time.monotonic()
+            if now - limit[3] >= 1.:
+                limit[3] = now
+                limit[4] = 0
+            if limit[4] >= limit[1]:
+                self.suppressed[category] = self.suppressed.get(category, 0) + 1
+                return False
+            limit[4] += 1
+        return True
+
+    def log(self, category: str, **fields):
+        self.logger.log(self.level, _Event(category, fields), extra={'event': category, 'fields': fields})
+
+    def event(self, category: str, **fields):
+        if self.sample(category):
+            self.log(category, **fields)
+
+
+class EventJsonFormatter(logging.Formatter):
+    '''
+    One json object per line for a dedicated event log file: time, logger, level, event and its fields.
+    Records that are not events are written with their message under "msg".
+    '''
+    def format(self, record):
+        line = {'ts': record.created, 'logger': record.name, 'level': record.levelname}
+        if hasattr(record, 'event'):
+            line['event'] = record.event
+            line.update(record.fields)
+        else:
+            line['msg'] = record.getMessage()
+        return dumps_event(line)
@@ -0,0 +1,130 @@
+from strategy_trading.STUtils.ohlcvResampler import KlineArrays, COLUMNS
+from datetime import datetime, timedelta
+import numpy as np
+import json
+import os
+import re
+
+DTYPES = dict([('time', np.int64)] + [(column, np.float64) for column in COLUMNS])
+TIMEZONE_OFFSET_US = {'UTC': 0, 'HKT': 8 * 3600 * 1000000}
+
+
+class KlineStore():
+    '''
+    On-disk kline history: one directory per (exchange, symbol, freq_seconds) holding one raw binary file per column
+    (time as UTC epoch microseconds, int64; the rest float64) plus meta.json with the committed length.
+    Files are only appended to, and read through np.memmap, so loading history costs no parsing. meta.json is
+    replaced atomically after the columns are written and read again on every call, so readers in other processes
+    only see committed bars.
+    Bars are immutable once a later bar is stored, except the latest one which is overwritten by newer data.
+    One writer process per directory.
+    '''
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+
+    def _get_dir(self, exchange, symbol, freq_seconds):
+        return os.path.join(self.root_dir, exchange, re.sub(r'[^A-Za-z0-9_.-]', '_', symbol), str(int(freq_seconds)))
+
+    def _load_meta(self, directory):
+        # read on every call, the writer may be another process or another KlineStore
+        meta_file = os.path.join(directory, 'meta.json')
+        if not os.path.exists(meta_file):
+            return {'length': 0, 'last_time': None}
+        with open(meta_file) as f:
+            return json.load(f)
+
+    def _save_meta(self, directory, meta):
+        tmp_file = os.path.join(directory, 'meta.json.tmp')
+        with open(tmp_file, 'w') as f:
+            json.dump(meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        # readers see either the old or the new meta.json, never a partial one
+        os.replace(tmp_file, os.path.join(directory, 'meta.json'))
+
+    def _map(self, directory, column, length, mode = 'r'):
+        return np.memmap(os.path.join(directory, column), dtype=DTYPES[column], mode=mode, shape=(length, ))
+
+    def get_length(self, exchange, symbol, freq_seconds) -> int:
+        return self._load_meta(self._get_dir(exchange, symbol, freq_seconds))['length']
+
+    def get_last_time(self, exchange, symbol, freq_seconds):
+        # UTC epoch microseconds of the latest stored bar, None if nothing is stored
+        return self._load_meta(self._get_dir(exchange, symbol, freq_seconds))['last_time']
+
+    def get_missing_bars(self, exchange, symbol, freq_seconds, now: datetime = None, max_bars = 2000) -> int:
+        # bars to request to fill the gap up to now (UTC), the latest stored bar included since it may have been incomplete
+        last_time = self.get_last_time(exchange, symbol, freq_seconds)
+        if last_time is None:
+            return max_bars
+        if now is None:
+            now = datetime.utcnow()
+        now_us = (now - datetime(1970, 1, 1)) // timedelta(microseconds=1)
+        return int(min(max_bars, max(1, (now_us - last_time) // (freq_seconds * 1000000) + 1)))
+
+    def write(self, exchange, symbol, freq_seconds, klines: KlineArrays) -> int:
+        '''
+        Store the bars of klines (UTC) not older than the latest stored bar. Returns the number of bars appended.
+        '''
+        directory = self._get_dir(exchange, symbol, freq_seconds)
+        os.makedirs(directory, exist_ok=True)
+        meta = self._load_meta(directory)
+        length = meta['length']
+        last_time = meta['last_time']
+
+        order = np.argsort(klines.time, kind='stable')
+        times = klines.time[order]
+        if last_time is not None:
+            keep = times >= last_time
+            order = order[keep]
+            times = times[keep]
+        if len(times) == 0:
+            return 0
+        # duplicated times: the last one wins
+        unique = np.concatenate((times[1:] != times[:-1], [True]))
+        order = order[unique]
+        times = times[unique]
+
+        if last_time is not None and times[0] == last_time:
+            for column in COLUMNS:
+                stored = self._map(directory, column, length, mode='r+')
+                stored[-1] = getattr(klines, column)[order[0]]
+                stored.flush()
+                del stored
+            order = order[1:]
+            times = times[1:]
+
+        if len(times):
+            for column in ('time', ) + COLUMNS:
+                values = times if column == 'time' else getattr(klines, column)[order]
+                with open(os.path.join(directory, column), 'r+b' if os.path.exists(os.path.join(directory, column)) else 'wb') as f:
+                    # drop anything beyond the committed length, e.g. left by an interrupted write
+                    f.truncate(length * 8)
+                    f.seek(length * 8)
+                    f.write(np.ascontiguousarray(values, dtype=DTYPES[column]).tobytes())
+            length += len(times)
+            last_time = int(times[-1])
+        self._save_meta(directory, {'length': length, 'last_time': last_time})
+        return len(times)
+
+    def read(self, exchange, symbol, freq_seconds, start: datetime = None, end: datetime = None, limit: int = None) -> KlineArrays:
+        '''
+        Stored bars with start <= time < end (UTC), the latest limit of them. Columns are copied out of the memmaps.
+        '''
+        directory = self._get_dir(exchange, symbol, freq_seconds)
+        length = self._load_meta(directory)['length']
+        if length == 0:
+            return KlineArrays(*([[]] * 8))
+        times = self._map(directory, 'time', length)
+        epoch = datetime(1970, 1, 1)
+        lo = 0 if start is None else int(np.searchsorted(times, (start - epoch) // timedelta(microseconds=1)))
+        hi = length if end is None else int(np.searchsorted(times, (end - epoch) // timedelta(microseconds=1)))
+        if limit is not None:
+            lo = max(lo, hi - limit)
+        return KlineArrays(np.array(times[lo:hi]), *[np.array(self._map(directory, column, length)[lo:hi]) for column in COLUMNS])
+
+    def get_klines(self, exchange, symbol, freq_seconds, limit: int = None, timezone = 'UTC') -> list:
+        # kline dicts as KlineBuilder(init_klines=...) takes them, times shifted to timezone
+        klines = self.read(exchange, symbol, freq_seconds, limit=limit)
+        klines.time = klines.time + TIMEZONE_OFFSET_US[timezone]
+        return klines.to_dicts()
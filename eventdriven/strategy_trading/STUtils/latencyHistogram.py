@@ -0,0 +1,57 @@
+from bisect import bisect_left
+
+
+class LatencyHistogram():
+    '''
+    Fixed log2 buckets in microseconds, 1us .. ~67s. add() is O(log buckets) and never allocates.
+    Percentiles are reported as the upper bound of the bucket they fall in.
+    '''
+    BOUNDS_US = [1 << i for i in range(27)]
+
+    def __init__(self, name: str = None):
+        self.name = name
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * (len(self.BOUNDS_US) + 1)
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, seconds: float):
+        us = seconds * 1e6
+        self.counts[bisect_left(self.BOUNDS_US, us)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p: float):
+        # in seconds
+        if not self.count:
+            return None
+        target = self.count * p / 100.
+        cumu = 0
+        for i, c in enumerate(self.counts):
+            cumu += c
+            if cumu >= target and c:
+                if i >= len(self.BOUNDS_US):
+                    return self.max
+                return self.BOUNDS_US[i] / 1e6
+        return self.max
+
+    def summary(self) -> dict:
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'max': self.max
+        }
+
+    def __repr__(self):
+        s = self.summary()
+        if not s['count']:
+            return "{}: no samples".format(self.name)
+        return "{}: n={} mean={:.1f}us p50<={:.0f}us p99<={:.0f}us max={:.1f}us".format(
+            self.name, s['count'], s['mean'] * 1e6, s['p50'] * 1e6, s['p99'] * 1e6, s['max'] * 1e6)
@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta
+import numpy as np
+
+EPOCH = datetime(1970, 1, 1)
+ONE_US = timedelta(microseconds=1)
+COLUMNS = ('open', 'high', 'low', 'close', 'volume', 'amount', 'count')
+
+
+class KlineArrays():
+    '''
+    Klines as contiguous numpy columns. time is the bar start in epoch microseconds (int64), in whatever
+    timezone the naive datetimes were. Prices of bars without any trade are nan.
+    '''
+    __slots__ = ('time', ) + COLUMNS
+
+    def __init__(self, time, open, high, low, close, volume, amount, count):
+        self.time = np.asarray(time, dtype=np.int64)
+        self.open = np.asarray(open, dtype=np.float64)
+        self.high = np.asarray(high, dtype=np.float64)
+        self.low = np.asarray(low, dtype=np.float64)
+        self.close = np.asarray(close, dtype=np.float64)
+        self.volume = np.asarray(volume, dtype=np.float64)
+        self.amount = np.asarray(amount, dtype=np.float64)
+        self.count = np.asarray(count, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.time)
+
+    @classmethod
+    def from_dicts(cls, klines: list):
+        # kline dicts with a 'time' datetime, in any order
+        klines = sorted(klines, key=lambda kline: kline['time'])
+        nan = float('nan')
+        return cls([(kline['time'] - EPOCH) // ONE_US for kline in klines],
+                   *[[nan if kline[column] is None else kline[column] for kline in klines] for column in COLUMNS])
+
+    def to_dicts(self) -> list:
+        columns = [getattr(self, column).tolist() for column in COLUMNS]
+        klines = []
+        for i, t in enumerate(self.time.tolist()):
+            kline = {column: values[i] for column, values in zip(COLUMNS, columns)}
+            if kline['open'] != kline['open']:
+                kline['open'] = kline['high'] = kline['low'] = kline['close'] = None
+            kline['time'] = EPOCH + timedelta(microseconds=t)
+            klines.append(kline)
+        return klines
+
+
+def resample(klines: KlineArrays, freq_seconds: int, shift_seconds: int = 0, fill_empty: bool = True) -> KlineArrays:
+    '''
+    Aggregate klines sorted by time into freq_seconds bars starting at (t - shift) // freq * freq + shift
+    (epoch aligned, as KlineBuilder windows). fill_empty adds the bars without any input kline between the first
+    and the last bar, with nan prices and zero volume, as pandas resample does.
+    '''
+    freq_us = int(freq_seconds * 1000000)
+    shift_us = int(shift_seconds * 1000000)
+    n = len(klines)
+    if n == 0:
+        return KlineArrays(*([[]] * 8))
+
+    keys = (klines.time - shift_us) // freq_us * freq_us + shift_us
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    ends = np.concatenate((starts[1:], [n])) - 1
+
+    # input bars without trades have nan prices: fmax/fmin skip them, open/close take the first/last traded bar
+    high = np.fmax.reduceat(klines.high, starts)
+    low = np.fmin.reduceat(klines.low, starts)
+    traded = ~np.isnan(klines.open)
+    index = np.arange(n)
+    first_traded = np.minimum.reduceat(np.where(traded, index, n), starts)
+    last_traded = np.maximum.reduceat(np.where(traded, index, -1), starts)
+    has_trade = first_traded <= ends
+    padded_open = np.append(klines.open, np.nan)
+    padded_close = np.append(klines.close, np.nan)
+    open = np.where(has_trade, padded_open[np.minimum(first_traded, n)], np.nan)
+    close = np.where(has_trade, padded_close[np.where(last_traded < 0, n, last_traded)], np.nan)
+    volume = np.add.reduceat(klines.volume, starts)
+    amount = np.add.reduceat(klines.amount, starts)
+    count = np.add.reduceat(klines.count, starts)
+    time = keys[starts]
+
+    if not fill_empty or len(time) == int((time[-1] - time[0]) // freq_us) + 1:
+        return KlineArrays(time, open, high, low, close, volume, amount, count)
+
+    slots = (time - time[0]) // freq_us
+    size = int(slots[-1]) + 1
+    columns = []
+    for values, empty in ((open, np.nan), (high, np.nan), (low, np.nan), (close, np.nan), (volume, 0.), (amount, 0.), (count, 0.)):
+        filled = np.full(size, empty)
+        filled[slots] = values
+        columns.append(filled)
+    return KlineArrays(time[0] + np.arange(size, dtype=np.int64) * freq_us, *columns)
+
+
+def resample_dicts(klines: list, freq_seconds: int, shift_seconds: int = 0) -> list:
+    return resample(KlineArrays.from_dicts(klines), freq_seconds, shift_seconds).to_dicts()
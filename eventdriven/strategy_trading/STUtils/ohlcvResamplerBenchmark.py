@@ -0,0 +1,85 @@
+'''
+Compare ohlcvResampler.resample with the pandas resample path KlineBuilder used, on 2000 1min klines.
+
+    python -m strategy_trading.STUtils.ohlcvResamplerBenchmark -n 2000
+
+Both sides must give the same bars (pandas with origin='epoch', the alignment KlineBuilder windows use).
+'''
+from strategy_trading.STUtils.ohlcvResampler import KlineArrays, resample, resample_dicts
+from optparse import OptionParser
+from datetime import datetime, timedelta
+import numpy as np
+import pandas
+import random
+import time
+
+
+def synthetic_klines(n, freq_seconds = 60, empty_ratio = 0.02):
+    start = datetime(2020, 1, 1, 0, 0)
+    price = 10000.
+    klines = []
+    for i in range(n):
+        price += random.gauss(0, 5)
+        if random.random() < empty_ratio:
+            klines.append({'time': start + timedelta(seconds=freq_seconds * i), 'open': None, 'high': None, 'low': None, 'close': None,
+                           'volume': 0., 'amount': 0., 'count': 0.})
+            continue
+        high = price + random.random() * 10
+        low = price - random.random() * 10
+        volume = random.random() * 100
+        klines.append({'time': start + timedelta(seconds=freq_seconds * i), 'open': price, 'high': high, 'low': low,
+                       'close': random.uniform(low, high), 'volume': volume, 'amount': volume * price, 'count': float(random.randint(1, 500))})
+    return klines
+
+
+def pandas_resample(klines, freq_seconds, shift_seconds):
+    # the former KlineBuilder._resample, with agg() in place of the removed resample(how=)
+    raw_df = pandas.DataFrame(klines)
+    raw_df['time'] = raw_df['time'] - pandas.Timedelta('{}s'.format(shift_seconds))
+    raw_df.set_index(raw_df['time'], inplace=True)
+    df = raw_df.resample('{}s'.format(freq_seconds), origin='epoch').agg(
+        {'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'volume': 'sum', 'amount': 'sum', 'count': 'sum'})
+    df['time'] = df.index
+    df['time'] = df['time'] + pandas.Timedelta('{}s'.format(shift_seconds))
+    return list(df.T.to_dict().values())
+
+
+def same_klines(a, b):
+    if len(a) != len(b):
+        return False
+    for x, y in zip(a, b):
+        if pandas.Timestamp(x['time']) != pandas.Timestamp(y['time']):
+            return False
+        for column in ('open', 'high', 'low', 'close', 'volume', 'amount', 'count'):
+            u = np.nan if x[column] is None else x[column]
+            v = np.nan if y[column] is None else y[column]
+            if not np.isclose(u, v, equal_nan=True):
+                return False
+    return True
+
+
+def best_of(func, rounds):
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("-n", type="int", dest="n", default=2000, help="number of 1min klines")
+    parser.add_option("-r", type="int", dest="rounds", default=20)
+    (options, args) = parser.parse_args()
+
+    klines = synthetic_klines(options.n)
+    arrays = KlineArrays.from_dicts(klines)
+    for freq_seconds, shift_seconds in [(300, 0), (900, 300), (1200, 600), (3600, 0), (3600 * 4, 3600)]:
+        assert same_klines(pandas_resample(klines, freq_seconds, shift_seconds), resample_dicts(klines, freq_seconds, shift_seconds)), (freq_seconds, shift_seconds)
+        t_pandas = best_of(lambda: pandas_resample(klines, freq_seconds, shift_seconds), options.rounds)
+        t_dicts = best_of(lambda: resample_dicts(klines, freq_seconds, shift_seconds), options.rounds)
+        t_arrays = best_of(lambda: resample(arrays, freq_seconds, shift_seconds), options.rounds)
+        print("{:>6}s shift {:>5}s: pandas {:>8.0f}us  numpy(dicts) {:>8.0f}us  numpy(arrays) {:>6.0f}us".format(
+            freq_seconds, shift_seconds, t_pandas * 1e6, t_dicts * 1e6, t_arrays * 1e6))
@@ -0,0 +1,277 @@
+from collections import deque
+import math
+
+
+class RollingWindow():
+    '''
+    Ring buffer of the latest entries, either the last size ones (count window) or those with
+    time > t_us - window_us, t_us being the latest time pushed or expired to (time window, as pandas rolling('Ns')).
+    Each entry is a tuple of columns; subclasses keep their statistics up to date in _add/_remove, O(1) per entry,
+    and recompute them exactly in _resum once per capacity removals so rounding errors do not accumulate.
+    The buffers of a time window double when full, they are never shrunk.
+    '''
+    def __init__(self, size: int = None, window_us: int = None, capacity: int = 1024):
+        assert (size is None) != (window_us is None), "either size or window_us"
+        if size is not None:
+            assert isinstance(size, int) and size >= 1
+            capacity = size
+        self.size = size
+        self.window_us = window_us
+        self.capacity = capacity
+        self._times = [0] * capacity
+        self._entries = [None] * capacity
+        self._head = 0
+        self._len = 0
+        self._removed = 0
+        # sequence number of the next entry; the oldest one present is _seq - _len
+        self._seq = 0
+
+    def __len__(self):
+        return self._len
+
+    def reset(self):
+        self._times = [0] * self.capacity
+        self._entries = [None] * self.capacity
+        self._head = 0
+        self._len = 0
+        self._removed = 0
+        self._seq = 0
+
+    def _grow(self):
+        order = [(self._head + i) % self.capacity for i in range(self._len)]
+        self._times = [self._times[i] for i in order] + [0] * self.capacity
+        self._entries = [self._entries[i] for i in order] + [None] * self.capacity
+        self._head = 0
+        self.capacity *= 2
+
+    def _pop(self):
+        entry = self._entries[self._head]
+        self._entries[self._head] = None
+        self._head = (self._head + 1) % self.capacity
+        self._len -= 1
+        self._remove(entry)
+        self._removed += 1
+        if self._removed >= self.capacity:
+            self._removed = 0
+            self._resum()
+
+    def expire(self, t_us: int):
+        # drop the entries out of the time window ending at t_us
+        if self.window_us is not None:
+            start = t_us - self.window_us
+            while self._len and self._times[self._head] <= start:
+                self._pop()
+
+    def push(self, t_us: int, entry: tuple):
+        if self.window_us is not None:
+            self.expire(t_us)
+            if self._len == self.capacity:
+                self._grow()
+        elif self._len == self.size:
+            self._pop()
+        idx = (self._head + self._len) % self.capacity
+        self._times[idx] = t_us
+        self._entries[idx] = entry
+        self._len += 1
+        self._seq += 1
+        self._add(entry)
+
+    def entries(self):
+        # oldest first
+        return (self._entries[(self._head + i) % self.capacity] for i in range(self._len))
+
+    def _add(self, entry):
+        pass
+
+    def _remove(self, entry):
+        pass
+
+    def _resum(self):
+        pass
+
+
+class RollingStats(RollingWindow):
+    '''
+    Sum, mean, sample variance (ddof=1, as pandas) and min/max of the values in the window.
+    min/max come from monotonic deques of the (value, seq) entries; track_min_max=False skips them.
+    '''
+    def __init__(self, size: int = None, window_us: int = None, capacity: int = 1024, track_min_max: bool = True):
+        super().__init__(size, window_us, capacity)
+        self.track_min_max = track_min_max
+        self._mean = 0.
+        self._m2 = 0.
+        self._mins = deque()
+        self._maxs = deque()
+
+    def reset(self):
+        super().reset()
+        self._mean = 0.
+        self._m2 = 0.
+        self._mins.clear()
+        self._maxs.clear()
+
+    def update(self, value: float, t_us: int = 0):
+        self.push(t_us, (value, self._seq))
+
+    def _add(self, entry):
+        value, seq = entry
+        delta = value - self._mean
+        self._mean += delta / self._len
+        self._m2 += delta * (value - self._mean)
+        if self.track_min_max:
+            mins, maxs = self._mins, self._maxs
+            while mins and mins[-1][0] >= value:
+                mins.pop()
+            mins.append(entry)
+            while maxs and maxs[-1][0] <= value:
+                maxs.pop()
+            maxs.append(entry)
+
+    def _remove(self, entry):
+        value, seq = entry
+        if self._len == 0:
+            self._mean = self._m2 = 0.
+        else:
+            delta = value - self._mean
+            self._mean -= delta / self._len
+            self._m2 -= delta * (value - self._mean)
+        if self.track_min_max:
+            if self._mins and self._mins[0][1] <= seq:
+                self._mins.popleft()
+            if self._maxs and self._maxs[0][1] <= seq:
+                self._maxs.popleft()
+
+    def _resum(self):
+        values = [value for value, _ in self.entries()]
+        if values:
+            self._mean = math.fsum(values) / len(values)
+            self._m2 = math.fsum((value - self._mean) ** 2 for value in values)
+
+    @property
+    def count(self):
+        return self._len
+
+    @property
+    def sum(self):
+        return self._mean * self._len
+
+    def mean(self):
+        return self._mean if self._len else None
+
+    def var(self):
+        return max(self._m2, 0.) / (self._len - 1) if self._len > 1 else None
+
+    def std(self):
+        var = self.var()
+        return math.sqrt(var) if var is not None else None
+
+    def min(self):
+        return self._mins[0][0] if self._mins else None
+
+    def max(self):
+        return self._maxs[0][0] if self._maxs else None
+
+
+class RollingSums(RollingWindow):
+    # running sums of every column of the entries
+    def __init__(self, size: int = None, window_us: int = None, capacity: int = 1024, columns: int = 1):
+        super().__init__(size, window_us, capacity)
+        self.sums = [0.] * columns
+
+    def reset(self):
+        super().reset()
+        self.sums = [0.] * len(self.sums)
+
+    def _add(self, entry):
+        sums = self.sums
+        for i, value in enumerate(entry):
+            sums[i] += value
+
+    def _remove(self, entry):
+        sums = self.sums
+        for i, value in enumerate(entry):
+            sums[i] -= value
+
+    def _resum(self):
+        entries = list(self.entries())
+        self.sums = [math.fsum(column) for column in zip(*entries)] if entries else [0.] * len(self.sums)
+
+
+class RollingVWAP(RollingSums):
+    def __init__(self, size: int = None, window_us: int = None, capacity: int = 1024):
+        super().__init__(size, window_us, capacity, columns=2)
+
+    def update(self, price: float, size: float, t_us: int = 0):
+        self.push(t_us, (price * size, size))
+
+    @property
+    def volume(self):
+        return self.sums[1]
+
+    def vwap(self):
+        return self.sums[0] / self.sums[1] if self._len and self.sums[1] > 0 else None
+
+
+class RollingTradeImbalance(RollingSums):
+    '''
+    Buy and sell volume of the trades in the window; imbalance() = (buy - sell) / (buy + sell), in [-1, 1].
+    '''
+    def __init__(self, size: int = None, window_us: int = None, capacity: int = 1024):
+        super().__init__(size, window_us, capacity, columns=2)
+
+    def update(self, size: float, is_buy: bool, t_us: int = 0):
+        self.push(t_us, (size, 0.) if is_buy else (0., size))
+
+    @property
+    def buy_volume(self):
+        return self.sums[0]
+
+    @property
+    def sell_volume(self):
+        return self.sums[1]
+
+    def imbalance(self):
+        total = self.sums[0] + self.sums[1]
+        return (self.sums[0] - self.sums[1]) / total if self._len and total > 0 else None
+
+
+if __name__ == '__main__':
+    # compare with pandas rolling on random ticks
+    import numpy as np
+    import pandas
+    import time
+
+    rng = np.random.default_rng(0)
+    n = 20000
+    t_us = np.cumsum(rng.integers(0, 200000, n))
+    values = 100. + np.cumsum(rng.normal(0, 1, n))
+    sizes = rng.random(n)
+    is_buy = rng.random(n) < 0.5
+    series = pandas.Series(values, index=pandas.to_datetime(t_us, unit='us'))
+
+    for stats, rolling in [(RollingStats(size=50), series.rolling(50, min_periods=1)),
+                           (RollingStats(window_us=5000000, capacity=8), series.rolling('5s'))]:
+        expected = {name: getattr(rolling, name)().values for name in ('sum', 'mean', 'var', 'min', 'max')}
+        start = time.perf_counter()
+        got = {name: np.full(n, np.nan) for name in expected}
+        for i in range(n):
+            stats.update(values[i], int(t_us[i]))
+            for name in expected:
+                value = stats.sum if name == 'sum' else getattr(stats, name)()
+                got[name][i] = np.nan if value is None else value
+        elapsed = time.perf_counter() - start
+        for name in expected:
+            assert np.allclose(got[name], expected[name], rtol=1e-9, atol=1e-9, equal_nan=True), name
+        print("{}: matches pandas, {:.2f}us per update with 5 reads".format(
+            'count window' if stats.size else 'time window', elapsed / n * 1e6))
+
+    vwap, imbalance = RollingVWAP(window_us=5000000), RollingTradeImbalance(window_us=5000000)
+    frame = pandas.DataFrame({'pv': values * sizes, 'size': sizes, 'buy': np.where(is_buy, sizes, 0.), 'sell': np.where(is_buy, 0., sizes)},
+                             index=series.index).rolling('5s').sum()
+    for i in range(n):
+        vwap.update(values[i], sizes[i], int(t_us[i]))
+        imbalance.update(sizes[i], bool(is_buy[i]), int(t_us[i]))
+    row = frame.iloc[-1]
+    assert math.isclose(vwap.vwap(), row['pv'] / row['size'], rel_tol=1e-9)
+    assert math.isclose(imbalance.imbalance(), (row['buy'] - row['sell']) / (row['buy'] + row['sell']), rel_tol=1e-9, abs_tol=1e-12)
+    print("vwap {:.4f}, imbalance {:.4f}: match pandas".format(vwap.vwap(), imbalance.imbalance()))
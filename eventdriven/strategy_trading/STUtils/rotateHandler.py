@@ -1,7 +1,9 @@
 from logging import FileHandler
 from logging.handlers import RotatingFileHandler, TimedRotatingFileHandler
-from threading import Thread
-from queue import Queue
+from threading import Thread, Condition, current_thread
+from collections import deque
+from enum import Enum
+import logging
 import os
 
 
@@ -23,24 +25,139 @@ class IntegralRotatingFileHandler(TimedRotatingFileHandler):
         #     pass
         return stream
 
+class OverflowPolicy(Enum):
+    DROP_LOW_LEVEL = 1  # DEBUG is dropped first (half full), then INFO (80% full), then everything (full)
+    BLOCK = 2  # the logging thread waits for room
+    SAMPLE = 3  # above half full keep 1 of sample_every records below WARNING, drop everything when full
+
+
 class AsyncHandlerMixin(object):
-    def __init__(self, *args, **kwargs):
+    '''
+    Records are queued in a bounded buffer and written by one thread, a batch of up to batch_size records per
+    write and flush. Rotation (shouldRollover/doRollover, hence rotator e.g. GZipRotator) is still checked per record.
+    get_metrics() reports queue depth and drops.
+    '''
+    def __init__(self, *args, capacity = 100000, overflow: OverflowPolicy = OverflowPolicy.DROP_LOW_LEVEL, batch_size = 512, sample_every = 10, **kwargs):
         super(AsyncHandlerMixin, self).__init__(*args, **kwargs)
-        self.__queue = Queue()
-        self.__thread = Thread(target=self.__loop)
-        self.__thread.daemon = True
-        self.__thread.start()
+        assert capacity > 0 and batch_size > 0 and sample_every >= 1
+        self.capacity = capacity
+        self.overflow = overflow
+        self.batch_size = batch_size
+        self.sample_every = sample_every
+        self._records = deque()
+        self._cond = Condition()
+        self._busy = False
+        self._sample_counter = 0
+        # counters are not named errors/... as FileHandler.errors is the encoding errors argument of open()
+        self.dropped_records = {}  # level name -> count
+        self.max_queue_depth = 0
+        self.written_records = 0
+        self.write_batches = 0
+        self.write_errors = 0
+        self._thread = Thread(target=self._loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _accept(self, record, depth):
+        if self.overflow == OverflowPolicy.BLOCK:
+            while len(self._records) >= self.capacity:
+                self._cond.wait()
+            return True
+        if depth >= self.capacity:
+            return False
+        if self.overflow == OverflowPolicy.DROP_LOW_LEVEL:
+            if record.levelno <= logging.DEBUG:
+                return depth < self.capacity * 0.5
+            if record.levelno < logging.WARNING:
+                return depth < self.capacity * 0.8
+            return True
+        if record.levelno < logging.WARNING and depth >= self.capacity * 0.5:
+            self._sample_counter += 1
+            if self._sample_counter < self.sample_every:
+                return False
+            self._sample_counter = 0
+        return True
 
     def emit(self, record):
-        self.__queue.put(record)
+        with self._cond:
+            if not self._accept(record, len(self._records)):
+                self.dropped_records[record.levelname] = self.dropped_records.get(record.levelname, 0) + 1
+                return
+            self._records.append(record)
+            if len(self._records) > self.max_queue_depth:
+                self.max_queue_depth = len(self._records)
+            self._cond.notify_all()
 
-    def __loop(self):
+    def _loop(self):
         while True:
-            record = self.__queue.get()
+            with self._cond:
+                while not self._records:
+                    self._busy = False
+                    self._cond.notify_all()
+                    self._cond.wait()
+                self._busy = True
+                batch = [self._records.popleft() for _ in range(min(self.batch_size, len(self._records)))]
+                self._cond.notify_all()
+            self._write_batch(batch)
+
+    def _write_batch(self, batch):
+        if not isinstance(self, logging.StreamHandler):
+            for record in batch:
+                try:
+                    super(AsyncHandlerMixin, self).emit(record)
+                    self.written_records += 1
+                except Exception:
+                    self.write_errors += 1
+                    self.handleError(record)
+            return
+
+        lines = []
+        for record in batch:
             try:
-                super(AsyncHandlerMixin, self).emit(record)
-            except:
-                pass
+                if hasattr(self, 'shouldRollover') and self.shouldRollover(record):
+                    self._write_lines(lines, record)
+                    lines = []
+                    self.doRollover()
+                lines.append(self.format(record) + self.terminator)
+            except Exception:
+                self.write_errors += 1
+                self.handleError(record)
+        self._write_lines(lines, batch[-1])
+        self.write_batches += 1
+
+    def _write_lines(self, lines, record):
+        if not lines:
+            return
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write("".join(lines))
+            self.stream.flush()
+            self.written_records += len(lines)
+        except Exception:
+            self.write_errors += len(lines)
+            self.handleError(record)
+
+    def flush(self, timeout = 5.):
+        # waits until the queued records are written. the writer thread itself only flushes the stream
+        if current_thread() is not self._thread:
+            with self._cond:
+                self._cond.wait_for(lambda: not self._records and not self._busy, timeout)
+        super(AsyncHandlerMixin, self).flush()
+
+    def close(self):
+        self.flush()
+        super(AsyncHandlerMixin, self).close()
+
+    def get_metrics(self) -> dict:
+        return {
+            'depth': len(self._records),
+            'max_depth': self.max_queue_depth,
+            'dropped': dict(self.dropped_records),
+            'written': self.written_records,
+            'batches': self.write_batches,
+            'errors': self.write_errors
+        }
 
 
 class AsyncFileHandler(AsyncHandlerMixin, FileHandler):
@@ -52,4 +169,32 @@ class AsyncRotatingFileHandler(AsyncHandlerMixin, RotatingFileHandler):
 
 
 class AsyncTimedRotatingFileHandler(AsyncHandlerMixin, IntegralRotatingFileHandler):
-    pass
\ No newline at end of file
+    pass
+
+
+if __name__ == '__main__':
+    # every record reaches disk across rollovers
+    import tempfile
+    import glob
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        path = os.path.join(log_dir, 'test.log')
+        handler = AsyncRotatingFileHandler(path, maxBytes=2000, backupCount=1000, batch_size=64)
+        logger = logging.getLogger('rotateHandler.check')
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        logger.addHandler(handler)
+        n = 1000
+        for i in range(n):
+            logger.info("record %d", i)
+        handler.close()
+        files = glob.glob(path + '*')
+        lines = []
+        for file in files:
+            with open(file) as f:
+                lines += f.read().splitlines()
+        metrics = handler.get_metrics()
+        assert len(files) > 1, "no rollover"
+        assert sorted(lines, key=lambda line: int(line.split()[-1])) == ["record {}".format(i) for i in range(n)], len(lines)
+        assert metrics['written'] == n and metrics['errors'] == 0, metrics
+        print("{} records in {} files after rollovers, {}".format(len(lines), len(files), metrics))
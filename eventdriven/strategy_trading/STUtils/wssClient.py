@@ -3,10 +3,39 @@ import logging
 import asyncio
 import json
 import inspect
+import time
+from decimal import Decimal
+from functools import partial
+from strategy_trading.STUtils.latencyHistogram import LatencyHistogram
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def get_json_decoder(use_decimal: bool = False):
+    '''
+    Decoder taking the frame payload as bytes or str.
+    orjson (when installed) parses bytes directly. use_decimal parses json numbers into Decimal, which orjson
+    cannot do, so it falls back to the stdlib json.
+    '''
+    if use_decimal:
+        return partial(json.loads, parse_float=Decimal)
+    if orjson is not None:
+        return orjson.loads
+    return json.loads
+
+
+def get_json_encoder():
+    # returns str since frames are sent as TEXT
+    if orjson is not None:
+        return lambda obj: orjson.dumps(obj).decode('utf-8')
+    return json.dumps
 
 
 class BaseWebsocketClient():
-    def __init__(self, url: str, allow_reconnect: bool, callback_when_data, callback_after_connection = None, heartbeat = 5, ssl = False, retry_seconds: int = None):
+    def __init__(self, url: str, allow_reconnect: bool, callback_when_data, callback_after_connection = None, heartbeat = 5, ssl = False, retry_seconds: int = None,
+                 decoder = None, encoder = None):
         self.url = url
         self.allow_reconnect = allow_reconnect
         if callback_after_connection is not None:
@@ -22,6 +51,14 @@ class BaseWebsocketClient():
             self.retry_seconds = max(retry_seconds, 1)
         else:
             self.retry_seconds = None
+        self.decoder = decoder if decoder is not None else get_json_decoder()
+        assert callable(self.decoder)
+        self.encoder = encoder if encoder is not None else get_json_encoder()
+        assert callable(self.encoder)
+        # frames queued by send_message_nowait, as (frame, queued perf_counter)
+        self._pending_frames = []
+        self._flush_scheduled = False
+        self.send_latency = LatencyHistogram("send|{}".format(url))
 
     async def connect_to_server(self, retry = None):
         if retry is None:
@@ -75,27 +112,64 @@ class BaseWebsocketClient():
                         continue
                     break
 
-                if msg.type == aiohttp.WSMsgType.TEXT:
+                if msg.type == aiohttp.WSMsgType.TEXT or msg.type == aiohttp.WSMsgType.BINARY:
+                    # BINARY payloads are utf-8 json. the decoder takes the bytes as they are
                     try:
-                        self.callback_when_data(json.loads(msg.data))
+                        self.callback_when_data(self.decoder(msg.data))
                     except Exception as e:
                         self.logger.exception("{} when client processing {}".format(e, msg.data))
-                elif msg.type == aiohttp.WSMsgType.BINARY:
-                    data = msg.data
-                    data = data.decode('utf-8')
-                    data = json.loads(data)
-                    try:
-                        self.callback_when_data(data)
-                    except Exception as e:
-                        self.logger.exception("{} when client processing {}".format(e, data))
                 else:
                     self.logger.warning("receive msg {} with type {}. Not recognized. Ignore"
                                         .format(msg.data, msg.type))
 
     async def send_message(self, messages: list):
         if self.ws is not None:
-            for msg in messages:
-                await self.ws.send_json(msg)
+            start = time.perf_counter()
+            frames = [self.encoder(msg) for msg in messages]
+            for frame in frames:
+                await self.ws.send_str(frame)
+            self.send_latency.add(time.perf_counter() - start)
+
+    def send_message_nowait(self, messages: list, on_error = None):
+        '''
+        Queue the messages and return. Everything queued within the same event loop turn is written by one flush
+        on the next turn. Errors are logged, not raised to the caller: the messages that were not written are passed
+        to on_error(messages, exception) instead.
+        '''
+        if self.ws is None:
+            if on_error is not None:
+                on_error(messages, ConnectionError("not connected to {}".format(self.url)))
+            return
+        now = time.perf_counter()
+        for msg in messages:
+            self._pending_frames.append((self.encoder(msg), now, msg, on_error))
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            asyncio.ensure_future(self._flush_pending_frames())
+
+    async def _flush_pending_frames(self):
+        frames = self._pending_frames
+        self._pending_frames = []
+        self._flush_scheduled = False
+        sent = 0
+        try:
+            for frame, _, _, _ in frames:
+                await self.ws.send_str(frame)
+                sent += 1
+        except Exception as e:
+            self.logger.warning("{} when sending {} frames to {}".format(e, len(frames) - sent, self.url))
+            failed = {}
+            for _, _, msg, on_error in frames[sent:]:
+                if on_error is not None:
+                    failed.setdefault(on_error, []).append(msg)
+            for on_error, msgs in failed.items():
+                try:
+                    on_error(msgs, e)
+                except Exception as callback_error:
+                    self.logger.exception(callback_error)
+        now = time.perf_counter()
+        for _, queued_time, _, _ in frames[:sent]:
+            self.send_latency.add(now - queued_time)
 
 
 if __name__ == '__main__':
@@ -244,9 +244,8 @@ class Strategy:
         to_create_orders = []
         to_cancel_orders = []
         if stop_loss_px > self.order_book.bids[0][0]:
-            for order in active_orders.values():
-                if order.side == Side.BUY:
-                    to_add -= order.size
+            for order in active_orders.get_orders(Side.BUY):
+                to_add -= order.size
             if to_add > 0:
                 to_create_orders.append({
                     'side': Side.BUY,
@@ -308,9 +307,8 @@ class Strategy:
         to_create_orders = []
         to_cancel_orders = []
         if stop_loss_px < self.order_book.asks[0][0]:
-            for order in active_orders.values():
-                if order.side == Side.SELL:
-                    to_add -= order.size
+            for order in active_orders.get_orders(Side.SELL):
+                to_add -= order.size
             if to_add > 0:
                 to_create_orders.append({
                     'side': Side.SELL,
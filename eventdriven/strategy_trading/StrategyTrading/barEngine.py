@@ -0,0 +1,398 @@
+from datetime import datetime, timedelta
+from sortedcontainers import SortedDict
+import asyncio
+import logging
+import numpy as np
+
+EPOCH = datetime(1970, 1, 1)
+ONE_US = timedelta(microseconds=1)
+FIELDS = ('open', 'high', 'low', 'close', 'volume', 'amount', 'count')
+
+
+def to_us(_time) -> int:
+    # naive datetime (or pandas.Timestamp) -> epoch microseconds in the same time base
+    return (_time - EPOCH) // ONE_US
+
+
+def from_us(us: int) -> datetime:
+    return EPOCH + timedelta(microseconds=int(us))
+
+
+class BarRing():
+    '''
+    Preallocated, time ordered ring of bars. Prices of a bar without trades are nan.
+    '''
+    def __init__(self, capacity: int):
+        assert capacity > 0
+        self.capacity = capacity
+        self.time = np.zeros(capacity, dtype=np.int64)
+        self.open = np.full(capacity, np.nan)
+        self.high = np.full(capacity, np.nan)
+        self.low = np.full(capacity, np.nan)
+        self.close = np.full(capacity, np.nan)
+        self.volume = np.zeros(capacity)
+        self.amount = np.zeros(capacity)
+        self.count = np.zeros(capacity, dtype=np.int64)
+        self._start = 0
+        self._len = 0
+        # bumped on every change so views built from the ring can be cached
+        self.version = 0
+        # times of the bars written since the last take_changes(); full_change when they cannot be listed
+        self.changed_times = set()
+        self.full_change = True
+
+    def __len__(self):
+        return self._len
+
+    def _idx(self, i):
+        if i < 0:
+            i += self._len
+        return (self._start + i) % self.capacity
+
+    def _write(self, idx, t, o, h, l, c, v, a, n):
+        self.time[idx] = t
+        self.open[idx] = o
+        self.high[idx] = h
+        self.low[idx] = l
+        self.close[idx] = c
+        self.volume[idx] = v
+        self.amount[idx] = a
+        self.count[idx] = n
+        self.version += 1
+        if not self.full_change:
+            self.changed_times.add(t)
+            if len(self.changed_times) > self.capacity:
+                self.full_change = True
+                self.changed_times = set()
+
+    def append(self, t, o, h, l, c, v, a, n):
+        # t must be later than the last bar
+        if self._len < self.capacity:
+            idx = (self._start + self._len) % self.capacity
+            self._len += 1
+        else:
+            idx = self._start
+            self._start = (self._start + 1) % self.capacity
+        self._write(idx, t, o, h, l, c, v, a, n)
+
+    def first_time(self):
+        return int(self.time[self._start]) if self._len else None
+
+    def last_time(self):
+        return int(self.time[self._idx(-1)]) if self._len else None
+
+    def find(self, t) -> int:
+        # position of the bar starting at t, -1 if there is none
+        lo, hi = 0, self._len
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.time[self._idx(mid)] < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._len and self.time[self._idx(lo)] == t:
+            return lo
+        return -1
+
+    def upsert(self, t, o, h, l, c, v, a, n):
+        '''
+        Replace the bar starting at t, or insert it in time order. Inserting before the last bar rebuilds the ring,
+        which only happens when REST/exchange klines fill gaps. The oldest bar is dropped when full.
+        '''
+        last = self.last_time()
+        if last is None or t > last:
+            self.append(t, o, h, l, c, v, a, n)
+            return
+        i = self.find(t)
+        if i >= 0:
+            self._write(self._idx(i), t, o, h, l, c, v, a, n)
+            return
+        if self._len == self.capacity and t < self.first_time():
+            return
+        arrays = self.get_arrays()
+        pos = int(np.searchsorted(arrays['time'], t))
+        new_values = {'time': t, 'open': o, 'high': h, 'low': l, 'close': c, 'volume': v, 'amount': a, 'count': n}
+        drop = 1 if self._len == self.capacity else 0
+        length = self._len + 1 - drop
+        for name, values in arrays.items():
+            values = np.insert(values, pos, new_values[name])[drop:]
+            getattr(self, name)[:length] = values
+        self._start = 0
+        self._len = length
+        self.version += 1
+        self.full_change = True
+        self.changed_times = set()
+
+    def take_changes(self):
+        # (full_change, changed times) since the last call
+        changes = (self.full_change, self.changed_times)
+        self.full_change = False
+        self.changed_times = set()
+        return changes
+
+    def get(self, i) -> tuple:
+        idx = self._idx(i)
+        return (int(self.time[idx]), self.open[idx], self.high[idx], self.low[idx], self.close[idx],
+                self.volume[idx], self.amount[idx], int(self.count[idx]))
+
+    def get_arrays(self) -> dict:
+        # time ordered copies of every column
+        end = self._start + self._len
+        arrays = {}
+        for name in ('time', ) + FIELDS:
+            column = getattr(self, name)
+            if end <= self.capacity:
+                arrays[name] = column[self._start:end].copy()
+            else:
+                arrays[name] = np.concatenate((column[self._start:], column[:end - self.capacity]))
+        return arrays
+
+    def to_dict(self, i) -> dict:
+        # bar as the dict KlineBuilder has always exposed, prices None when there was no trade
+        t, o, h, l, c, v, a, n = self.get(i)
+        if o != o:
+            o = h = l = c = None
+        else:
+            o, h, l, c = float(o), float(h), float(l), float(c)
+        return {'open': o, 'high': h, 'low': l, 'close': c, 'volume': float(v), 'amount': float(a), 'count': n, 'time': from_us(t)}
+
+
+class BarSeries():
+    '''
+    Bars of one freq/shift: the window being built plus the finished bars in a BarRing.
+    Window starts are (t - shift) // freq * freq + shift in integer epoch microseconds.
+    '''
+    def __init__(self, freq_seconds: int, shift_seconds: int = 0, capacity: int = 1000, curr_us: int = None):
+        self.freq_seconds = freq_seconds
+        self.shift_seconds = shift_seconds
+        self.freq_us = int(freq_seconds * 1000000)
+        self.shift_us = int(shift_seconds * 1000000)
+        self.bars = BarRing(capacity)
+        self._klines = SortedDict()
+        self._klines_version = None
+        self.window_start = None
+        self.start_window(to_us(datetime.utcnow()) if curr_us is None else curr_us)
+
+    def get_window_start(self, t_us: int) -> int:
+        return (t_us - self.shift_us) // self.freq_us * self.freq_us + self.shift_us
+
+    def start_window(self, t_us: int):
+        self.window_start = self.get_window_start(t_us)
+        self.window_end = self.window_start + self.freq_us
+        self.open = self.high = self.low = self.close = None
+        self.volume = 0.
+        self.amount = 0.
+        self.count = 0
+
+    def update(self, price: float, volume: float, amount: float):
+        if self.count:
+            if price > self.high:
+                self.high = price
+            elif price < self.low:
+                self.low = price
+        else:
+            self.open = self.high = self.low = price
+        self.close = price
+        self.volume += volume
+        self.amount += amount
+        self.count += 1
+
+    def merge(self, o, h, l, c, v, a, n):
+        # add a finished finer bar to the window being built. nan prices mean the bar had no trade
+        if o == o and o is not None:
+            if self.open is None:
+                self.open, self.high, self.low = o, h, l
+            else:
+                if h > self.high:
+                    self.high = h
+                if l < self.low:
+                    self.low = l
+            self.close = c
+        self.volume += v
+        self.amount += a
+        self.count += n
+
+    def set_window(self, o, h, l, c, v, a, n):
+        # overwrite the window being built, e.g. by a REST kline of the same window
+        self.open, self.high, self.low, self.close = o, h, l, c
+        self.volume = v
+        self.amount = a
+        self.count = n
+
+    def store_window(self):
+        # store the window being built as a finished bar
+        nan = float('nan')
+        self.bars.upsert(self.window_start,
+                         nan if self.open is None else self.open, nan if self.high is None else self.high,
+                         nan if self.low is None else self.low, nan if self.close is None else self.close,
+                         self.volume, self.amount, self.count)
+
+    def close_window(self):
+        self.store_window()
+        self.start_window(self.window_end)
+
+    def roll(self, t_us: int) -> int:
+        '''
+        Close every window ending at or before t_us, empty ones included (at most capacity of them, then it jumps).
+        Returns the number of closed windows.
+        '''
+        closed = 0
+        while t_us >= self.window_end:
+            if closed >= self.bars.capacity:
+                self.start_window(t_us)
+                break
+            self.close_window()
+            closed += 1
+        return closed
+
+    def get_klines(self) -> SortedDict:
+        # SortedDict {time: kline dict} of the finished bars, updated for the bars written since the last call
+        bars = self.bars
+        if self._klines_version != bars.version:
+            full_change, changed_times = bars.take_changes()
+            klines = self._klines
+            if full_change:
+                klines.clear()
+                klines.update((kline['time'], kline) for kline in (bars.to_dict(i) for i in range(len(bars))))
+            else:
+                for t in sorted(changed_times):
+                    i = bars.find(t)
+                    if i >= 0:
+                        klines[from_us(t)] = bars.to_dict(i)
+                # drop the bars pushed out of the ring
+                first_time = from_us(bars.first_time()) if len(bars) else None
+                while klines and (first_time is None or klines.peekitem(0)[0] < first_time):
+                    klines.popitem(0)
+            self._klines_version = bars.version
+        return self._klines
+
+    def window_to_dict(self) -> dict:
+        return {'open': self.open, 'high': self.high, 'low': self.low, 'close': self.close,
+                'volume': self.volume, 'amount': self.amount, 'count': self.count, 'time': from_us(self.window_start)}
+
+
+class BarEngine():
+    '''
+    Many BarSeries (freq/shift pairs) of one symbol fed by one pass over the trades.
+    With trade timestamps, windows roll on trade time; otherwise call roll(now_us) from a timer.
+    '''
+    def __init__(self, is_inverse: bool = False, size_multiplier: float = 1.):
+        self.is_inverse = is_inverse
+        self.size_multiplier = size_multiplier
+        self.series = {}
+        self._series_list = []
+
+    def add_series(self, freq_seconds: int, shift_seconds: int = 0, capacity: int = 1000, curr_us: int = None) -> BarSeries:
+        key = (freq_seconds, shift_seconds)
+        if key not in self.series:
+            self.series[key] = BarSeries(freq_seconds, shift_seconds, capacity, curr_us)
+            self._series_list = list(self.series.values())
+        return self.series[key]
+
+    def get_series(self, freq_seconds: int, shift_seconds: int = 0) -> BarSeries:
+        return self.series.get((freq_seconds, shift_seconds))
+
+    def update_trade(self, price: float, size: float, t_us: int = None):
+        if self.is_inverse:
+            volume = size / price * self.size_multiplier
+            amount = size
+        else:
+            volume = size
+            amount = size * price
+        for series in self._series_list:
+            if t_us is not None and t_us >= series.window_end:
+                series.roll(t_us)
+            series.update(price, volume, amount)
+
+    def roll(self, t_us: int) -> list:
+        # series which closed at least one window
+        return [series for series in self._series_list if series.roll(t_us)]
+
+
+class MultiTimeframeBars():
+    '''
+    Bars of several timeframes of one symbol from one trade stream. Trades only update the finest series; each finished
+    bar is merged into the next coarser series, whose finished bars are merged into the next one, and so on.
+    Every freq must be a multiple of the previous one and all share shift_seconds.
+    on_bars_closed({freq_seconds: kline dict}) is called once per finest window boundary with every timeframe closed there.
+    '''
+    def __init__(self, freqs_seconds: list, shift_seconds: int = 0, capacity: int = 1000, on_bars_closed = None,
+                 is_inverse: bool = False, size_multiplier: float = 1., curr_us: int = None, timezone = 'UTC'):
+        freqs_seconds = sorted(set(freqs_seconds))
+        for finer, coarser in zip(freqs_seconds, freqs_seconds[1:]):
+            assert coarser % finer == 0, "{} is not a multiple of {}".format(coarser, finer)
+        if on_bars_closed is not None:
+            assert callable(on_bars_closed)
+        self.on_bars_closed = on_bars_closed
+        self.is_inverse = is_inverse
+        self.size_multiplier = size_multiplier
+        self.timezone = timezone
+        self.logger = logging.getLogger("MTF|{}|{}".format(",".join(str(freq) for freq in freqs_seconds), shift_seconds))
+        if curr_us is None:
+            curr_us = to_us(self._get_curr_time())
+        self.levels = [BarSeries(freq, shift_seconds, capacity, curr_us) for freq in freqs_seconds]
+        self.series = {series.freq_seconds: series for series in self.levels}
+        self.finest = self.levels[0]
+
+    def _get_curr_time(self):
+        curr_time = datetime.utcnow()
+        if self.timezone == 'HKT':
+            curr_time += timedelta(hours=8)
+        return curr_time
+
+    def get_klines(self, freq_seconds) -> SortedDict:
+        return self.series[freq_seconds].get_klines()
+
+    def update_trade(self, price: float, size: float, t_us: int = None):
+        if t_us is not None and t_us >= self.finest.window_end:
+            self.roll(t_us)
+        if self.is_inverse:
+            self.finest.update(price, size / price * self.size_multiplier, size)
+        else:
+            self.finest.update(price, size, size * price)
+
+    def _close_finest(self) -> dict:
+        closed = {}
+        series = self.finest
+        series.close_window()
+        for coarser in self.levels[1:]:
+            coarser.merge(*series.bars.get(-1)[1:])
+            closed[series.freq_seconds] = series
+            if series.bars.last_time() + series.freq_us < coarser.window_end:
+                break
+            coarser.close_window()
+            series = coarser
+        else:
+            closed[series.freq_seconds] = series
+        return {freq: series.bars.to_dict(-1) for freq, series in closed.items()}
+
+    def roll(self, t_us: int) -> int:
+        '''
+        Close every finest window ending at or before t_us, rolling them up. Returns the number of callbacks fired.
+        '''
+        boundaries = 0
+        while t_us >= self.finest.window_end:
+            if boundaries >= self.finest.bars.capacity:
+                for series in self.levels:
+                    series.start_window(t_us)
+                break
+            closed = self._close_finest()
+            boundaries += 1
+            if self.on_bars_closed is not None:
+                try:
+                    self.on_bars_closed(closed)
+                except Exception as e:
+                    self.logger.exception(e)
+        return boundaries
+
+    async def auto_roll(self):
+        # one timer for every timeframe
+        while True:
+            try:
+                time_diff_seconds = (self.finest.window_end - to_us(self._get_curr_time())) / 1000000
+                if time_diff_seconds > 0:
+                    await asyncio.sleep(time_diff_seconds)
+                self.roll(to_us(self._get_curr_time()))
+            except Exception as e:
+                self.logger.exception(e)
+                await asyncio.sleep(0.1)
@@ -0,0 +1,94 @@
+import asyncio
+import time
+from collections import deque
+
+
+class ConflatingQueue(asyncio.Queue):
+    '''
+    asyncio.Queue of raw md gateway messages for one symbol.
+    A queued DEPTH/TICKER message is replaced by a newer one of the same type, so a slow consumer never
+    sees stale snapshots piling up: in place when nothing was queued after it, otherwise the old one is removed and
+    the new one queued at the tail, so it is never applied before older messages. TRADES/DIFF and other messages
+    are always queued.
+    maxsize is the high-water mark: non-conflatable messages beyond it are dropped with asyncio.QueueFull, while
+    DEPTH/TICKER, at most one of each queued, are always taken so a resync depth gets through.
+    A dropped DIFF leaves the book behind, so a BOOK_GAP message is queued after it and the book waits for a depth.
+    '''
+    CONFLATED_TYPES = ('DEPTH', 'TICKER')
+    GAP_TYPE = 'BOOK_GAP'
+
+    def _init(self, maxsize):
+        self._queue = deque()  # entries of [msg, enqueue monotonic time]
+        self._latest = {}  # dataType -> queued entry which can still be replaced
+        self.dropped = 0
+        self.conflated = 0
+        self.max_depth = 0
+
+    def _put(self, item):
+        entry = [item, time.monotonic()]
+        self._queue.append(entry)
+        data_type = item.get('dataType')
+        if data_type in self.CONFLATED_TYPES:
+            self._latest[data_type] = entry
+        if len(self._queue) > self.max_depth:
+            self.max_depth = len(self._queue)
+
+    def _get(self):
+        entry = self._queue.popleft()
+        item = entry[0]
+        data_type = item.get('dataType')
+        if self._latest.get(data_type) is entry:
+            del self._latest[data_type]
+        return item
+
+    def put_nowait(self, item):
+        entry = self._latest.get(item.get('dataType')) if self._latest else None
+        if entry is not None:
+            self.conflated += 1
+            if self._queue[-1] is entry:
+                # the slot keeps its position and enqueue time
+                entry[0] = item
+                return
+            for i in range(len(self._queue) - 1, -1, -1):
+                if self._queue[i] is entry:
+                    del self._queue[i]
+                    break
+            # one entry out, one in: the queue stays non-empty and its size does not change
+            self._put(item)
+            return
+        if not self.full():
+            super().put_nowait(item)
+            return
+        data_type = item.get('dataType')
+        if data_type in self.CONFLATED_TYPES:
+            self._put_over(item)
+            return
+        self.dropped += 1
+        if data_type == 'DIFF' and self._queue[-1][0].get('dataType') != self.GAP_TYPE:
+            gap = {'dataType': self.GAP_TYPE}
+            for key in ('symbol', 'Symbol'):
+                if key in item:
+                    gap[key] = item[key]
+            self._put_over(gap)
+        raise asyncio.QueueFull
+
+    def _put_over(self, item):
+        # asyncio.Queue.put_nowait without the maxsize check
+        self._put(item)
+        self._unfinished_tasks += 1
+        self._finished.clear()
+        self._wakeup_next(self._getters)
+
+    def oldest_age_seconds(self):
+        if not self._queue:
+            return 0.
+        return time.monotonic() - self._queue[0][1]
+
+    def get_metrics(self) -> dict:
+        return {
+            'depth': len(self._queue),
+            'max_depth': self.max_depth,
+            'dropped': self.dropped,
+            'conflated': self.conflated,
+            'oldest_age_seconds': self.oldest_age_seconds()
+        }
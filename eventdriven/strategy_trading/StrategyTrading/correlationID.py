@@ -1,6 +1,8 @@
 
 
 class CorrelationID():
+    __slots__ = ('msg',)
+
     def __init__(self, msg):
         self.msg = msg
 
@@ -0,0 +1,43 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+
+class FixedPointConverter():
+    '''
+    Converts prices to integer tick counts and sizes to integer lot counts for one symbol.
+    Market data built with a converter carries ints, BaseOrderBook(fixed_point=...) runs all its book math on them
+    and TradingSession(fixed_point=True) converts back to Decimal when the order is created.
+
+    Prices/sizes off the tick/lot grid are rounded to the nearest tick/lot.
+    '''
+    def __init__(self, tick_size: Decimal, lot_size: Decimal):
+        assert tick_size > 0 and lot_size > 0
+        self.tick_size = Decimal(tick_size)
+        self.lot_size = Decimal(lot_size)
+        self._tick_float = float(tick_size)
+        self._lot_float = float(lot_size)
+
+    @classmethod
+    def from_symbol_info(cls, info: dict):
+        return cls(info['tick_size'], info['order_size_incremental'])
+
+    def to_ticks(self, price) -> int:
+        if isinstance(price, Decimal):
+            return int((price / self.tick_size).to_integral_value(rounding=ROUND_HALF_UP))
+        return round(float(price) / self._tick_float)
+
+    def to_lots(self, size) -> int:
+        if isinstance(size, Decimal):
+            return int((size / self.lot_size).to_integral_value(rounding=ROUND_HALF_UP))
+        return round(float(size) / self._lot_float)
+
+    def to_price(self, ticks: int) -> Decimal:
+        return self.tick_size * ticks
+
+    def to_size(self, lots: int) -> Decimal:
+        return self.lot_size * lots
+
+    def to_value(self, ticks: int, lots: int) -> Decimal:
+        return self.tick_size * self.lot_size * ticks * lots
+
+    def __repr__(self):
+        return "tick: {}, lot: {}".format(self.tick_size, self.lot_size)
@@ -1,22 +1,22 @@
 from strategy_trading.StrategyTrading.marketData import MarketTrade, Kline
-import pandas
+from strategy_trading.StrategyTrading.barEngine import BarSeries, to_us, from_us
+from strategy_trading.STUtils.ohlcvResampler import resample_dicts
 from datetime import datetime, timedelta
-from decimal import Decimal
-from sortedcontainers import SortedDict
 import asyncio
 import logging
 from strategy_trading.StrategyTrading.symbolHelper import SymbolHelper
 import random
-from strategy_trading.ExchangeHelper.huobiRestHelper import get_accurate_huobi_fut_klines, get_klines, get_swap_klines
+from strategy_trading.ExchangeHelper.huobiRestHelper import get_accurate_huobi_fut_klines, get_klines, get_swap_klines, sync_kline_store
+from strategy_trading.STUtils.klineStore import KlineStore
 
 
 class KlineBuilder():
-    def __init__(self, exchange, global_symbol, freq_seconds, init_klines: list, max_length: int, symbol_helper: SymbolHelper = None, shift_seconds = 0, curr_time = None, timezone = 'UTC'):
+    def __init__(self, exchange, global_symbol, freq_seconds, init_klines: list, max_length: int, symbol_helper: SymbolHelper = None, shift_seconds = 0, curr_time = None, timezone = 'UTC',
+                 kline_store: KlineStore = None):
         self.exchange = exchange
         self.global_symbol = global_symbol
         self.freq_seconds = freq_seconds
         self.shift_seconds = shift_seconds
-        self.klines = SortedDict()
         self.max_length = max_length
         self.logger = logging.getLogger("KB|{}|{}|{}|{}".format(exchange, global_symbol, freq_seconds, shift_seconds))
         self.symbol_helper = symbol_helper
@@ -26,58 +26,47 @@ class KlineBuilder():
             self.logger.warning("exchange not recognized. the volume and amount might be inaccurate")
             self.size_multiplier = float(symbol_helper.get_info(global_symbol, exchange)['size_multiplier'])
         self.timezone = timezone
-        self._reset_current_window(curr_time)
-        if init_klines:
-            self.on_klines(init_klines)
+        # bar times are epoch microseconds of the builder's timezone
+        self.series = BarSeries(freq_seconds, shift_seconds, max_length, to_us(self._get_curr_time(curr_time)))
+        # HUOBI_SPOT/HUOBI_SWAP REST klines are kept in kline_store: warm start from it and only fetch the missing bars
+        self.kline_store = kline_store if exchange in ('HUOBI_SPOT', 'HUOBI_SWAP') else None
         self.kline_adjustment_opened = False
-
         self.update_kline_sync_freq_seconds()
+        if init_klines:
+            self.on_klines(init_klines)
+        elif self.kline_store is not None and self.rest_freq_seconds is not None:
+            self.on_klines(self._get_finished_klines(self._read_stored_klines(max_length * max(1, self.freq_seconds // self.rest_freq_seconds)), curr_time),
+                           replace_curr_window=False)
 
-    def _reset_current_window(self, curr_time = None):
-        curr_time = self.get_recent_window_start(curr_time)
-        self._curr_window = {
-            "open": None,
-            "high": None,
-            "low": None,
-            "close": None,
-            "volume": 0,
-            "amount": 0,
-            "count": 0,
-            "time": curr_time
-        }
-
-    def get_recent_window_start(self, curr_time = None):
+    def _get_curr_time(self, curr_time = None):
         if curr_time is None:
             if self.timezone == 'UTC':
                 curr_time = datetime.utcnow()
             elif self.timezone == 'HKT':
                 curr_time = datetime.utcnow() + timedelta(hours=8)
-        window_start = (pandas.to_datetime(curr_time).floor("{}s".format(self.freq_seconds))).to_pydatetime() + timedelta(seconds=self.shift_seconds)
-        if window_start > curr_time:
-            window_start -= timedelta(seconds=self.freq_seconds)
-        return window_start
+        return curr_time
+
+    def _reset_current_window(self, curr_time = None):
+        self.series.start_window(to_us(self._get_curr_time(curr_time)))
+
+    @property
+    def _curr_window(self):
+        return self.series.window_to_dict()
+
+    def get_recent_window_start(self, curr_time = None):
+        return from_us(self.series.get_window_start(to_us(self._get_curr_time(curr_time))))
 
     def update_trade(self, trade: MarketTrade):
         trade_size = float(trade.size)
         trade_price = float(trade.price)
-        # append size
-        if self._curr_window['close'] is None:
-            self._curr_window['open'] = trade_price
-            self._curr_window['high'] = trade_price
-            self._curr_window['low'] = trade_price
-        else:
-            if self._curr_window['high'] < trade_price:
-                self._curr_window['high'] = trade_price
-            if self._curr_window['low'] > trade_price:
-                self._curr_window['low'] = trade_price
-        self._curr_window['close'] = trade_price
         if not self.is_inverse:
-            self._curr_window['volume'] += trade_size
-            self._curr_window['amount'] += trade_size * trade_price
+            self.series.update(trade_price, trade_size, trade_size * trade_price)
         else:
-            self._curr_window['volume'] += trade_size / trade_price * self.size_multiplier
-            self._curr_window['amount'] += trade_size
-        self._curr_window['count'] += 1
+            self.series.update(trade_price, trade_size / trade_price * self.size_multiplier, trade_size)
+
+    @property
+    def klines(self):
+        return self.series.get_klines()
 
     def get_klines(self):
         return self.klines
@@ -91,24 +80,28 @@ class KlineBuilder():
                                                                  kline['volume'],
                                                                  kline['amount'],
                                                                  kline['count']))
-    
+
     def finalize_last_window(self):
-        self.klines[self._curr_window['time']] = self._curr_window
-        self._print(self._curr_window['time'], self._curr_window)
-        while len(self.klines) > self.max_length:
-            self.klines.popitem(0)
+        self.series.store_window()
+        self._print(from_us(self.series.window_start), self.series.window_to_dict())
+
+    def _upsert_kline(self, t_us, kline: dict):
+        nan = float('nan')
+        self.series.bars.upsert(t_us,
+                                nan if kline['open'] is None else kline['open'], nan if kline['high'] is None else kline['high'],
+                                nan if kline['low'] is None else kline['low'], nan if kline['close'] is None else kline['close'],
+                                kline['volume'], kline['amount'], kline['count'])
 
     def on_klines(self, klines: list, replace_curr_window = True):
         # Here allows REST klines to adjust local klines
         for kline in klines:
-            if kline['time'] < self._curr_window['time']:
-                self.klines[kline['time']] = kline
+            t_us = to_us(kline['time'])
+            if t_us < self.series.window_start:
+                self._upsert_kline(t_us, kline)
                 self._print(kline['time'], kline)
-            elif kline['time'] == self._curr_window['time'] and replace_curr_window:
-                self._curr_window = kline
+            elif t_us == self.series.window_start and replace_curr_window:
+                self.series.set_window(kline['open'], kline['high'], kline['low'], kline['close'], kline['volume'], kline['amount'], kline['count'])
                 self._print(kline['time'], kline)
-        while len(self.klines) > self.max_length:
-            self.klines.popitem(0)
 
     def _kline_to_dict(self, kline: Kline):
         return {
@@ -130,12 +123,13 @@ class KlineBuilder():
             _time += timedelta(hours=8)
 
         # official klines should not be affecting the current kline
-        if _time < self._curr_window['time']:
-            if (_time not in self.klines and (len(self.klines) < self.max_length or _time > min(self.klines.keys()))) \
-                    or (_time in self.klines):
+        t_us = to_us(_time)
+        if t_us < self.series.window_start:
+            bars = self.series.bars
+            if len(bars) < self.max_length or t_us >= bars.first_time():
                 kline_dict = self._kline_to_dict(kline)
                 kline_dict['time'] = _time
-                self.klines[_time] = kline_dict
+                self._upsert_kline(t_us, kline_dict)
                 self._print(_time, kline_dict)
 
     async def auto_refresh_when_next_window(self, on_kline_update, adjust_by_rest_first = False):
@@ -144,7 +138,7 @@ class KlineBuilder():
             if self.timezone == 'HKT':
                 curr_time += timedelta(hours=8)
             try:
-                next_window_time = self._curr_window['time'] + timedelta(seconds=self.freq_seconds)
+                next_window_time = from_us(self.series.window_end)
                 time_diff_seconds = (next_window_time - curr_time) / timedelta(seconds=1)
                 if time_diff_seconds > 0:
                     await asyncio.sleep(time_diff_seconds)
@@ -163,14 +157,7 @@ class KlineBuilder():
                 await asyncio.sleep(0.1)
 
     def _resample(self, klines, freq_seconds, shift_seconds):
-        if freq_seconds % 60 == 0 and shift_seconds % 60 == 0:
-            raw_df = pandas.DataFrame(klines)
-            raw_df['time'] = raw_df['time'] - pandas.Timedelta('{}s'.format(shift_seconds))
-            raw_df.set_index(raw_df['time'], inplace=True)
-            df = raw_df.resample('{}s'.format(freq_seconds), how = {'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'volume': 'sum', 'amount': 'sum', 'count': 'sum'})
-            df['time'] = df.index
-            df['time'] = df['time'] + pandas.Timedelta('{}s'.format(shift_seconds))
-            return list(df.T.to_dict().values())
+        return resample_dicts(klines, freq_seconds, shift_seconds)
 
     def update_kline_sync_freq_seconds(self):
         self.rest_freq_seconds = None
@@ -197,30 +184,36 @@ class KlineBuilder():
             freq_seconds = max(able_resample_freq)
         self.rest_freq_seconds = freq_seconds
 
+    def _read_stored_klines(self, limit):
+        return self.kline_store.get_klines(self.exchange, self.symbol, self.rest_freq_seconds, limit=limit, timezone=self.timezone)
+
+    def _get_finished_klines(self, klines, curr_time = None):
+        # resample rest/stored klines to freq_seconds/shift_seconds, keeping the ones which have ended
+        curr_time = self._get_curr_time(curr_time)
+        if self.rest_freq_seconds != self.freq_seconds:
+            # sorted by time. the oldest window may miss some of its finer klines
+            klines = self._resample(klines, self.freq_seconds, self.shift_seconds)[1:]
+        # filter kline whose end_time > curr_time, e.g. the in-progress one REST returns first
+        return [kline for kline in klines if kline['time'] + timedelta(seconds=self.freq_seconds) < curr_time]
+
     async def _adjust_klines_from_rest(self):
         if self.rest_freq_seconds is None:
             return
 
         try:
-            curr_time = datetime.utcnow()
-            if self.timezone == 'HKT':
-                curr_time += timedelta(hours=8)
-            if self.exchange == 'HUOBI_SPOT':
-                klines = await get_klines(self.symbol, self.rest_freq_seconds, ret_dataframe=False, timezone=self.timezone, limit = 5 * (self.freq_seconds // self.rest_freq_seconds))
+            limit = 5 * (self.freq_seconds // self.rest_freq_seconds)
+            if self.kline_store is not None:
+                await sync_kline_store(self.kline_store, self.exchange, self.symbol, self.rest_freq_seconds)
+                klines = self._read_stored_klines(limit)
+            elif self.exchange == 'HUOBI_SPOT':
+                klines = await get_klines(self.symbol, self.rest_freq_seconds, ret_dataframe=False, timezone=self.timezone, limit = limit)
             elif self.exchange == 'HUOBI_CONTRACT':
-                klines = await get_accurate_huobi_fut_klines(self.global_symbol, self.rest_freq_seconds, ret_dataframe=False, timezone=self.timezone, limit = 5 * (self.freq_seconds // self.rest_freq_seconds))
+                klines = await get_accurate_huobi_fut_klines(self.global_symbol, self.rest_freq_seconds, ret_dataframe=False, timezone=self.timezone, limit = limit)
             elif self.exchange == 'HUOBI_SWAP':
-                klines = await get_swap_klines(self.symbol, self.rest_freq_seconds, ret_dataframe=False, timezone=self.timezone, limit=5 * (self.freq_seconds // self.rest_freq_seconds))
+                klines = await get_swap_klines(self.symbol, self.rest_freq_seconds, ret_dataframe=False, timezone=self.timezone, limit=limit)
             else:
                 return
-            if self.rest_freq_seconds != self.freq_seconds:
-                adjusted_klines = self._resample(klines, self.freq_seconds, self.shift_seconds)
-            else:
-                adjusted_klines = klines
-            adjusted_klines = adjusted_klines[1:]
-            # filter kline whose end_time > curr_time
-            adjusted_klines = [kline for kline in adjusted_klines if kline['time'] + timedelta(seconds=self.freq_seconds) < curr_time]
-            self.on_klines(adjusted_klines, replace_curr_window=False)
+            self.on_klines(self._get_finished_klines(klines), replace_curr_window=False)
             self.logger.info("kline adjusted by REST {}".format(self.rest_freq_seconds))
         except Exception as e:
             self.logger.exception(e)
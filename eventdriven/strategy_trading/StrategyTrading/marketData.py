@@ -1,13 +1,105 @@
 from strategy_trading.StrategyTrading.correlationID import CorrelationID
 from strategy_trading.StrategyTrading.order import Side
+from strategy_trading.StrategyTrading.fixedPoint import FixedPointConverter
 from decimal import Decimal
 
 
+class LazyLevels():
+    '''
+    List of [price, size] levels that keeps the raw gateway levels and converts them only when read.
+    Levels are converted from the top, so reading bids[0] of a 150-level snapshot converts one level.
+    Supports the list operations BaseOrderBook uses on its bids/asks.
+    '''
+    __slots__ = ('_levels', '_converted', '_to_price', '_to_size')
+
+    def __init__(self, raw_levels: list, to_price, to_size):
+        self._levels = raw_levels
+        self._converted = 0  # levels[:_converted] have been converted
+        self._to_price = to_price
+        self._to_size = to_size
+
+    def _convert_to(self, end):
+        levels = self._levels
+        end = min(end, len(levels))
+        if end > self._converted:
+            to_price, to_size = self._to_price, self._to_size
+            for i in range(self._converted, end):
+                raw = levels[i]
+                levels[i] = [to_price(raw[0]), to_size(raw[1])]
+            self._converted = end
+
+    def __len__(self):
+        return len(self._levels)
+
+    def __bool__(self):
+        return bool(self._levels)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            self._convert_to(len(self._levels) if index.stop is None or index.stop < 0 or (index.step or 1) < 0 else index.stop)
+        elif index < 0:
+            self._convert_to(len(self._levels))
+        else:
+            self._convert_to(index + 1)
+        return self._levels[index]
+
+    def __iter__(self):
+        i = 0
+        while i < len(self._levels):
+            if i >= self._converted:
+                self._convert_to(i + 1)
+            yield self._levels[i]
+            i += 1
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def insert(self, index, level):
+        if index >= len(self._levels):
+            self.append(level)
+            return
+        self._convert_to(index)
+        self._levels.insert(index, level)
+        if index <= self._converted:
+            self._converted += 1
+
+    def append(self, level):
+        self._convert_to(len(self._levels))
+        self._levels.append(level)
+        self._converted += 1
+
+    def pop(self, index=-1):
+        if index < 0:
+            index += len(self._levels)
+        self._convert_to(index + 1)
+        self._converted -= 1
+        return self._levels.pop(index)
+
+
+def _to_levels(levels: list, fixed_point, lazy: bool):
+    if fixed_point is None:
+        to_price, to_size = Decimal, Decimal
+    else:
+        to_price, to_size = fixed_point.to_ticks, fixed_point.to_lots
+    if lazy:
+        return LazyLevels(levels, to_price, to_size)
+    return [[to_price(level[0]), to_size(level[1])] for level in levels]
+
+
 class MarketTrade():
+    __slots__ = ('price', 'size', 'side', 'exch_timestamp', 'more_coming', 'correlation_id', 'seq_id')
+
     def __init__(self, price: Decimal, size: Decimal, side: Side, more_coming=False, exch_timestamp=None,
-                 correlation_id: CorrelationID = None, seq_id=None):
-        self.price = Decimal(price)
-        self.size = Decimal(size)
+                 correlation_id: CorrelationID = None, seq_id=None, fixed_point: FixedPointConverter = None):
+        if fixed_point is None:
+            self.price = Decimal(price)
+            self.size = Decimal(size)
+        else:
+            self.price = fixed_point.to_ticks(price)
+            self.size = fixed_point.to_lots(size)
         self.side = side
         self.exch_timestamp = exch_timestamp
         self.more_coming = more_coming
@@ -19,30 +111,57 @@ class MarketTrade():
 
 
 class OrderBookDepth():
-    def __init__(self, bids: list, asks: list, exch_timestamp=None, correlation_id: CorrelationID = None, seq_id=None):
-        self.bids = [[Decimal(b[0]), Decimal(b[1])] for b in bids]
-        self.asks = [[Decimal(a[0]), Decimal(a[1])] for a in asks]
+    __slots__ = ('bids', 'asks', 'correlation_id', 'exch_timestamp', 'seq_id')
+
+    def __init__(self, bids: list, asks: list, exch_timestamp=None, correlation_id: CorrelationID = None, seq_id=None,
+                 fixed_point: FixedPointConverter = None, lazy: bool = False):
+        self.bids = _to_levels(bids, fixed_point, lazy)
+        self.asks = _to_levels(asks, fixed_point, lazy)
         self.correlation_id = correlation_id
         self.exch_timestamp = exch_timestamp
         self.seq_id = seq_id
 
 
 class OrderBookDiff():
-    def __init__(self, bids: list, asks: list, exch_timestamp=None, correlation_id: CorrelationID = None, seq_id=None):
-        self.bids = [[Decimal(b[0]), Decimal(b[1])] for b in bids]
-        self.asks = [[Decimal(a[0]), Decimal(a[1])] for a in asks]
+    __slots__ = ('bids', 'asks', 'correlation_id', 'exch_timestamp', 'seq_id', 'prev_seq_id')
+
+    def __init__(self, bids: list, asks: list, exch_timestamp=None, correlation_id: CorrelationID = None, seq_id=None,
+                 fixed_point: FixedPointConverter = None, lazy: bool = False, prev_seq_id=None):
+        self.bids = _to_levels(bids, fixed_point, lazy)
+        self.asks = _to_levels(asks, fixed_point, lazy)
         self.correlation_id = correlation_id
         self.exch_timestamp = exch_timestamp
         self.seq_id = seq_id
+        # seq of the book update this diff applies on, when the gateway sends it
+        self.prev_seq_id = prev_seq_id
+
+
+class BookGap():
+    '''
+    book updates were dropped before they reached the book, e.g. at the md queue high-water mark.
+    the book cannot be trusted until the next depth
+    '''
+    __slots__ = ('correlation_id',)
+
+    def __init__(self, correlation_id: CorrelationID = None):
+        self.correlation_id = correlation_id
 
 
 class Ticker():
+    __slots__ = ('bid1p', 'bid1s', 'ask1p', 'ask1s', 'correlation_id', 'exch_timestamp', 'seq_id')
+
     def __init__(self, bid1p, bid1s, ask1p, ask1s, exch_timestamp=None, correlation_id: CorrelationID = None,
-                 seq_id=None):
-        self.bid1p = Decimal(bid1p)
-        self.bid1s = Decimal(bid1s)
-        self.ask1p = Decimal(ask1p)
-        self.ask1s = Decimal(ask1s)
+                 seq_id=None, fixed_point: FixedPointConverter = None):
+        if fixed_point is None:
+            self.bid1p = Decimal(bid1p)
+            self.bid1s = Decimal(bid1s)
+            self.ask1p = Decimal(ask1p)
+            self.ask1s = Decimal(ask1s)
+        else:
+            self.bid1p = fixed_point.to_ticks(bid1p)
+            self.bid1s = fixed_point.to_lots(bid1s)
+            self.ask1p = fixed_point.to_ticks(ask1p)
+            self.ask1s = fixed_point.to_lots(ask1s)
         self.correlation_id = correlation_id
         self.exch_timestamp = exch_timestamp
         self.seq_id = seq_id
@@ -52,6 +171,9 @@ class Ticker():
 
 
 class Kline():
+    __slots__ = ('freq_seconds', 'open_price', 'high', 'low', 'close_price', 'volume', 'amount', 'count',
+                 'start_timestamp', 'correlation_id', 'exch_timestamp')
+
     def __init__(self, freq_seconds, start_timestamp, open_price, high, low, close_price, volume, amount, count,
                  exch_timestamp=None, correlation_id: CorrelationID = None):
         self.freq_seconds = freq_seconds
@@ -0,0 +1,83 @@
+'''
+Measure the memory allocated per parsed market data message by MarketDataConnection._parse_msg_from_server.
+Messages are read from a recording (one json gateway message per line) or generated.
+
+    python -m strategy_trading.StrategyTrading.marketDataBenchmark [-f md_BTC_USDT.jsonl]
+
+Run it on an older revision to get the numbers before a change.
+'''
+from strategy_trading.StrategyTrading.marketDataConnection import MarketDataConnection
+from optparse import OptionParser
+import tracemalloc
+import random
+import json
+import time
+
+
+def generate_messages(n = 20000, book_level = 20, seed = 0):
+    rnd = random.Random(seed)
+    msgs = []
+    for seq in range(n):
+        common = {'symbol': 'btcusdt', 'exchTimestamp': seq, 'correlationID': "{}|{}".format(1600000000000000 + seq, seq), 'seq': seq}
+        r = rnd.random()
+        if r < 0.3:
+            msg = {'dataType': 'DEPTH',
+                   'bids': [["{:.2f}".format(10000 - i * 0.01), "{:.4f}".format(rnd.random())] for i in range(book_level)],
+                   'asks': [["{:.2f}".format(10000.01 + i * 0.01), "{:.4f}".format(rnd.random())] for i in range(book_level)]}
+        elif r < 0.6:
+            msg = {'dataType': 'DIFF',
+                   'bids': [["{:.2f}".format(10000 - rnd.randint(0, book_level) * 0.01), "{:.4f}".format(rnd.random())]],
+                   'asks': [["{:.2f}".format(10000.01 + rnd.randint(0, book_level) * 0.01), "{:.4f}".format(rnd.random())]]}
+        elif r < 0.9:
+            msg = {'dataType': 'TRADES',
+                   'trades': [{'price': "10000.00", 'size': "{:.4f}".format(rnd.random()), 'side': rnd.choice(['BUY', 'SELL'])}
+                              for _ in range(rnd.randint(1, 5))]}
+        else:
+            msg = {'dataType': 'TICKER',
+                   'ticker': {'bid1p': "10000.00", 'bid1s': "1.0000", 'ask1p': "10000.01", 'ask1s': "2.0000"}}
+        msg.update(common)
+        msgs.append(msg)
+    return msgs
+
+
+def load_messages(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def measure(msgs, lazy = False):
+    # the connection is only used for parsing here. no gateway is involved
+    md = MarketDataConnection.__new__(MarketDataConnection)
+    md.fixed_point_per_symbol = {}
+    md.lazy_symbols = set(msg['symbol'] for msg in msgs) if lazy else set()
+
+    start = time.perf_counter()
+    for msg in msgs:
+        md._parse_msg_from_server(msg)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    parsed = [md._parse_msg_from_server(msg) for msg in msgs]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    stats = after.compare_to(before, 'filename')
+    size = sum(stat.size_diff for stat in stats)
+    blocks = sum(stat.count_diff for stat in stats)
+    objs = sum(len(p) for p in parsed if p)
+    return elapsed, size, blocks, objs
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("-f", type="string", dest="file", default=None, help="recorded md gateway messages (json lines)")
+    parser.add_option("-n", type="int", dest="num", default=20000, help="synthetic messages")
+    parser.add_option("-z", dest="lazy", default=False, action="store_true", help="lazy book levels")
+    (options, args) = parser.parse_args()
+
+    msgs = load_messages(options.file) if options.file else generate_messages(options.num)
+    elapsed, size, blocks, objs = measure(msgs, options.lazy)
+    print("msgs: {}, objs: {}".format(len(msgs), objs))
+    print("parse: {:.2f}us/msg".format(elapsed / len(msgs) * 1e6))
+    print("retained: {:.1f} bytes/msg, {:.2f} blocks/msg".format(size / len(msgs), blocks / len(msgs)))
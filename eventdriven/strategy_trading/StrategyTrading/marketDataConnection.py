@@ -2,14 +2,20 @@ import logging
 from strategy_trading.STUtils.wssClient import BaseWebsocketClient
 import asyncio
 from strategy_trading.StrategyTrading.symbolHelper import SymbolHelper
-from strategy_trading.StrategyTrading.marketData import MarketTrade, OrderBookDepth, OrderBookDiff, CorrelationID, Ticker, Kline
+from strategy_trading.StrategyTrading.marketData import MarketTrade, OrderBookDepth, OrderBookDiff, CorrelationID, Ticker, Kline, BookGap
 from strategy_trading.StrategyTrading.order import Side
+from strategy_trading.StrategyTrading.fixedPoint import FixedPointConverter
+from strategy_trading.StrategyTrading.conflatingQueue import ConflatingQueue
 from datetime import datetime, timedelta
 import json
 
 
+_SIDES = {side.value: side for side in Side}
+_NON_BOOK_TYPES = ('TRADES', 'KLINE')
+
+
 class MarketDataConnection():
-    def __init__(self, exchange, server, port, symbol_helper: SymbolHelper, dma = False):
+    def __init__(self, exchange, server, port, symbol_helper: SymbolHelper, dma = False, resync_seconds: float = 1):
         self.logger = logging.getLogger("{}-{}".format(self.__class__.__name__, exchange))
         self.exchange = exchange
         self.dma = dma
@@ -28,6 +34,12 @@ class MarketDataConnection():
         self.symbol_helper = symbol_helper
         self.symbol_to_global_symbol = {}
         self.global_symbol_to_symbol = {}
+        self.fixed_point_per_symbol = {}
+        self.lazy_symbols = set()
+        # resync requests of a symbol are sent at most once per resync_seconds
+        self.resync_seconds = resync_seconds
+        self.last_resync_time = {}
+        self.pending_resync = {}  # symbol -> TimerHandle of a deferred resync
 
     async def init(self, loop, enable_kline = True):
         if not self.dma:
@@ -55,7 +67,9 @@ class MarketDataConnection():
             if symbol in self.data_q_per_symbol:
                 self.data_q_per_symbol[symbol].put_nowait(message)
         except asyncio.QueueFull:
-            self.logger.warning("message full, drop {}".format(message))
+            self.logger.warning("message full, drop {}".format(message.get('dataType')))
+            if message.get('dataType') == 'DIFF' and isinstance(self.data_q_per_symbol[symbol], ConflatingQueue):
+                self.request_resync(self.symbol_to_global_symbol[symbol])
         except Exception as e:
             self.logger.exception(e)
 
@@ -77,7 +91,8 @@ class MarketDataConnection():
         return "{}_CQ".format(info['price_ccy'])
 
     async def subscribe(self, global_symbol, want_orderbook: bool = True, book_level=None, want_trades: bool = True,
-                        want_ticker: bool = False, want_kline=False, kline_freq_seconds: list = None, want_diff: bool = True):
+                        want_ticker: bool = False, want_kline=False, kline_freq_seconds: list = None, want_diff: bool = True,
+                        fixed_point: bool = False, lazy: bool = False, conflate: bool = False, high_water_mark: int = 0):
         info = self.symbol_helper.get_info(global_symbol, self.exchange)
         if self.exchange != 'HUOBI_CONTRACT':
             symbol = info['symbol']
@@ -104,7 +119,16 @@ class MarketDataConnection():
             'klineFreq': kline_freq_seconds
         }
         self.requests.append(reqeust)
-        self.data_q_per_symbol[symbol] = asyncio.Queue()
+        if fixed_point:
+            # depth/diff/trades/ticker of this symbol are delivered in int ticks/lots
+            self.fixed_point_per_symbol[symbol] = FixedPointConverter.from_symbol_info(info)
+        if lazy:
+            # book levels are converted when read, and only the newest of the queued DEPTH snapshots is parsed
+            self.lazy_symbols.add(symbol)
+        if conflate:
+            self.data_q_per_symbol[symbol] = ConflatingQueue(high_water_mark)
+        else:
+            self.data_q_per_symbol[symbol] = asyncio.Queue(high_water_mark)
         if not self.dma:
             await self.ws.send_message([reqeust])
         else:
@@ -113,42 +137,105 @@ class MarketDataConnection():
                 'data': json.dumps(reqeust)
             })
 
+    def request_resync(self, global_symbol):
+        '''
+        Ask for a fresh DEPTH snapshot of a subscribed symbol by sending its subscription again, as done after a
+        reconnection. Meant as the on_gap callback of BaseOrderBook:
+
+            BaseOrderBook(exchange, global_symbol, on_gap=lambda book: md.request_resync(book.symbol))
+
+        A request within resync_seconds of the previous one is sent when the interval is over, not dropped.
+        '''
+        symbol = self.global_symbol_to_symbol.get(global_symbol)
+        reqeust = None
+        for _reqeust in self.requests:
+            if _reqeust['symbol'] == symbol:
+                reqeust = _reqeust
+                break
+        if reqeust is None:
+            raise ValueError('{} not subscribed yet'.format(global_symbol))
+        if symbol in self.pending_resync:
+            return
+
+        loop = asyncio.get_event_loop()
+        now = loop.time()
+        last_time = self.last_resync_time.get(symbol)
+        if last_time is not None and now - last_time < self.resync_seconds:
+            self.pending_resync[symbol] = loop.call_later(last_time + self.resync_seconds - now, self._send_resync, symbol, reqeust)
+        else:
+            self._send_resync(symbol, reqeust)
+
+    def _send_resync(self, symbol, reqeust):
+        self.pending_resync.pop(symbol, None)
+        self.last_resync_time[symbol] = asyncio.get_event_loop().time()
+        self.logger.warning("resync {}".format(symbol))
+        if not self.dma:
+            asyncio.ensure_future(self.ws.send_message([reqeust]))
+        else:
+            self.adapter.on_client_request({
+                'connection_id': 0,
+                'data': json.dumps(reqeust)
+            })
+
+    def get_queue_metrics(self, global_symbol) -> dict:
+        q = self.data_q_per_symbol[self.global_symbol_to_symbol[global_symbol]]
+        if isinstance(q, ConflatingQueue):
+            return q.get_metrics()
+        return {'depth': q.qsize()}
+
+    def get_fixed_point(self, global_symbol) -> FixedPointConverter:
+        return self.fixed_point_per_symbol.get(self.global_symbol_to_symbol[global_symbol])
+
     def _parse_msg_from_server(self, msg):
         # TODO: data format validation
+        symbol = msg['symbol'] if 'symbol' in msg else msg['Symbol']
+        fixed_point = self.fixed_point_per_symbol.get(symbol) if self.fixed_point_per_symbol else None
+        lazy = symbol in self.lazy_symbols
         if msg['dataType'] == 'DEPTH':
             depth = OrderBookDepth(bids=msg['bids'] if msg['bids'] is not None else [],
                                    asks=msg['asks'] if msg['asks'] is not None else [],
                                    exch_timestamp=msg['exchTimestamp'],
                                    correlation_id=CorrelationID(msg['correlationID']),
-                                   seq_id=msg['seq'])
+                                   seq_id=msg['seq'],
+                                   fixed_point=fixed_point,
+                                   lazy=lazy)
             return [depth]
         elif msg['dataType'] == 'DIFF':
             depth = OrderBookDiff(bids=msg['bids'] if msg['bids'] is not None else [],
                                    asks=msg['asks'] if msg['asks'] is not None else [],
                                    exch_timestamp=msg['exchTimestamp'],
                                    correlation_id=CorrelationID(msg['correlationID']),
-                                   seq_id = msg['seq'])
+                                   seq_id = msg['seq'],
+                                   fixed_point=fixed_point,
+                                   lazy=lazy,
+                                   prev_seq_id=msg.get('prevSeq'))
             return [depth]
         elif msg['dataType'] == 'TRADES':
             trades = msg['trades']
             if isinstance(trades, list):
+                # trades of one message share the same correlation id object
+                correlation_id = CorrelationID(msg['correlationID'])
+                exch_timestamp = msg['exchTimestamp']
+                seq_id = msg['seq']
                 trades = [MarketTrade(
                     price=trade['price'],
                     size=trade['size'],
-                    side=Side(trade['side']),
-                    exch_timestamp=msg['exchTimestamp'],
-                    correlation_id=CorrelationID(msg['correlationID']),
-                    seq_id=msg['seq']
+                    side=_SIDES[trade['side']],
+                    exch_timestamp=exch_timestamp,
+                    correlation_id=correlation_id,
+                    seq_id=seq_id,
+                    fixed_point=fixed_point
                 ) for trade in trades]
                 return trades
             else:
                 trade = MarketTrade(
                     price=trades['price'],
                     size=trades['size'],
-                    side=Side(trades['side']),
+                    side=_SIDES[trades['side']],
                     exch_timestamp=msg['exchTimestamp'],
                     correlation_id=CorrelationID(msg['correlation_id']),
-                    seq_id=msg['seq']
+                    seq_id=msg['seq'],
+                    fixed_point=fixed_point
                 )
                 return [trade]
         elif msg['dataType'] == 'TICKER':
@@ -159,7 +246,8 @@ class MarketDataConnection():
                 ask1s=msg['ticker']['ask1s'],
                 exch_timestamp=msg['exchTimestamp'],
                 correlation_id=CorrelationID(msg['correlationID']),
-                seq_id=msg['seq']
+                seq_id=msg['seq'],
+                fixed_point=fixed_point
             )
             return [ticker]
         elif msg['dataType'] == 'KLINE':
@@ -177,6 +265,22 @@ class MarketDataConnection():
                 correlation_id=CorrelationID(msg['correlationID'])
             )
             return [kline]
+        elif msg['dataType'] == ConflatingQueue.GAP_TYPE:
+            # diffs were dropped at the queue high-water mark, on_message already asked for a depth
+            return [BookGap()]
+
+    @staticmethod
+    def _coalesce_depths(msgs: list):
+        # a DEPTH snapshot replaces the whole book, so older book updates (depths, diffs, tickers) in the same batch
+        # are not needed. trades and klines are not part of the book and are kept
+        last_depth_i = None
+        for i in range(len(msgs) - 1, -1, -1):
+            if msgs[i]['dataType'] == 'DEPTH':
+                last_depth_i = i
+                break
+        if last_depth_i is None:
+            return msgs
+        return [msg for i, msg in enumerate(msgs) if i >= last_depth_i or msg['dataType'] in _NON_BOOK_TYPES]
 
     async def get_update(self, global_symbol, symbol):
         assert global_symbol or symbol
@@ -195,14 +299,16 @@ class MarketDataConnection():
             symbol = self.global_symbol_to_symbol[global_symbol]
 
         if symbol in self.data_q_per_symbol:
+            q = self.data_q_per_symbol[symbol]
+            msgs = [await q.get()]
+            while not q.empty():
+                msgs.append(q.get_nowait())
+            if symbol in self.lazy_symbols:
+                msgs = self._coalesce_depths(msgs)
+
             updates = []
-            _update = await self.data_q_per_symbol[symbol].get()
-            _update = self._parse_msg_from_server(_update)
-            updates += _update
-            while not self.data_q_per_symbol[symbol].empty:
-                _update = await self.data_q_per_symbol[symbol].get()
-                _update = self._parse_msg_from_server(_update)
-                updates += _update
+            for msg in msgs:
+                updates += self._parse_msg_from_server(msg)
             return updates
         raise ValueError('{} not subscribed yet'.format(symbol))
 
@@ -4,6 +4,7 @@ import logging
 from datetime import datetime
 from strategy_trading.StrategyTrading.correlationID import CorrelationID
 import asyncio
+import time
 
 
 class Side(Enum):
@@ -64,6 +65,11 @@ class ClientOrder():
         self._update_event = asyncio.Event()
         self.priority = priority
         assert priority in [0, 1]
+        # 'create'/'cancel' -> perf_counter time the request was sent, until the order_update answering it
+        self.request_sent_times = {}
+
+    def mark_request_sent(self, request: str):
+        self.request_sent_times[request] = time.perf_counter()
 
     def update_info(self, info: dict):
         for k, v in info.items():
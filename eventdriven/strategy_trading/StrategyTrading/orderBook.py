@@ -1,9 +1,14 @@
 from decimal import Decimal
+from operator import neg
+from sortedcontainers import SortedDict
+from collections import deque
 from strategy_trading.StrategyTrading.correlationID import CorrelationID
 import logging
-from strategy_trading.StrategyTrading.marketData import OrderBookDepth, OrderBookDiff, MarketTrade, Ticker, Kline
+from strategy_trading.StrategyTrading.marketData import OrderBookDepth, OrderBookDiff, MarketTrade, Ticker, Kline, BookGap
 from typing import List
 from strategy_trading.StrategyTrading.order import ClientOrder, Side
+from strategy_trading.StrategyTrading.fixedPoint import FixedPointConverter
+from strategy_trading.STUtils.bookSnapshot import TopLevelSnapshot
 from enum import Enum
 
 
@@ -14,29 +19,165 @@ class SeqType(Enum):
     MARKET_TRADE = 4
 
 
+class BookBackend(Enum):
+    LIST = 1  # plain lists of [price, size], linear scans
+    SORTED = 2  # price-keyed SortedDict, O(log n) level updates
+
+
+class _FixedPointOrder():
+    __slots__ = ('side', 'price', 'remaining_size')
+
+    def __init__(self, order: ClientOrder, fixed_point: FixedPointConverter):
+        self.side = order.side
+        self.price = fixed_point.to_ticks(order.price)
+        self.remaining_size = fixed_point.to_lots(order.remaining_size)
+
+
+def _iter_cleaned_levels(book, self_sizes: dict, levels: int):
+    count = 0
+    for level in book:
+        self_size = self_sizes.get(level[0]) if self_sizes else None
+        if self_size is None:
+            yield [level[0], level[1]]
+        elif level[1] > self_size:
+            yield [level[0], level[1] - self_size]
+        else:
+            continue
+        count += 1
+        if count >= levels:
+            return
+
+
+class CleanedLevels():
+    # list-like view of _iter_cleaned_levels, levels are computed on first access and kept
+    __slots__ = ('_levels', '_it')
+
+    def __init__(self, it):
+        self._levels = []
+        self._it = it
+
+    def _fill(self, n=None):
+        if self._it is None:
+            return
+        levels = self._levels
+        for level in self._it:
+            levels.append(level)
+            if n is not None and len(levels) >= n:
+                return
+        self._it = None
+
+    def __getitem__(self, i):
+        if isinstance(i, int) and i >= 0:
+            self._fill(i + 1)
+        else:
+            self._fill()
+        return self._levels[i]
+
+    def __len__(self):
+        self._fill()
+        return len(self._levels)
+
+    def __bool__(self):
+        self._fill(1)
+        return bool(self._levels)
+
+    def __iter__(self):
+        i = 0
+        while True:
+            self._fill(i + 1)
+            if i >= len(self._levels):
+                return
+            yield self._levels[i]
+            i += 1
+
+
 class BaseOrderBook():
-    def __init__(self, exchange, global_symbol, print_when_data: bool = True):
+    def __init__(self, exchange, global_symbol, print_when_data: bool = True, backend: BookBackend = BookBackend.LIST,
+                 fixed_point: FixedPointConverter = None, seq_step=None, on_gap=None, max_cached_diffs: int = 10000):
         self.exchange = exchange
         self.symbol = global_symbol
-        self.bids = []
-        self.asks = []
+        self.backend = backend
+        # with fixed_point, levels/trades/tickers are expected in int ticks/lots, as built by
+        # MarketDataConnection.subscribe(fixed_point=True), and sizes/prices returned by the book are ticks/lots too
+        self.fixed_point = fixed_point
+        self._zero = Decimal("0") if fixed_point is None else 0
+        if backend == BookBackend.SORTED:
+            # bids/asks are live views over the price-keyed levels, so strategies keep indexing bids[i][0]
+            self._bid_levels = SortedDict(neg)
+            self._ask_levels = SortedDict()
+            self.bids = self._bid_levels.values()
+            self.asks = self._ask_levels.values()
+        elif backend == BookBackend.LIST:
+            self.bids = []
+            self.asks = []
+        else:
+            raise ValueError('Invalid backend {}'.format(backend))
         self.correlation_id = None
 
         self.logger = logging.getLogger("{}-{}-{}".format(self.__class__.__name__, exchange, global_symbol))
         self.seq_id = None
         self.seq_type = None
         self.print_when_data = print_when_data
+        self._top_levels = {}
+
+        # a diff must apply on the latest depth/diff: its prev_seq_id has to be book_seq_id or, for feeds without
+        # prev seq, its seq_id has to be book_seq_id + seq_step. trades and tickers do not move book_seq_id.
+        # after a gap the book is stale (is_invalid() is True) and diffs are cached until the next depth,
+        # on_gap(book) is called once per gap to ask for that depth, e.g. MarketDataConnection.request_resync
+        self.seq_step = seq_step
+        self.on_gap = on_gap
+        self.book_seq_id = None
+        self.stale = False
+        self.cached_diffs = deque(maxlen=max_cached_diffs)
 
     def update_depth(self, depth: OrderBookDepth):
-        self.bids = depth.bids
-        self.asks = depth.asks
+        if self.backend == BookBackend.SORTED:
+            self._bid_levels.clear()
+            self._bid_levels.update((bid[0], bid) for bid in depth.bids)
+            self._ask_levels.clear()
+            self._ask_levels.update((ask[0], ask) for ask in depth.asks)
+        else:
+            self.bids = depth.bids
+            self.asks = depth.asks
         self.correlation_id = depth.correlation_id
 
         self.seq_id = depth.seq_id
         self.seq_type = SeqType.DEPTH
+        self.book_seq_id = depth.seq_id
 
+        if self.stale:
+            self._replay_cached_diffs(depth.seq_id)
         self.print()
 
+    def _replay_cached_diffs(self, depth_seq_id):
+        cached_diffs = self.cached_diffs
+        self.cached_diffs = deque(maxlen=cached_diffs.maxlen)
+        self.stale = False
+        self.logger.info("resync at seq {}, replay cached diffs: {}".format(depth_seq_id, len(cached_diffs)))
+        for diff in cached_diffs:
+            if depth_seq_id is not None and diff.seq_id is not None and diff.seq_id <= depth_seq_id:
+                continue
+            # a new gap marks the book stale again and caches the rest
+            self.update_diff(diff)
+
+    def _is_gap(self, diff: OrderBookDiff):
+        if self.book_seq_id is None or diff.seq_id is None:
+            return False
+        if diff.prev_seq_id is not None:
+            return diff.prev_seq_id != self.book_seq_id
+        if self.seq_step is not None:
+            return diff.seq_id != self.book_seq_id + self.seq_step
+        return False
+
+    def mark_stale(self):
+        '''
+        updates were lost before they reached the book, e.g. BookGap from MarketDataConnection, which already asked
+        for a depth. diffs are cached until it comes
+        '''
+        if not self.stale:
+            self.logger.warning("book updates dropped at {}. wait for depth".format(self.book_seq_id))
+            self.stale = True
+
     def print(self):
         if not self.print_when_data:
             return
@@ -52,18 +193,40 @@ class BaseOrderBook():
             if self.seq_id > diff.seq_id:
                 return
 
+        if self.stale:
+            self.cached_diffs.append(diff)
+            return
+        if self._is_gap(diff):
+            self.logger.warning("seq gap: book at {}, diff {} after {}. wait for depth".format(
+                self.book_seq_id, diff.seq_id, diff.prev_seq_id))
+            self.stale = True
+            self.cached_diffs.append(diff)
+            if self.on_gap is not None:
+                self.on_gap(self)
+            return
+        self.book_seq_id = diff.seq_id
+
+        if self.backend == BookBackend.SORTED:
+            self._update_levels_sorted(self._bid_levels, diff.bids)
+            self._update_levels_sorted(self._ask_levels, diff.asks)
+            self.correlation_id = diff.correlation_id
+            self.seq_id = diff.seq_id
+            self.seq_type = SeqType.DIFF
+            self.print()
+            return
+
         for bid in diff.bids:
             b_find = False
             for i in range(len(self.bids)):
                 localbid = self.bids[i]
                 if bid[0] > localbid[0]:
                     # new bid
-                    if bid[1] > Decimal("0"):
+                    if bid[1] > 0:
                         self.bids.insert(i, bid)
                     b_find = True
                     break
                 elif bid[0] == localbid[0]:
-                    if bid[1] > Decimal("0"):
+                    if bid[1] > 0:
                         # update size
                         localbid[1] = bid[1]
                     else:
@@ -71,7 +234,7 @@ class BaseOrderBook():
                         self.bids.pop(i)
                     b_find = True
                     break
-            if not b_find and bid[1] > Decimal("0"):
+            if not b_find and bid[1] > 0:
                 # new bid
                 self.bids.append(bid)
 
@@ -81,12 +244,12 @@ class BaseOrderBook():
                 localask = self.asks[i]
                 if ask[0] < localask[0]:
                     # new bid
-                    if ask[1] > Decimal("0"):
+                    if ask[1] > 0:
                         self.asks.insert(i, ask)
                     b_find = True
                     break
                 elif ask[0] == localask[0]:
-                    if ask[1] > Decimal("0"):
+                    if ask[1] > 0:
                         # update size
                         localask[1] = ask[1]
                     else:
@@ -94,7 +257,7 @@ class BaseOrderBook():
                         self.asks.pop(i)
                     b_find = True
                     break
-            if not b_find and ask[1] > Decimal("0"):
+            if not b_find and ask[1] > 0:
                 # new bid
                 self.asks.append(ask)
 
@@ -103,7 +266,60 @@ class BaseOrderBook():
         self.seq_type = SeqType.DIFF
         self.print()
 
+    @staticmethod
+    def _update_levels_sorted(levels: SortedDict, updates: list):
+        for level in updates:
+            if level[1] > 0:
+                local_level = levels.get(level[0])
+                if local_level is None:
+                    levels[level[0]] = level
+                else:
+                    local_level[1] = level[1]
+            else:
+                levels.pop(level[0], None)
+
+    def _apply_market_trade_sorted(self, side: Side, price, size):
+        if side == Side.BUY:
+            levels = self._ask_levels
+            # asks below the trade price have been taken out
+            while levels and levels.peekitem(0)[0] < price:
+                levels.popitem(0)
+        elif side == Side.SELL:
+            levels = self._bid_levels
+            while levels and levels.peekitem(0)[0] > price:
+                levels.popitem(0)
+        else:
+            return
+
+        level = levels.get(price)
+        if level is not None:
+            level[1] -= min(size, level[1])
+            if level[1] <= 0:
+                levels.pop(price)
+
+    def _apply_ticker_sorted(self, ticker: Ticker):
+        asks = self._ask_levels
+        while asks and asks.peekitem(0)[0] < ticker.ask1p:
+            asks.popitem(0)
+        ask = asks.get(ticker.ask1p)
+        if ask is not None:
+            ask[1] = ticker.ask1s
+        else:
+            asks[ticker.ask1p] = [ticker.ask1p, ticker.ask1s]
+
+        bids = self._bid_levels
+        while bids and bids.peekitem(0)[0] > ticker.bid1p:
+            bids.popitem(0)
+        bid = bids.get(ticker.bid1p)
+        if bid is not None:
+            bid[1] = ticker.bid1s
+        else:
+            bids[ticker.bid1p] = [ticker.bid1p, ticker.bid1s]
+
     def is_invalid(self):
+        if self.stale:
+            return True
+
         if not self.bids or not self.asks:
             return True
 
@@ -112,55 +328,41 @@ class BaseOrderBook():
 
         return False
 
+    def get_top_levels(self, levels: int) -> TopLevelSnapshot:
+        # numpy columns of the top levels, refreshed in place for the levels changed since the last call
+        if levels not in self._top_levels:
+            self._top_levels[levels] = TopLevelSnapshot(levels)
+        return self._top_levels[levels].refresh(self.bids, self.asks)
+
     def get_mid_price(self):
         return (self.bids[0][0] + self.asks[0][0]) / Decimal("2")
 
-    def get_cleaned_book(self, self_orders: List[ClientOrder], levels: int):
-        self_orders = self_orders[:]
-
-        bids = []
-        bid_len = 0
-        for bid in self.bids:
-            # find self volume
-            self_volume = Decimal("0")
-            to_remove_orders = []
-            for order in self_orders:
-                if order.side == Side.BUY and order.price == bid[0]:
-                    self_volume += order.remaining_size
-                    to_remove_orders.append(order)
-
-            for order in to_remove_orders:
-                self_orders.remove(order)
-
-            if bid[1] > self_volume:
-                other_vol = bid[1] - self_volume
-                bids.append([bid[0], other_vol])
-                bid_len += 1
-                if bid_len >= levels:
-                    break
-
-        asks = []
-        ask_len = 0
-        for ask in self.asks:
-            # find self volume
-            self_volume = Decimal("0")
-            to_remove_orders = []
-            for order in self_orders:
-                if order.side == Side.SELL and order.price == ask[0]:
-                    self_volume += order.remaining_size
-                    to_remove_orders.append(order)
-
-            for order in to_remove_orders:
-                self_orders.remove(order)
-
-            if ask[1] > self_volume:
-                other_vol = ask[1] - self_volume
-                asks.append([ask[0], other_vol])
-                ask_len += 1
-                if ask_len >= levels:
-                    break
-
-        return bids, asks
+    def _get_self_sizes(self, self_orders) -> dict:
+        # side -> price -> our remaining size, in the book's units
+        self_sizes = {Side.BUY: {}, Side.SELL: {}}
+        if isinstance(self_orders, dict):
+            self_orders = self_orders.values()
+        if self.fixed_point is not None:
+            # orders are kept in Decimal. bring them to the book's ticks/lots
+            self_orders = (_FixedPointOrder(order, self.fixed_point) for order in self_orders)
+        for order in self_orders:
+            at_side = self_sizes.get(order.side)
+            if at_side is not None:
+                at_side[order.price] = at_side.get(order.price, self._zero) + order.remaining_size
+        return self_sizes
+
+    def get_cleaned_book(self, self_orders: List[ClientOrder], levels: int, lazy: bool = False):
+        '''
+        Top levels of the book without our own resting size; levels left with nothing are skipped.
+        self_orders can be a list of orders or a dict of them, e.g. TradingSession.get_active_orders().
+        With lazy, bids and asks are CleanedLevels computing the levels as they are read, valid until the book is updated.
+        '''
+        self_sizes = self._get_self_sizes(self_orders)
+        bids = _iter_cleaned_levels(self.bids, self_sizes[Side.BUY], levels)
+        asks = _iter_cleaned_levels(self.asks, self_sizes[Side.SELL], levels)
+        if lazy:
+            return CleanedLevels(bids), CleanedLevels(asks)
+        return list(bids), list(asks)
 
     def apply_market_trade(self, market_trade: MarketTrade):
         if self.seq_id is not None and market_trade.seq_id is not None:
@@ -172,7 +374,9 @@ class BaseOrderBook():
 
                 if self.print_when_data:
                     self.logger.debug("adjust resv({}) by trade {:.10f}@{:.8f}".format(side, price, size))
-                if side == Side.BUY:
+                if self.backend == BookBackend.SORTED:
+                    self._apply_market_trade_sorted(side, price, size)
+                elif side == Side.BUY:
                     to_remove_asks = []
                     for ask_i in range(len(self.asks)):
                         ask = self.asks[ask_i]
@@ -181,10 +385,10 @@ class BaseOrderBook():
                         elif ask[0] == price:
                             drop_vol = min(size, ask[1])
                             ask[1] -= drop_vol
-                            if ask[1] <= Decimal("0"):
+                            if ask[1] <= 0:
                                 to_remove_asks.append(ask_i)
                             size -= drop_vol
-                            if size <= Decimal("0"):
+                            if size <= 0:
                                 break
                         else:
                             break
@@ -200,10 +404,10 @@ class BaseOrderBook():
                         elif bid[0] == price:
                             drop_vol = min(size, bid[1])
                             bid[1] -= drop_vol
-                            if bid[1] <= Decimal("0"):
+                            if bid[1] <= 0:
                                 to_remove_bids.append(bid_i)
                             size -= drop_vol
-                            if size <= Decimal("0"):
+                            if size <= 0:
                                 break
                         else:
                             break
@@ -223,6 +427,14 @@ class BaseOrderBook():
 
                 if self.print_when_data:
                     self.logger.info("adjust by ticker {}".format(ticker))
+                if self.backend == BookBackend.SORTED:
+                    self._apply_ticker_sorted(ticker)
+                    self.correlation_id = ticker.correlation_id
+                    self.seq_id = ticker.seq_id
+                    self.seq_type = SeqType.TICKER
+                    self.print()
+                    return
+
                 to_remove_asks = []
                 ask_applied = False
                 for ask_i in range(len(self.asks)):
@@ -282,6 +494,8 @@ class BaseOrderBook():
                 self.update_depth(_update)
             elif isinstance(_update, Kline):
                 klines.append(_update)
+            elif isinstance(_update, BookGap):
+                self.mark_stale()
             else:
                 self.logger.warning("Unrecognized type {}".format(type(_update)))
         return trades, klines
@@ -294,7 +508,7 @@ class BaseOrderBook():
         else:
             raise ValueError('Invalid side {}'.format(side))
 
-        cumu_size = Decimal("0")
+        cumu_size = self._zero
         price = None
         for level in book:
             find_size = min(level[1], size - cumu_size)
@@ -312,8 +526,10 @@ class BaseOrderBook():
         else:
             raise ValueError('Invalid side {}'.format(side))
 
-        cumu_value = Decimal("0")
-        cumu_size = Decimal("0")
+        if self.fixed_point is not None:
+            return self._get_taking_ticks_lots_by_value(book, value)
+        cumu_value = self._zero
+        cumu_size = self._zero
         price = None
         for level in book:
             find_size = min(level[1] * level[0], value - cumu_value)
@@ -322,4 +538,73 @@ class BaseOrderBook():
             if cumu_value >= value:
                 return level[0], cumu_size
             price = level[0]
-        return price, cumu_size
\ No newline at end of file
+        return price, cumu_size
+
+    def _get_taking_ticks_lots_by_value(self, book, value):
+        # value is in quote currency as without fixed point. it is floored to tick * lot units so the walk stays in
+        # ints and returns (ticks, whole lots) affordable with it
+        fixed_point = self.fixed_point
+        value = int(Decimal(value) / (fixed_point.tick_size * fixed_point.lot_size))
+        cumu_value = 0
+        cumu_size = 0
+        price = None
+        for level in book:
+            lots = min(level[1], (value - cumu_value) // level[0])
+            cumu_size += lots
+            cumu_value += lots * level[0]
+            if lots < level[1]:
+                return level[0], cumu_size
+            price = level[0]
+        return price, cumu_size
+
+
+if __name__ == '__main__':
+    # seq gap handling: gap, cached diffs, replay on the next depth, and a depth that leaves a gap again
+    for backend in BookBackend:
+        gaps = []
+        book = BaseOrderBook('TEST', 'SPOT-BTC/USDT', print_when_data=False, backend=backend, on_gap=lambda b: gaps.append(b.book_seq_id))
+        book.update_depth(OrderBookDepth([[100, 1], [99, 2]], [[101, 1], [102, 2]], seq_id=10))
+        book.update_diff(OrderBookDiff([[100, 3]], [], seq_id=11, prev_seq_id=10))
+        assert not book.is_invalid() and book.bids[0][1] == 3
+
+        # 12 is missed
+        book.update_diff(OrderBookDiff([[100, 5]], [], seq_id=13, prev_seq_id=12))
+        book.update_diff(OrderBookDiff([[99, 7]], [[101, 0]], seq_id=14, prev_seq_id=13))
+        book.update_diff(OrderBookDiff([[98, 1]], [], seq_id=15, prev_seq_id=14))
+        assert book.stale and book.is_invalid() and gaps == [11] and len(book.cached_diffs) == 3
+
+        # a depth at 11 cannot be followed by 13: stale again, the diffs after it stay cached
+        book.update_depth(OrderBookDepth([[100, 3], [99, 2]], [[101, 1], [102, 2]], seq_id=11))
+        assert book.stale and gaps == [11, 11] and len(book.cached_diffs) == 3
+
+        # a depth at 13 replays 14 and 15, 13 is dropped
+        book.update_depth(OrderBookDepth([[100, 4], [99, 2]], [[101, 1], [102, 2]], seq_id=13))
+        assert not book.stale and not book.is_invalid() and book.book_seq_id == 15 and not book.cached_diffs
+        assert [list(bid) for bid in book.bids] == [[100, 4], [99, 7], [98, 1]]
+        assert [list(ask) for ask in book.asks] == [[102, 2]]
+
+        # without prev seq, seq_step checks consecutive diffs
+        book = BaseOrderBook('TEST', 'SPOT-BTC/USDT', print_when_data=False, backend=backend, seq_step=1)
+        book.update_depth(OrderBookDepth([[100, 1]], [[101, 1]], seq_id=1))
+        book.update_diff(OrderBookDiff([[100, 2]], [], seq_id=2))
+        assert not book.stale
+        book.update_diff(OrderBookDiff([[100, 4]], [], seq_id=4))
+        assert book.stale
+        book.update_depth(OrderBookDepth([[100, 3]], [[101, 1]], seq_id=3))
+        assert not book.stale and book.book_seq_id == 4 and book.bids[0][1] == 4
+        print("{}: gap, cache, replay and re-gap ok".format(backend.name))
+
+        # taking by value: Decimal levels, and int ticks/lots of the same book with the value still in quote currency
+        book = BaseOrderBook('TEST', 'SPOT-BTC/USDT', print_when_data=False, backend=backend)
+        book.update_depth(OrderBookDepth([[Decimal('100'), Decimal('1')]], [[Decimal('101'), Decimal('1')], [Decimal('102'), Decimal('2')]]))
+        assert book.get_taking_price_size_by_value(Side.BUY, Decimal('203')) == (Decimal('102'), Decimal('2'))
+        fixed_point = FixedPointConverter(Decimal('0.5'), Decimal('0.01'))
+        book = BaseOrderBook('TEST', 'SPOT-BTC/USDT', print_when_data=False, backend=backend, fixed_point=fixed_point)
+        book.update_depth(OrderBookDepth([[100, 1]], [[101, 1], [102, 2]], fixed_point=fixed_point))
+        assert book.bids[0][0] == 200 and book.asks[0][1] == 100
+        price, lots = book.get_taking_price_size_by_value(Side.BUY, Decimal('203'))
+        assert (price, lots) == (204, 200) and fixed_point.to_size(lots) == Decimal('2')
+        # 51.9 left after the 100 lots at 101 buys 50 whole lots at 102
+        assert book.get_taking_price_size_by_value(Side.BUY, Decimal('152.9')) == (204, 150)
+        assert book.get_taking_price_size_by_value(Side.SELL, Decimal('1000')) == (200, 100)
+        print("{}: taking by value ok".format(backend.name))
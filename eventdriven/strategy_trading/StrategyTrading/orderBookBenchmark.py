@@ -0,0 +1,90 @@
+'''
+Replay recorded market data gateway messages (one json message per line, as received by
+MarketDataConnection.on_message) against the order book backends and compare the time spent.
+
+    python -m strategy_trading.StrategyTrading.orderBookBenchmark -f md_BTC_USDT.jsonl
+
+Without -f, a synthetic 400-level book with random diffs is generated.
+'''
+from strategy_trading.StrategyTrading.marketData import OrderBookDepth, OrderBookDiff
+from strategy_trading.StrategyTrading.orderBook import BaseOrderBook, BookBackend
+from optparse import OptionParser
+from decimal import Decimal
+import random
+import json
+import time
+
+
+def load_recorded_updates(path):
+    updates = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            msg = json.loads(line)
+            if msg.get('dataType') == 'DEPTH':
+                _cls = OrderBookDepth
+            elif msg.get('dataType') == 'DIFF':
+                _cls = OrderBookDiff
+            else:
+                continue
+            updates.append((_cls, msg['bids'] or [], msg['asks'] or [], msg['seq']))
+    return updates
+
+
+def generate_updates(levels = 400, diffs = 20000, levels_per_diff = 20, seed = 0):
+    rnd = random.Random(seed)
+    mid = 100000
+    bids = [[str(Decimal(mid - i - 1) / 10), str(rnd.randint(1, 1000))] for i in range(levels)]
+    asks = [[str(Decimal(mid + i + 1) / 10), str(rnd.randint(1, 1000))] for i in range(levels)]
+    updates = [(OrderBookDepth, bids, asks, 0)]
+    for seq in range(1, diffs + 1):
+        diff_bids = []
+        diff_asks = []
+        for _ in range(levels_per_diff):
+            size = str(rnd.randint(0, 1000)) if rnd.random() > 0.3 else "0"
+            offset = rnd.randint(1, levels)
+            if rnd.random() > 0.5:
+                diff_bids.append([str(Decimal(mid - offset) / 10), size])
+            else:
+                diff_asks.append([str(Decimal(mid + offset) / 10), size])
+        updates.append((OrderBookDiff, diff_bids, diff_asks, seq))
+    return updates
+
+
+def replay(backend: BookBackend, updates):
+    # md objects are built outside of the timed section since the book mutates the levels in place
+    md_objs = [_cls(bids=bids, asks=asks, seq_id=seq) for _cls, bids, asks, seq in updates]
+    book = BaseOrderBook('BENCH', 'BENCH', print_when_data=False, backend=backend)
+    start = time.perf_counter()
+    for md_obj in md_objs:
+        if isinstance(md_obj, OrderBookDiff):
+            book.update_diff(md_obj)
+        else:
+            book.update_depth(md_obj)
+    return time.perf_counter() - start, book
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("-f", type="string", dest="file", default=None, help="recorded md gateway messages (json lines)")
+    parser.add_option("-l", type="int", dest="levels", default=400, help="synthetic book levels")
+    parser.add_option("-n", type="int", dest="diffs", default=20000, help="synthetic diffs")
+    (options, args) = parser.parse_args()
+
+    if options.file:
+        updates = load_recorded_updates(options.file)
+    else:
+        updates = generate_updates(levels=options.levels, diffs=options.diffs)
+
+    results = {}
+    for backend in BookBackend:
+        elapsed, book = replay(backend, updates)
+        results[backend] = book
+        print("{:<8} {:>10.3f}s {:>8.2f}us/msg".format(backend.name, elapsed, elapsed / len(updates) * 1e6))
+
+    list_book = results[BookBackend.LIST]
+    sorted_book = results[BookBackend.SORTED]
+    assert list(list_book.bids) == list(sorted_book.bids) and list(list_book.asks) == list(sorted_book.asks), \
+        "backends diverged"
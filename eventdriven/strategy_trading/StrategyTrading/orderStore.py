@@ -0,0 +1,156 @@
+from strategy_trading.StrategyTrading.order import ClientOrder, Side, State
+from datetime import datetime
+import heapq
+
+
+class OrderStore(dict):
+    '''
+    strategy_order_id -> ClientOrder, indexed by (side, price) and by state.
+    It is still a dict so strategies can keep using active_orders.values()/items() as before.
+    The state index follows order.state only when reindex_state() is called after the order is updated.
+    '''
+    def __init__(self):
+        super().__init__()
+        self._by_side_price = {Side.BUY: {}, Side.SELL: {}}  # side -> price -> {strategy_order_id: order}
+        self._by_state = {}  # state -> {strategy_order_id: order}
+        self._indexed_state = {}  # strategy_order_id -> state it is indexed under
+
+    def __setitem__(self, strategy_order_id, order: ClientOrder):
+        if strategy_order_id in self:
+            self._unindex(strategy_order_id)
+        super().__setitem__(strategy_order_id, order)
+        self._index(strategy_order_id, order)
+
+    def __delitem__(self, strategy_order_id):
+        order = self[strategy_order_id]
+        super().__delitem__(strategy_order_id)
+        self._unindex(strategy_order_id, order)
+
+    _missing = object()
+
+    def pop(self, strategy_order_id, default = _missing):
+        if strategy_order_id in self:
+            order = super().pop(strategy_order_id)
+            self._unindex(strategy_order_id, order)
+            return order
+        if default is self._missing:
+            raise KeyError(strategy_order_id)
+        return default
+
+    def popitem(self):
+        strategy_order_id, order = super().popitem()
+        self._unindex(strategy_order_id, order)
+        return strategy_order_id, order
+
+    def setdefault(self, strategy_order_id, order = None):
+        if strategy_order_id not in self:
+            self[strategy_order_id] = order
+        return self[strategy_order_id]
+
+    def update(self, *args, **kwargs):
+        for strategy_order_id, order in dict(*args, **kwargs).items():
+            self[strategy_order_id] = order
+
+    def clear(self):
+        super().clear()
+        self._by_side_price = {Side.BUY: {}, Side.SELL: {}}
+        self._by_state = {}
+        self._indexed_state = {}
+
+    def _index(self, strategy_order_id, order: ClientOrder):
+        self._by_side_price[order.side].setdefault(order.price, {})[strategy_order_id] = order
+        self._by_state.setdefault(order.state, {})[strategy_order_id] = order
+        self._indexed_state[strategy_order_id] = order.state
+
+    def _unindex(self, strategy_order_id, order: ClientOrder = None):
+        if order is None:
+            order = self[strategy_order_id]
+        at_price = self._by_side_price[order.side].get(order.price)
+        if at_price is not None:
+            at_price.pop(strategy_order_id, None)
+            if not at_price:
+                del self._by_side_price[order.side][order.price]
+        state = self._indexed_state.pop(strategy_order_id, None)
+        in_state = self._by_state.get(state)
+        if in_state is not None:
+            in_state.pop(strategy_order_id, None)
+            if not in_state:
+                del self._by_state[state]
+
+    def reindex_state(self, order: ClientOrder):
+        strategy_order_id = order.strategy_order_id
+        state = self._indexed_state.get(strategy_order_id)
+        if strategy_order_id not in self or state == order.state:
+            return
+        in_state = self._by_state[state]
+        in_state.pop(strategy_order_id)
+        if not in_state:
+            del self._by_state[state]
+        self._by_state.setdefault(order.state, {})[strategy_order_id] = order
+        self._indexed_state[strategy_order_id] = order.state
+
+    def get_orders(self, side: Side, price = None) -> list:
+        # orders of side at price, or of all prices of side when price is None
+        if price is not None:
+            return list(self._by_side_price[side].get(price, {}).values())
+        return [order for at_price in self._by_side_price[side].values() for order in at_price.values()]
+
+    def get_prices(self, side: Side) -> list:
+        return list(self._by_side_price[side])
+
+    def has_order_at(self, side: Side, price) -> bool:
+        return price in self._by_side_price[side]
+
+    def get_orders_by_state(self, state: State) -> list:
+        return list(self._by_state.get(state, {}).values())
+
+    def count_by_state(self, state: State) -> int:
+        return len(self._by_state.get(state, ()))
+
+
+class ClosedOrderStore(OrderStore):
+    '''
+    OrderStore of closed orders with a heap on last_update_time, so expiring old orders only touches the expired ones.
+    An order updated after it was pushed is pushed again with its new time when it reaches the top.
+    '''
+    def __init__(self):
+        super().__init__()
+        self._expiry = []  # (last_update_time, push seq, strategy_order_id)
+        self._seq = 0
+        self._latest_seq = {}  # strategy_order_id -> seq of its live heap entry. older entries are skipped
+
+    def __setitem__(self, strategy_order_id, order: ClientOrder):
+        super().__setitem__(strategy_order_id, order)
+        self._push(strategy_order_id, order)
+
+    def _unindex(self, strategy_order_id, order: ClientOrder = None):
+        super()._unindex(strategy_order_id, order)
+        self._latest_seq.pop(strategy_order_id, None)
+
+    def clear(self):
+        super().clear()
+        self._expiry = []
+        self._latest_seq = {}
+
+    def _push(self, strategy_order_id, order: ClientOrder):
+        self._seq += 1
+        self._latest_seq[strategy_order_id] = self._seq
+        heapq.heappush(self._expiry, (order.last_update_time, self._seq, strategy_order_id))
+
+    def expire(self, before: datetime) -> list:
+        '''
+        Remove orders whose last_update_time is earlier than before. Returns their strategy_order_ids.
+        '''
+        expired = []
+        while self._expiry and self._expiry[0][0] < before:
+            _, seq, strategy_order_id = heapq.heappop(self._expiry)
+            if self._latest_seq.get(strategy_order_id) != seq:
+                # left the store already, e.g. became active again, or pushed again later
+                continue
+            order = self[strategy_order_id]
+            if order.last_update_time >= before:
+                self._push(strategy_order_id, order)
+                continue
+            self.pop(strategy_order_id)
+            expired.append(strategy_order_id)
+        return expired
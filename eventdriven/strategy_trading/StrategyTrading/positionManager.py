@@ -3,6 +3,7 @@ from strategy_trading.StrategyTrading.symbolHelper import SymbolHelper
 from decimal import Decimal
 from strategy_trading.StrategyTrading.order import Side, Offset
 import logging
+from strategy_trading.STUtils.eventLog import EventLogger
 from strategy_trading.StrategyTrading.inventoryManager import InventoryManager, HuobiContractInventoryManager
 from strategy_trading.StrategyTrading.errors import LocalPositionInvalid
 from typing import List, Dict
@@ -42,6 +43,7 @@ class SigSybPM():
             self.inventory_manager.bind_position_manager(self)
 
         self.logger = logging.getLogger("{}-{}-{}{}".format(self.__class__.__name__, self.exchange, self.global_symbol, "-" + alias if isinstance(alias, str) else ""))
+        self.event_log = EventLogger(self.logger.name)
 
     def _open_new_position(self, price, size, side: Side):
         if self.position != Decimal("0"):
@@ -132,8 +134,9 @@ class SigSybPM():
         else:
             self.turnover += size
 
-        entry_price = None if self.entry_price is None else "{:.10f}".format(self.entry_price)
-        self.logger.info("EXEC {} {:.10f}@{:.8f}. Position: {:.4f}. RPnL: {:.4f}, TV: {:.4f}, ROT: {:.4f}%, EP: {}, Hit: {:.4f}%".format(side.name, price, size, self.position, self.realized_pnl, self.turnover, self.realized_pnl / self.turnover * 100, entry_price, self.hit_rate * 100))
+        if self.event_log.sample('exec'):
+            self.event_log.log('exec', side=side, price=price, size=size, pos=self.position, rpnl=self.realized_pnl, tv=self.turnover,
+                               rot=self.realized_pnl / self.turnover * 100, ep=self.entry_price, hit=self.hit_rate * 100)
 
         if self.inventory_manager is not None and affect_inventory:
             if open_size > Decimal("0"):
@@ -299,9 +302,10 @@ class SigSybPMOS(SigSybPM):
             self._close_position(price, size, side)
 
         self.turnover += size
-        long_entry_price = None if self.entry_long_price is None else "{:.5f}".format(self.entry_long_price)
-        short_entry_price = None if self.entry_short_price is None else "{:.5f}".format(self.entry_short_price)
-        self.logger.info("EXEC {}/{} {:.5f}@{:.0f}. LongPos: {:.0f}. ShortPos: {:.0f}. RPnL: {:.4f}, TV: {:.4f}, ROT: {:.4f}%. LP: {}, SP: {}, Hit: {:.4f}%".format(side.name, offset.name, price, size, self.long_position, self.short_position, self.realized_pnl, self.turnover, self.realized_pnl / self.turnover * 100, long_entry_price, short_entry_price, self.hit_rate * 100))
+        if self.event_log.sample('exec'):
+            self.event_log.log('exec', side=side, offset=offset, price=price, size=size, long_pos=self.long_position, short_pos=self.short_position,
+                               rpnl=self.realized_pnl, tv=self.turnover, rot=self.realized_pnl / self.turnover * 100,
+                               lp=self.entry_long_price, sp=self.entry_short_price, hit=self.hit_rate * 100)
 
         if self.inventory_manager is not None and affect_inventory:
             self.inventory_manager.update_exec(self.global_symbol, side, price, size, offset = offset)
@@ -1,10 +1,15 @@
 from strategy_trading.STUtils.wssClient import BaseWebsocketClient
+from strategy_trading.STUtils.latencyHistogram import LatencyHistogram
+from strategy_trading.STUtils.eventLog import EventLogger
 from strategy_trading.StrategyTrading.symbolHelper import SymbolHelper
 from strategy_trading.StrategyTrading.order import ClientOrder, Side, State, Offset
+from strategy_trading.StrategyTrading.orderStore import OrderStore, ClosedOrderStore
 from strategy_trading.StrategyTrading.correlationID import CorrelationID
 from strategy_trading.StrategyTrading.exchStates import ExchangeState
+from strategy_trading.StrategyTrading.fixedPoint import FixedPointConverter
 import logging
 import asyncio
+import time
 from decimal import Decimal, ROUND_UP, ROUND_DOWN
 from uuid import uuid4
 from datetime import datetime, timedelta
@@ -17,8 +22,11 @@ INTERVAL_BETWEEN_TWO_CANCEL_CLOSING = 1
 
 
 class TradingSession():
-    def __init__(self, exchange, global_symbol, session_id, trading_connection, symbol_helper: SymbolHelper, callback_when_exec = None, receive_error = False, alias = None):
+    def __init__(self, exchange, global_symbol, session_id, trading_connection, symbol_helper: SymbolHelper, callback_when_exec = None, receive_error = False, alias = None,
+                 fixed_point: bool = False):
         self.logger = logging.getLogger("{}|{}|{}{}".format("TS", exchange, global_symbol, "|{}".format(alias) if alias is not None else ""))
+        # order lifecycle events (new_order/cancel_order/closed) go to the same logger as json lines
+        self.event_log = EventLogger(self.logger.name)
         self.alias = alias
         self.exchange = exchange
         self.global_symbol = global_symbol
@@ -33,8 +41,8 @@ class TradingSession():
         else:
             assert callable(callback_when_exec)
 
-        self.active_orders = {}
-        self.inactive_orders = {}
+        self.active_orders = OrderStore()
+        self.inactive_orders = ClosedOrderStore()
         self.cloid_to_orders = {}
         self.receive_error = receive_error
         if receive_error:
@@ -53,11 +61,18 @@ class TradingSession():
             self.min_order_value = Decimal("0")
         self.size_incremental = symbol_info['order_size_incremental']
         self.price_precision = symbol_info['price_precision']
+        # with fixed_point, int prices/sizes given to create_order/bulk_create_orders/replace_orders are ticks/lots,
+        # as in fixed-point market data. otherwise only Decimal is accepted
+        self.fixed_point = FixedPointConverter(self.tick_size, self.size_incremental) if fixed_point else None
         self.interval_between_two_cancel = INTERVAL_BETWEEN_TWO_CANCEL
+        # round trip from request sent to the first order_update of the order
+        self.create_rtt = LatencyHistogram("create_rtt|{}".format(global_symbol))
+        self.cancel_rtt = LatencyHistogram("cancel_rtt|{}".format(global_symbol))
 
     async def create_order(self, side: Side, price: Decimal, size: Decimal,
                  order_type:str = 'GTC', correlation_id: CorrelationID = None, remark = None, offset: Offset = None, margin_trade = None, priority = 1):
         # TODO: risk checking + normalize price and size
+        price, size = self._from_fixed_point(price, size)
 
         size = size.quantize(self.size_incremental, rounding=ROUND_DOWN)
         if side == Side.BUY:
@@ -97,84 +112,137 @@ class TradingSession():
                             )
         self.active_orders[order.strategy_order_id] = order
         await self.trading_connection._create_order(order)
-        self.logger.info("new order: side: {}, {:.10f}@{:.8f} sid: {} corrID:{} rem:{}".format(side.name, price, size, order.strategy_order_id, correlation_id, remark))
+        self.event_log.event('new_order', sid=order.strategy_order_id, side=side, price=price, size=size, corr=correlation_id, rem=remark)
         return order
 
+    def _from_fixed_point(self, price, size):
+        # orders are always kept in Decimal
+        if self.fixed_point is not None:
+            if isinstance(price, int):
+                price = self.fixed_point.to_price(price)
+            if isinstance(size, int):
+                size = self.fixed_point.to_size(size)
+        if not isinstance(price, Decimal) or not isinstance(size, Decimal):
+            raise TypeError("price and size should be Decimal{}, not {!r}@{!r}".format(
+                " or int ticks/lots" if self.fixed_point is not None else "", size, price))
+        return price, size
+
+    def _build_order_from_info(self, order_info: dict, correlation_id: CorrelationID = None):
+        # validate and quantize one order of bulk_create_orders/replace_orders. None if the order is dropped
+        size = order_info['size']
+        side = order_info['side']
+        price = order_info['price']
+        order_type = order_info.get('orderType', 'GTC')
+        remark = order_info.get('remark', None)
+        offset = order_info.get('offset', None)
+        margin_trade = order_info.get('marginTrade', None)
+        priority = order_info.get('priority', 0)
+        price, size = self._from_fixed_point(price, size)
+        size = size.quantize(self.size_incremental, rounding=ROUND_DOWN)
+        if side == Side.BUY:
+            price = price.quantize(self.tick_size, rounding=ROUND_DOWN)
+        elif side == Side.SELL:
+            price = price.quantize(self.tick_size, rounding=ROUND_UP)
+
+        if size < self.min_order_size or (not self.size_is_value and price * size < self.min_order_value):
+            self.logger.warning("too small order size. drop. side: {}, {:.8f}@{:.8f}".format(side.name, price, size))
+            self._order_update_event.set()
+            return
+
+        if self.exchange in ['HUOBI_CONTRACT', 'HUOBI_SWAP'] and offset is None:
+            self.logger.warning("offset should not be None. drop. side: {}, {:.8f}@{:.8f}".format(side.name, price, size))
+            self._order_update_event.set()
+            return
+
+        if margin_trade is not None and margin_trade not in ['cross-margin', "margin"]:
+            self.logger.warning("margin_trade should be None/cross-margin, not {}".format(margin_trade))
+            self._order_update_event.set()
+            return
+
+        return ClientOrder(exchange = self.exchange,
+                           global_symbol = self.global_symbol,
+                           symbol = self.symbol,
+                           strategy_order_id= str(uuid4()),
+                           side = side,
+                           price = price,
+                           size = size,
+                           trading_session=self,
+                           order_type = order_type,
+                           correlation_id = correlation_id,
+                           remark = remark,
+                           offset = offset,
+                           margin_trade = margin_trade,
+                           priority = priority
+                           )
+
     async def bulk_create_orders(self, order_infos: List[dict], correlation_id: CorrelationID = None):
         # TODO: risk checking + normalize price and size
         orders = []
         for order_info in order_infos:
-            size = order_info['size']
-            side = order_info['side']
-            price = order_info['price']
-            order_type = order_info.get('orderType', 'GTC')
-            remark = order_info.get('remark', None)
-            offset = order_info.get('offset', None)
-            margin_trade = order_info.get('marginTrade', None)
-            priority = order_info.get('priority', 0)
-            size = size.quantize(self.size_incremental, rounding=ROUND_DOWN)
-            if side == Side.BUY:
-                price = price.quantize(self.tick_size, rounding=ROUND_DOWN)
-            elif side == Side.SELL:
-                price = price.quantize(self.tick_size, rounding=ROUND_UP)
-
-            if size < self.min_order_size or (not self.size_is_value and price * size < self.min_order_value):
-                self.logger.warning("too small order size. drop. side: {}, {:.8f}@{:.8f}".format(side.name, price, size))
-                self._order_update_event.set()
-                continue
-
-            if self.exchange in ['HUOBI_CONTRACT', 'HUOBI_SWAP'] and offset is None:
-                self.logger.warning("offset should not be None. drop. side: {}, {:.8f}@{:.8f}".format(side.name, price, size))
-                self._order_update_event.set()
-                continue
-
-            if margin_trade is not None and margin_trade not in ['cross-margin', "margin"]:
-                self.logger.warning("margin_trade should be None/cross-margin, not {}".format(margin_trade))
-                self._order_update_event.set()
-                continue
-
-            order = ClientOrder(exchange = self.exchange,
-                                global_symbol = self.global_symbol,
-                                symbol = self.symbol,
-                                strategy_order_id= str(uuid4()),
-                                side = side,
-                                price = price,
-                                size = size,
-                                trading_session=self,
-                                order_type = order_type,
-                                correlation_id = correlation_id,
-                                remark = remark,
-                                offset = offset,
-                                margin_trade = margin_trade,
-                                priority = priority
-                                )
-            orders.append(order)
+            order = self._build_order_from_info(order_info, correlation_id)
+            if order is not None:
+                orders.append(order)
 
         if orders:
             for order in orders:
                 self.active_orders[order.strategy_order_id] = order
-                self.logger.info("new order: side: {}, {:.10f}@{:.8f} sid: {} corrID:{} rem:{} bk".format(order.side.name, order.price, order.size, order.strategy_order_id, correlation_id, order.remark))
+                self.event_log.event('new_order', sid=order.strategy_order_id, side=order.side, price=order.price, size=order.size, corr=correlation_id, rem=order.remark, via='bk')
             await self.trading_connection._bulk_create_orders(orders)
             return orders
 
-    async def cancel_order(self, strategy_order_id, correlation_id: CorrelationID = None, priority = 0):
+    def _get_order_to_cancel(self, strategy_order_id, current_timestamp):
+        # the active order if a cancel can be sent for it now. marks it as cancel sent
         if strategy_order_id in self.active_orders:
             order = self.active_orders[strategy_order_id]
             if order.order_type == 'IOC':
                 self.logger.warning("cancel order {} is IOC. ignore cancel".format(strategy_order_id))
                 return
 
-            current_timestamp = datetime.now().timestamp()
             if order.last_cancel_timestamp is None or (order.state != State.CLOSING and order.last_cancel_timestamp < current_timestamp - self.interval_between_two_cancel) \
                     or (order.state == State.CLOSING and order.last_cancel_timestamp < current_timestamp - INTERVAL_BETWEEN_TWO_CANCEL_CLOSING):
                 order.last_cancel_timestamp = current_timestamp
-                await self.trading_connection._cancel_order(order, correlation_id, priority = priority)
-                self.logger.info("cancel order {}".format(order.strategy_order_id))
+                return order
             else:
                 self.logger.warning("cancel order {}|{} just sent at {}. wait a moment".format(order.strategy_order_id, order.state, order.last_cancel_timestamp))
         else:
             self.logger.warning("order {} is not active. ignore cancel".format(strategy_order_id))
 
+    async def cancel_order(self, strategy_order_id, correlation_id: CorrelationID = None, priority = 0):
+        order = self._get_order_to_cancel(strategy_order_id, datetime.now().timestamp())
+        if order is not None:
+            await self.trading_connection._cancel_order(order, correlation_id, priority = priority)
+            self.event_log.event('cancel_order', sid=order.strategy_order_id)
+
+    async def replace_orders(self, strategy_order_ids: List[str], order_infos: List[dict], correlation_id: CorrelationID = None, priority = 0):
+        '''
+        Cancel strategy_order_ids and create order_infos (same format as bulk_create_orders) in one pass.
+        The cancels and the creates are written to the gateway together, cancels first.
+        Returns the created orders.
+        '''
+        current_timestamp = datetime.now().timestamp()
+        to_cancel_orders = []
+        for strategy_order_id in strategy_order_ids:
+            order = self._get_order_to_cancel(strategy_order_id, current_timestamp)
+            if order is not None:
+                to_cancel_orders.append(order)
+
+        to_create_orders = []
+        for order_info in order_infos:
+            order = self._build_order_from_info(order_info, correlation_id)
+            if order is not None:
+                to_create_orders.append(order)
+
+        if not to_cancel_orders and not to_create_orders:
+            return []
+        for order in to_create_orders:
+            self.active_orders[order.strategy_order_id] = order
+        await self.trading_connection._replace_orders(to_cancel_orders, to_create_orders, correlation_id, priority = priority)
+        for order in to_cancel_orders:
+            self.event_log.event('cancel_order', sid=order.strategy_order_id, via='rp')
+        for order in to_create_orders:
+            self.event_log.event('new_order', sid=order.strategy_order_id, side=order.side, price=order.price, size=order.size, corr=correlation_id, rem=order.remark, via='rp')
+        return to_create_orders
+
     async def bulk_cancel_orders(self, strategy_order_ids: List[str], correlation_id: CorrelationID = None, priority = 0):
         to_cancel_orders = []
         current_timestamp = datetime.now().timestamp()
@@ -196,7 +264,7 @@ class TradingSession():
 
         if to_cancel_orders:
             for order in to_cancel_orders:
-                self.logger.info("cancel order {} bk".format(order.strategy_order_id))
+                self.event_log.event('cancel_order', sid=order.strategy_order_id, via='bk')
             await self.trading_connection._bulk_cancel_orders(to_cancel_orders, correlation_id, priority = priority)
 
     def get_liquidation_order(self, data):
@@ -232,6 +300,9 @@ class TradingSession():
     def get_active_orders(self):
         return self.active_orders
 
+    def get_active_orders_at(self, side: Side, price = None) -> List[ClientOrder]:
+        return self.active_orders.get_orders(side, price)
+
     async def wait_for_order_update_event(self):
         await self._order_update_event.wait()
         self._order_update_event.clear()
@@ -258,21 +329,42 @@ class TradingSession():
                         'offset': order.offset
                     }
 
+    def _record_rtt(self, order: ClientOrder, info: dict):
+        # called before the update is applied: the first update of a pending order answers the create, an update
+        # moving the order to closing/closed answers the cancel
+        sent_times = order.request_sent_times
+        if not sent_times:
+            return
+        now = time.perf_counter()
+        if 'create' in sent_times and order.state == State.PENDING:
+            self.create_rtt.add(now - sent_times.pop('create'))
+        if 'cancel' in sent_times and info.get('state') in (State.CLOSING, State.CLOSED, State.INTERNAL_CLOSED):
+            self.cancel_rtt.add(now - sent_times.pop('cancel'))
+        if info.get('state') in (State.CLOSED, State.INTERNAL_CLOSED):
+            # nothing will answer the rest
+            sent_times.clear()
+
     def _update_order_info(self, strategy_order_id, info):
         if strategy_order_id in self.active_orders:
             order = self.active_orders[strategy_order_id]
+            self._record_rtt(order, info)
             order_exec_update = self._get_order_exec(order, info)
             order.update_info(info)
             if order.is_closed():
                 self.inactive_orders[strategy_order_id] = self.active_orders.pop(strategy_order_id)
-                self.logger.info("order {}@{}-{} is closed".format(strategy_order_id, order.symbol, order.side))
+                self.event_log.event('closed', sid=strategy_order_id, symbol=order.symbol, side=order.side)
+            else:
+                self.active_orders.reindex_state(order)
         elif strategy_order_id in self.inactive_orders:
             order = self.inactive_orders[strategy_order_id]
+            self._record_rtt(order, info)
             order_exec_update = self._get_order_exec(order, info)
             order.update_info(info)
             if not order.is_closed():
                 self.logger.warning("order {} state becomes from inactive to active".format(strategy_order_id))
                 self.active_orders[strategy_order_id] = self.inactive_orders.pop(strategy_order_id)
+            else:
+                self.inactive_orders.reindex_state(order)
         else:
             self.logger.warning("cannot find order {} locally".format(strategy_order_id))
             return
@@ -311,8 +403,11 @@ class TradingConnection():
     Usually this class is used to communicate with trading gateways or market data gateways
     One connection sets up one ws channel to one server
     '''
-    def __init__(self, exchange, server, port, strategy, process, symbol_helper: SymbolHelper, receive_error = False, callback_when_exch_state = None):
+    def __init__(self, exchange, server, port, strategy, process, symbol_helper: SymbolHelper, receive_error = False, callback_when_exch_state = None,
+                 batch_sends = False):
         self.logger = logging.getLogger("{}-{}".format(self.__class__.__name__, exchange))
+        # e.g. event_log.set_sampling('recv', max_per_second=100) to rate limit the received message log
+        self.event_log = EventLogger(self.logger.name)
         self.exchange = exchange
         self.server = server
         self.port = port
@@ -330,6 +425,9 @@ class TradingConnection():
         self.callback_when_exch_state = callback_when_exch_state
         if callback_when_exch_state is not None:
             assert callable(callback_when_exch_state)
+        # with batch_sends, order requests are queued and all requests made within one event loop turn
+        # (e.g. a strategy looping over cancels and creates) are written together on the next turn
+        self.batch_sends = batch_sends
 
     def on_message(self, message):
         # TODO parse message, if it's order_update, update the info to the corresponding order
@@ -338,7 +436,10 @@ class TradingConnection():
             self.logger.warning("message {} is not dict. ignore".format(message))
             return
 
-        self.logger.info("receive msg {}".format(message))
+        if self.event_log.sample('recv'):
+            # data values are converted in place below and the record may be formatted later in the handler thread
+            data = message.get('data')
+            self.event_log.log('recv', msg=dict(message, data=dict(data)) if isinstance(data, dict) else message)
         if 'message_type' in message:
             mtype = message['message_type']
             if mtype in ['order_update', 'liquidation']:
@@ -400,14 +501,15 @@ class TradingConnection():
         asyncio.ensure_future(self.ws.receive_data(), loop = loop)
         asyncio.ensure_future(self.clean_orders(), loop=loop)
 
-    def get_session(self, global_symbol, callback_when_exec = None, alias = None) -> TradingSession:
+    def get_session(self, global_symbol, callback_when_exec = None, alias = None, fixed_point: bool = False) -> TradingSession:
         self.logger.info("created session {} for {} ".format(self.session_next_id, global_symbol))
         session = TradingSession(self.exchange, global_symbol, self.session_next_id,
                                  self,
                                  receive_error=self.receive_error,
                                  symbol_helper = self.symbol_helper,
                                  callback_when_exec = callback_when_exec,
-                                 alias = alias)
+                                 alias = alias,
+                                 fixed_point = fixed_point)
         return self.update_session(session)
 
     def update_session(self, session):
@@ -415,20 +517,47 @@ class TradingConnection():
         self.session_next_id += 1
         return session
 
-    def get_liquidation_session(self, global_symbol, callback_when_exec = None, alias = None) -> TradingSession:
+    def get_liquidation_session(self, global_symbol, callback_when_exec = None, alias = None, fixed_point: bool = False) -> TradingSession:
         self.logger.info("created liquidation session {} for {} ".format(self.session_next_id, global_symbol))
         session = TradingSession(self.exchange, global_symbol, self.session_next_id,
                                  self,
                                  receive_error=self.receive_error,
                                  symbol_helper = self.symbol_helper,
                                  callback_when_exec = callback_when_exec,
-                                 alias = alias)
+                                 alias = alias,
+                                 fixed_point = fixed_point)
         info = self.symbol_helper.get_info(global_symbol, self.exchange)
         exchange_symbol = info['symbol']
         self.liq_sessions.update({exchange_symbol.lower(): session})
         return self.update_session(session)
 
+    async def _send(self, messages: list):
+        if self.batch_sends:
+            self.ws.send_message_nowait(messages, on_error=self._on_send_failure)
+        else:
+            await self.ws.send_message(messages)
+
+    def _on_send_failure(self, messages: list, e: Exception):
+        # batched requests that never reached the gateway: created orders are closed locally, cancels can be sent again
+        for message in messages:
+            infos = message['data'] if isinstance(message['data'], list) else [message['data']]
+            for info in infos:
+                session = self.sessions.get(info['session_id'])
+                order = session._get_order(info['strategy_order_id']) if session is not None else None
+                if order is None:
+                    continue
+                if message['message_type'] == 'create_order':
+                    order.request_sent_times.pop('create', None)
+                    self.logger.warning("create order {} not sent: {}. close it".format(order.strategy_order_id, e))
+                    session._update_order_info(order.strategy_order_id, {'state': State.INTERNAL_CLOSED})
+                else:
+                    order.request_sent_times.pop('cancel', None)
+                    self.logger.warning("cancel order {} not sent: {}".format(order.strategy_order_id, e))
+                    order.last_cancel_timestamp = None
+                    session._order_update_event.set()
+
     def _get_create_order_msg(self, order: ClientOrder):
+        order.mark_request_sent('create')
         return {
                     "symbol": order.symbol,
                     "side": order.side.name,
@@ -448,7 +577,7 @@ class TradingConnection():
 
     async def _create_order(self, order: ClientOrder):
         # send to trading gateway
-        await self.ws.send_message([
+        await self._send([
             {
                 'message_type': "create_order",
                 "data": self._get_create_order_msg(order)
@@ -460,7 +589,7 @@ class TradingConnection():
         for order in orders:
             order_infos.append(self._get_create_order_msg(order))
 
-        await self.ws.send_message([
+        await self._send([
             {
                 'message_type': "create_order",
                 "data": order_infos
@@ -468,6 +597,7 @@ class TradingConnection():
         ])
 
     def _get_cancel_order_msg(self, order: ClientOrder, correlation_id, priority):
+        order.mark_request_sent('cancel')
         return {
                     "symbol": order.symbol,
                     "strategy_order_id": order.strategy_order_id,
@@ -477,7 +607,7 @@ class TradingConnection():
                 }
 
     async def _cancel_order(self, order: ClientOrder, correlation_id: CorrelationID = None, priority = 0):
-        await self.ws.send_message([
+        await self._send([
             {
                 "message_type": "cancel_order",
                 "data": self._get_cancel_order_msg(order, correlation_id, priority)
@@ -488,26 +618,36 @@ class TradingConnection():
         order_infos = []
         for order in orders:
             order_infos.append(self._get_cancel_order_msg(order, correlation_id, priority))
-        await self.ws.send_message([
+        await self._send([
             {
                 "message_type": "cancel_order",
                 "data": order_infos
             }
         ])
 
+    async def _replace_orders(self, cancel_orders: List[ClientOrder], create_orders: List[ClientOrder], correlation_id: CorrelationID = None, priority = 0):
+        # the gateway takes one message_type per message, so cancels and creates are two bulk messages sent in one call
+        messages = []
+        if cancel_orders:
+            messages.append({
+                "message_type": "cancel_order",
+                "data": [self._get_cancel_order_msg(order, correlation_id, priority) for order in cancel_orders]
+            })
+        if create_orders:
+            messages.append({
+                'message_type': "create_order",
+                "data": [self._get_create_order_msg(order) for order in create_orders]
+            })
+        await self._send(messages)
+
     async def clean_orders(self, interval_seconds = 18 * 60):
         assert interval_seconds >= 360
         while True:
             await asyncio.sleep(interval_seconds)
 
             for session_id in self.sessions:
-                dead_order_ids = []
-                for strategy_order_id, order in self.sessions[session_id].inactive_orders.items():
-                    if order.last_update_time < datetime.now() - timedelta(seconds=interval_seconds):
-                        dead_order_ids.append(strategy_order_id)
-
+                dead_order_ids = self.sessions[session_id].inactive_orders.expire(datetime.now() - timedelta(seconds=interval_seconds))
                 for strategy_order_id in dead_order_ids:
-                    self.sessions[session_id].inactive_orders.pop(strategy_order_id)
                     self.logger.info("clean order {}".format(strategy_order_id))
 
     def handle_liquidation_order(self, data):
@@ -127,7 +127,7 @@ class StrategyTradingHelper:
         handler.setFormatter(formatter)
         root.addHandler(handler)
 
-    async def connect_to_trading_gateway(self, loop, gateway_name, strategy, process, receive_error = False, callback_when_exch_state = None) -> TradingConnection:
+    async def connect_to_trading_gateway(self, loop, gateway_name, strategy, process, receive_error = False, callback_when_exch_state = None, batch_sends = False) -> TradingConnection:
         assert "tradingGateway" in self.config, "tradingGateway not config-ed"
         assert gateway_name in self.config['tradingGateway'], "trading gateway for {} not config-ed".format(gateway_name)
         config = self.config['tradingGateway'][gateway_name]
@@ -146,11 +146,12 @@ class StrategyTradingHelper:
                                        process = process,
                                        symbol_helper = self.symbol_helper,
                                        receive_error = receive_error,
-                                       callback_when_exch_state = callback_when_exch_state)
+                                       callback_when_exch_state = callback_when_exch_state,
+                                       batch_sends = batch_sends)
         await connection.init(loop)
         return connection
 
-    async def connect_to_local_trading_gateway_by_account(self, loop, exchange, account, strategy, process, receive_error = False, callback_when_exch_state = None) -> TradingConnection:
+    async def connect_to_local_trading_gateway_by_account(self, loop, exchange, account, strategy, process, receive_error = False, callback_when_exch_state = None, batch_sends = False) -> TradingConnection:
         port = get_oms_port(exchange = exchange, account=account)
 
         if self.symbol_helper is None:
@@ -163,7 +164,8 @@ class StrategyTradingHelper:
                                        process = process,
                                        symbol_helper = self.symbol_helper,
                                        receive_error = receive_error,
-                                       callback_when_exch_state = callback_when_exch_state)
+                                       callback_when_exch_state = callback_when_exch_state,
+                                       batch_sends = batch_sends)
         await connection.init(loop)
         return connection
 
@@ -6,6 +6,7 @@ from collections import deque
 
 from strategy_trading.easy_strategy.data_type import Side
 from strategy_trading.easy_strategy.instrument_manager import Instrument
+from strategy_trading.STUtils.bookSnapshot import TopLevelSnapshot
 
 
 class FullLevelOrderBook(object):
@@ -20,6 +21,7 @@ class FullLevelOrderBook(object):
         self.has_been_initialized = False
         self.is_ready = False
         self.last_update_by_diff = False
+        self._top_levels = {}
 
     def on_full_snapshot(self, bids, asks, exchange_timestamp, connectivity_timestamp, exchange_sequence: Optional[int]=None):
         if self.has_been_initialized and exchange_sequence and exchange_sequence <= self.exchange_sequence:
@@ -100,6 +102,11 @@ class FullLevelOrderBook(object):
     def asks(self, level=None):
         return self._asks.values() if not level else self._asks.values()[0:level]
 
+    def top_levels(self, level: int) -> TopLevelSnapshot:
+        if level not in self._top_levels:
+            self._top_levels[level] = TopLevelSnapshot(level)
+        return self._top_levels[level].refresh(self._bids.values(), self._asks.values())
+
 
 class FixedLevelOrderBook(object):
     def __init__(self, instrument: Instrument, level: int):